@@ -3,18 +3,31 @@
 AsciiDoc Reader
 ===============
 
-This plugin allows you to use AsciiDoc to write your posts. 
+This plugin allows you to use AsciiDoc to write your posts.
 File extension should be ``.asc``, ``.adoc``, or ``asciidoc``.
 """
 
+import codecs
+import hashlib
+import io
+import json
+import marshal
+import multiprocessing
+import os
+import re
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
 from pelican.readers import BaseReader
-from pelican.utils import pelican_open
 from pelican import signals
 import six
 
 try:
     # asciidocapi won't import on Py3
-    from .asciidocapi import AsciiDocAPI, AsciiDocError
+    from .asciidocapi import AsciiDocAPI, AsciiDocError, Options
     # AsciiDocAPI class checks for asciidoc.py
     AsciiDocAPI()
 except:
@@ -22,6 +35,210 @@ except:
 else:
     asciidoc_enabled = True
 
+CACHE_VERSION = 2
+
+INCLUDE = re.compile(br'^include1?::(\S+?)\[', re.M)
+
+
+def module_code(cmd):
+    """The code of asciidoc.py, compiled once to reset the module with"""
+    with open(cmd, 'rb') as f:
+        if cmd.endswith('.pyc'):
+            # skip the magic number and the timestamp
+            f.seek(8)
+            return marshal.load(f)
+        # do not inherit the __future__ imports of this module
+        return compile(f.read(), cmd, 'exec', 0, True)
+
+
+class AsciiDocEngine(object):
+    """The asciidoc module, located, imported and compiled once per process,
+    converting documents one after the other"""
+
+    def __init__(self, options, backend):
+        self.config = (options, backend)
+        api = AsciiDocAPI()
+        self.cmd = api.cmd
+        self.asciidoc = api.asciidoc
+        self.code = module_code(self.cmd)
+        self.options = Options()
+        for o in options:
+            self.options(*o.split())
+        self.options('--backend', backend)
+
+    def reset(self):
+        """asciidoc keeps the state of a document in module globals, start
+        again from fresh ones as AsciiDocAPI does by reloading the module"""
+        exec(self.code, self.asciidoc.__dict__)
+
+    def convert(self, text):
+        """The HTML and the attributes of a document, given as UTF-8"""
+        self.reset()
+        content = StringIO()
+        opts = Options(self.options.values)
+        opts('--out-file', content)
+        try:
+            try:
+                self.asciidoc.execute(self.cmd, opts.values, [StringIO(text)])
+            finally:
+                messages = self.asciidoc.messages[:]
+        except SystemExit as e:
+            if e.code:
+                raise AsciiDocError(messages[-1])
+
+        attributes = {}
+        for name, value in self.asciidoc.document.attributes.items():
+            if value is None:
+                continue
+            attributes[name.lower()] = six.text_type(value)
+        return {'content': content.getvalue().decode('utf8'),
+                'attributes': attributes}
+
+
+_engine = None
+
+
+def get_engine(options, backend):
+    global _engine
+    if _engine is None or _engine.config != (options, backend):
+        _engine = AsciiDocEngine(options, backend)
+    return _engine
+
+
+def init_worker(options, backend):
+    get_engine(options, backend)
+
+
+def convert_file(source_path, options, backend):
+    return get_engine(options, backend).convert(read_source(source_path))
+
+
+def read_source(source_path):
+    """The UTF-8 text of a document, without the BOM pelican_open drops"""
+    with open(source_path, 'rb') as f:
+        text = f.read()
+    if text.startswith(codecs.BOM_UTF8):
+        text = text[len(codecs.BOM_UTF8):]
+    return text
+
+
+def hash_includes(digest, text, seen=None):
+    """Add the files included by a document to digest; the document is
+    given to asciidoc on its standard input, so it looks for them from the
+    current directory"""
+    seen = set() if seen is None else seen
+    for target in INCLUDE.findall(text):
+        if target in seen:
+            continue
+        seen.add(target)
+        digest.update(target + b'\0')
+        try:
+            with open(target, 'rb') as f:
+                included = f.read()
+        except (IOError, OSError):
+            digest.update(b'missing\0')
+            continue
+        digest.update(hashlib.sha1(included).digest())
+        hash_includes(digest, included, seen)
+
+
+class AsciiDocConverter(object):
+    """Converts AsciiDoc files, from the cache, with the engine of the
+    Pelican process or with a pool of worker processes started as soon as
+    the generators start reading"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        options = settings.get('ASCIIDOC_OPTIONS', [])
+        self.options = AsciiDocReader.default_options + list(options)
+        self.backend = settings.get('ASCIIDOC_BACKEND',
+                                    AsciiDocReader.default_backend)
+
+        self.cache_path = None
+        if settings.get('ASCIIDOC_CACHE', True):
+            self.cache_path = os.path.join(settings['CACHE_PATH'],
+                                           'asciidoc_reader')
+        # the documents also depend on the options and on the backend
+        self.version = hashlib.sha1(json.dumps(
+            [CACHE_VERSION, self.backend, self.options]).encode('utf-8'))
+
+        self.workers = settings.get('ASCIIDOC_WORKERS', 0)
+        self.pool = None
+        self.pending = {}
+
+    def key(self, text):
+        digest = self.version.copy()
+        digest.update(text)
+        hash_includes(digest, text)
+        return digest.hexdigest()
+
+    def cached(self, key):
+        if self.cache_path:
+            try:
+                with io.open(os.path.join(self.cache_path, key + '.json'),
+                             encoding='utf-8') as f:
+                    return json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+        return None
+
+    def store(self, key, document):
+        if not self.cache_path:
+            return
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        path = os.path.join(self.cache_path, key + '.json')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(json.dumps(document).encode('utf-8'))
+        os.rename(path + '.tmp', path)
+
+    def convert(self, source_path):
+        text = read_source(source_path)
+        key = self.key(text)
+        document = self.cached(key)
+        if document is not None:
+            return document
+        pending = self.pending.pop(source_path, None)
+        if pending is not None:
+            document = pending.get()
+        else:
+            engine = get_engine(self.options, self.backend)
+            document = engine.convert(text)
+        self.store(key, document)
+        return document
+
+    def prefetch(self, filenames):
+        """Start converting the files that are not in the cache"""
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.workers, init_worker, (self.options, self.backend))
+        for filename in filenames:
+            if filename in self.pending:
+                continue
+            if self.cached(self.key(read_source(filename))) is not None:
+                continue
+            self.pending[filename] = self.pool.apply_async(
+                convert_file, (filename, self.options, self.backend))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+
+
+_converter = None
+
+
+def get_converter(settings):
+    global _converter
+    if _converter is not None and _converter.settings is not settings:
+        _converter.close()
+        _converter = None
+    if _converter is None:
+        _converter = AsciiDocConverter(settings)
+    return _converter
 
 
 class AsciiDocReader(BaseReader):
@@ -34,34 +251,45 @@ class AsciiDocReader(BaseReader):
 
     def read(self, source_path):
         """Parse content and metadata of asciidoc files"""
-        from cStringIO import StringIO
-        with pelican_open(source_path) as source:
-            text = StringIO(source.encode('utf8'))
-        content = StringIO()
-        ad = AsciiDocAPI()
-
-        options = self.settings.get('ASCIIDOC_OPTIONS', [])
-        options = self.default_options + options
-        for o in options:
-            ad.options(*o.split())
-
-        backend = self.settings.get('ASCIIDOC_BACKEND', self.default_backend)
-        ad.execute(text, content, backend=backend)
-        content = content.getvalue().decode('utf8')
+        document = get_converter(self.settings).convert(source_path)
 
         metadata = {}
-        for name, value in ad.asciidoc.document.attributes.items():
-            if value is None:
-                continue
-            name = name.lower()
-            metadata[name] = self.process_metadata(name, six.text_type(value))
+        for name, value in document['attributes'].items():
+            metadata[name] = self.process_metadata(name, value)
         if 'doctitle' in metadata:
             metadata['title'] = metadata['doctitle']
-        return content, metadata
+        return document['content'], metadata
 
 def add_reader(readers):
     for ext in AsciiDocReader.file_extensions:
         readers.reader_classes[ext] = AsciiDocReader
 
+def prefetch(generator, paths, excludes):
+    if not asciidoc_enabled:
+        return
+    converter = get_converter(generator.settings)
+    if converter.workers <= 0:
+        return
+    files = generator.get_files(generator.settings[paths],
+                                exclude=generator.settings[excludes],
+                                extensions=AsciiDocReader.file_extensions)
+    converter.prefetch([os.path.abspath(os.path.join(generator.path, f))
+                        for f in files])
+
+def prefetch_articles(generator):
+    prefetch(generator, 'ARTICLE_PATHS', 'ARTICLE_EXCLUDES')
+
+def prefetch_pages(generator):
+    prefetch(generator, 'PAGE_PATHS', 'PAGE_EXCLUDES')
+
+def close_converter(pelican):
+    global _converter
+    if _converter is not None:
+        _converter.close()
+        _converter = None
+
 def register():
     signals.readers_init.connect(add_reader)
+    signals.article_generator_init.connect(prefetch_articles)
+    signals.page_generator_init.connect(prefetch_pages)
+    signals.finalized.connect(close_converter)
@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 
 import datetime
 import os
+import shutil
+import tempfile
 
 from pelican.readers import Readers
 from pelican.tests.support import unittest, get_settings
@@ -16,6 +18,7 @@ CONTENT_PATH = os.path.join(CUR_DIR, 'test_data')
 class AsciiDocReaderTest(unittest.TestCase):
     def read_file(self, path, **kwargs):
         # Isolate from future API changes to readers.read_file
+        kwargs.setdefault('ASCIIDOC_CACHE', False)
         r = Readers(settings=get_settings(**kwargs))
         return r.read_file(base_path=CONTENT_PATH, path=path)
 
@@ -62,6 +65,20 @@ class AsciiDocReaderTest(unittest.TestCase):
                     '</div>\n</div>\n</div>\n')
         self.assertEqual(page.content, expected)
 
+    def test_article_from_cache(self):
+        # a second read of an unchanged file comes from ASCIIDOC_CACHE
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+        first = self.read_file(path='article_with_asc_extension.asc',
+                               ASCIIDOC_CACHE=True, CACHE_PATH=cache_path)
+        cached = os.listdir(os.path.join(cache_path, 'asciidoc_reader'))
+        self.assertEqual(len(cached), 1)
+        second = self.read_file(path='article_with_asc_extension.asc',
+                                ASCIIDOC_CACHE=True, CACHE_PATH=cache_path)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first.metadata['title'], second.metadata['title'])
+        self.assertEqual(first.metadata['date'], second.metadata['date'])
+
 
 if __name__ == '__main__':
     unittest.main()
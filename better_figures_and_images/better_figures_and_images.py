@@ -15,102 +15,211 @@ TODO: Need to add a test.py for this plugin.
 
 from __future__ import unicode_literals
 from os import path, access, R_OK
+import json
 import os
+import xml.etree.ElementTree as ElementTree
 
 from pelican import signals
 
 from bs4 import BeautifulSoup
 from PIL import Image
-import pysvg.parser
 
 import logging
 logger = logging.getLogger(__name__)
 
-def content_object_init(instance):
-
-    if instance._content is not None:
-        content = instance._content
-        soup = BeautifulSoup(content, 'html.parser')
-
-        for img in soup(['img', 'object']):
-            logger.debug('Better Fig. PATH: %s', instance.settings['PATH'])
-            if img.name == 'img':
-                logger.debug('Better Fig. img.src: %s', img['src'])
-                img_path, img_filename = path.split(img['src'])
-            else:
-                logger.debug('Better Fig. img.data: %s', img['data'])
-                img_path, img_filename = path.split(img['data'])
-            logger.debug('Better Fig. img_path: %s', img_path)
-            logger.debug('Better Fig. img_fname: %s', img_filename)
-
-            # Strip off {filename}, |filename| or /static
-            if img_path.startswith(('{filename}', '|filename|')):
-                img_path = img_path[10:]
-            elif img_path.startswith('/static'):
-                img_path = img_path[7:]
-            elif img_path.startswith('data:image'):
-                # Image is encoded in-line (not a file).
-                continue
-            else:
-                logger.warning('Better Fig. Error: img_path should start with either {filename}, |filename| or /static')
+INDEX_VERSION = 1
+INDEX_FILENAME = 'better_figures_and_images.json'
 
-            # search src path list
-            # 1. Build the source image filename from PATH
-            # 2. Build the source image filename from STATIC_PATHS
 
-            # if img_path start with '/', remove it.
-            img_path = os.path.sep.join([el for el in img_path.split("/") if len(el) > 0])
+def probe_image(src):
+    """ Width, height and format of an image, read from its header """
+    im = Image.open(src)
+    try:
+        return im.size[0], im.size[1], im.format
+    finally:
+        im.close()
 
-            # style: {filename}/static/foo/bar.png
-            src = os.path.join(instance.settings['PATH'], img_path, img_filename)
-            src_candidates = [src]
 
-            # style: {filename}../static/foo/bar.png
-            src_candidates += [os.path.join(instance.settings['PATH'], static_path, img_path, img_filename) for static_path in instance.settings['STATIC_PATHS']]
+def probe_svg(src):
+    """ Width, height and format of a SVG, read from its root element """
+    with open(src, 'rb') as f:
+        for _, root in ElementTree.iterparse(f, events=('start',)):
+            width = root.get('width')
+            if width is None:
+                raise IOError('SVG without width')
+            return width, root.get('height'), 'SVG'
+    raise IOError('empty SVG')
 
-            src_candidates = [f for f in src_candidates if path.isfile(f) and access(f, R_OK)]
 
-            if not src_candidates:
-                logger.error('Better Fig. Error: image not found: %s', src)
-                logger.debug('Better Fig. Skip src: %s', img_path + '/' + img_filename)
-                continue
+class ImageIndex(object):
+    """ Dimensions of the images, by path, kept under CACHE_PATH
 
-            src = src_candidates[0]
-            logger.debug('Better Fig. src: %s', src)
+    An entry is reused while the mtime and size of the file are the same.
+    """
 
-            # Open the source image and query dimensions; build style string
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = None
+        self.entries = {}
+        self.sources = {}
+        if settings.get('BETTER_FIGURES_CACHE', True):
+            self.path = os.path.join(settings['CACHE_PATH'], INDEX_FILENAME)
             try:
-                if img.name == 'img':
-                    im = Image.open(src)
-                    extra_style = 'width: {}px; height: auto;'.format(im.size[0])
-                else:
-                    svg = pysvg.parser.parse(src)
-                    extra_style = 'width: {}px; height: auto;'.format(svg.get_width())
-            except IOError as e:
-                logger.debug('Better Fig. Failed to open: %s', src)
-                extra_style = 'width: 100%; height: auto;'
-
-            if 'RESPONSIVE_IMAGES' in instance.settings and instance.settings['RESPONSIVE_IMAGES']:
-                extra_style += ' max-width: 100%;'
-
-            if img.get('style'):
-                img['style'] += extra_style
-            else:
-                img['style'] = extra_style
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self.entries = data.get('images', {})
+            except (IOError, OSError, ValueError):
+                pass
+        self.modified = False
+
+    def find_source(self, candidates):
+        """ The first readable file of candidates """
+        key = tuple(candidates)
+        if key not in self.sources:
+            found = [f for f in candidates if path.isfile(f) and access(f, R_OK)]
+            self.sources[key] = found[0] if found else None
+        return self.sources[key]
+
+    def dimensions(self, src, probe):
+        """ (width, height, format) of src, from the index or probe """
+        stat = os.stat(src)
+        entry = self.entries.get(src)
+        if entry and entry[:2] == [stat.st_mtime, stat.st_size]:
+            return tuple(entry[2:])
+        dimensions = probe(src)
+        self.entries[src] = [stat.st_mtime, stat.st_size] + list(dimensions)
+        self.modified = True
+        return dimensions
+
+    def save(self):
+        # the files may change before the next build
+        self.sources = {}
+        if not self.path or not self.modified:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'images': self.entries}, f)
+        os.rename(self.path + '.tmp', self.path)
+        self.modified = False
+
+
+_index = None
+
+
+def get_index(settings):
+    global _index
+    if _index is not None and _index.settings is not settings:
+        _index.save()
+        _index = None
+    if _index is None:
+        _index = ImageIndex(settings)
+    return _index
+
+
+def save_index(pelican):
+    if _index is not None:
+        _index.save()
 
-            if img.name == 'img':
-                if img['alt'] == img['src']:
-                    img['alt'] = ''
+def content_object_init(instance):
 
-            fig = img.find_parent('div', 'figure')
-            if fig:
-                if fig.get('style'):
-                    fig['style'] += extra_style
-                else:
-                    fig['style'] = extra_style
+    if instance._content is not None:
+        content = instance._content
+        soup = BeautifulSoup(content, 'html.parser')
+        if better_figures_soup(instance, soup):
+            instance._content = soup.decode()
+
+
+def better_figures_soup(instance, soup):
+    modified = False
+    index = get_index(instance.settings)
+    for img in soup(['img', 'object']):
+        logger.debug('Better Fig. PATH: %s', instance.settings['PATH'])
+        if img.name == 'img':
+            logger.debug('Better Fig. img.src: %s', img['src'])
+            img_path, img_filename = path.split(img['src'])
+        else:
+            logger.debug('Better Fig. img.data: %s', img['data'])
+            img_path, img_filename = path.split(img['data'])
+        logger.debug('Better Fig. img_path: %s', img_path)
+        logger.debug('Better Fig. img_fname: %s', img_filename)
+
+        # Strip off {filename}, |filename| or /static
+        if img_path.startswith(('{filename}', '|filename|')):
+            img_path = img_path[10:]
+        elif img_path.startswith('/static'):
+            img_path = img_path[7:]
+        elif img_path.startswith('data:image'):
+            # Image is encoded in-line (not a file).
+            continue
+        else:
+            logger.warning('Better Fig. Error: img_path should start with either {filename}, |filename| or /static')
+
+        # search src path list
+        # 1. Build the source image filename from PATH
+        # 2. Build the source image filename from STATIC_PATHS
+
+        # if img_path start with '/', remove it.
+        img_path = os.path.sep.join([el for el in img_path.split("/") if len(el) > 0])
+
+        # style: {filename}/static/foo/bar.png
+        src = os.path.join(instance.settings['PATH'], img_path, img_filename)
+        src_candidates = [src]
+
+        # style: {filename}../static/foo/bar.png
+        src_candidates += [os.path.join(instance.settings['PATH'], static_path, img_path, img_filename) for static_path in instance.settings['STATIC_PATHS']]
+
+        found = index.find_source(src_candidates)
+
+        if not found:
+            logger.error('Better Fig. Error: image not found: %s', src)
+            logger.debug('Better Fig. Skip src: %s', img_path + '/' + img_filename)
+            continue
+
+        src = found
+        logger.debug('Better Fig. src: %s', src)
+
+        # Query the dimensions of the source image; build style string
+        try:
+            probe = probe_image if img.name == 'img' else probe_svg
+            width = index.dimensions(src, probe)[0]
+            extra_style = 'width: {}px; height: auto;'.format(width)
+        except (IOError, OSError, ElementTree.ParseError) as e:
+            logger.debug('Better Fig. Failed to open: %s', src)
+            extra_style = 'width: 100%; height: auto;'
+
+        if 'RESPONSIVE_IMAGES' in instance.settings and instance.settings['RESPONSIVE_IMAGES']:
+            extra_style += ' max-width: 100%;'
+
+        modified = True
+        if img.get('style'):
+            img['style'] += extra_style
+        else:
+            img['style'] = extra_style
+
+        if img.name == 'img':
+            if img['alt'] == img['src']:
+                img['alt'] = ''
+
+        fig = img.find_parent('div', 'figure')
+        if fig:
+            if fig.get('style'):
+                fig['style'] += extra_style
+            else:
+                fig['style'] = extra_style
 
-        instance._content = soup.decode()
+    return modified
 
 
 def register():
-    signals.content_object_init.connect(content_object_init)
+    signals.finalized.connect(save_index)
+    try:
+        from content_dom import register_pass
+    except ImportError:
+        register_pass = None
+    if register_pass:
+        register_pass(better_figures_soup)
+    else:
+        signals.content_object_init.connect(content_object_init)
@@ -46,13 +46,9 @@ Usage:
 from pelican import signals, contents
 from bs4 import BeautifulSoup
 
-def better_tables(content):
-    if isinstance(content, contents.Static):
-        return
-
-    soup = BeautifulSoup(content._content, 'html.parser')
-
-    for table in soup.findAll('table'):
+def clean_tables(content, soup):
+    tables = soup.findAll('table')
+    for table in tables:
         # table's "border" is so 1996
         del(table['border'])
 
@@ -64,8 +60,22 @@ def better_tables(content):
         for tag in table.findAll(['tbody', 'thead']):
             del(tag['valign'])
 
-    soup.renderContents()
-    content._content = soup.decode()
+    return bool(tables)
+
+def better_tables(content):
+    if isinstance(content, contents.Static):
+        return
+
+    soup = BeautifulSoup(content._content, 'html.parser')
+    if clean_tables(content, soup):
+        content._content = soup.decode()
 
 def register():
-    signals.content_object_init.connect(better_tables)
+    try:
+        from content_dom import register_pass
+    except ImportError:
+        register_pass = None
+    if register_pass:
+        register_pass(clean_tables)
+    else:
+        signals.content_object_init.connect(better_tables)
@@ -8,42 +8,53 @@ from pelican import signals, contents
 from bs4 import BeautifulSoup
 
 def replace(searchterm, soup, attributes):
-    for item in soup.findAll(searchterm):
+    items = soup.findAll(searchterm)
+    for item in items:
         item.attrs['class'] = list(set(item.attrs.get('class', []) + attributes))
+    return len(items)
 
 # def replace_tables(soup, attributes=['table',' table-striped', 'table-hover']):
 #     replace('table', soup, attributes)
 
 def replace_tables(soup, attributes=['table']):
-    replace('table', soup, attributes)
+    count = replace('table', soup, attributes)
     for item in soup.findAll('table'):
         item.attrs['border'] = 0
+    return count
 
 def replace_images(soup, attributes=['img-responsive']):
-    replace('img', soup, attributes)
+    return replace('img', soup, attributes)
 
 def replace_svg(soup, attributes=['svg-responsive']):
-    replace('svg', soup, attributes)
+    return replace('svg', soup, attributes)
 
 def replace_embed(soup, attributes=['embed-responsive-item']):
-    replace('embed', soup, attributes)
-    replace('iframe', soup, attributes)
-    replace('video', soup, attributes)
-    replace('object', soup, attributes)
+    return (replace('embed', soup, attributes) +
+            replace('iframe', soup, attributes) +
+            replace('video', soup, attributes) +
+            replace('object', soup, attributes))
 
 
 
+def bootstrapify_soup(content, soup):
+    return bool(replace_tables(soup) + replace_images(soup) +
+                replace_svg(soup) + replace_embed(soup))
+
 def bootstrapify(content):
     if isinstance(content, contents.Static):
         return
 
     soup = BeautifulSoup(content._content, 'html.parser')
-    replace_tables(soup)
-    replace_images(soup)
-    replace_svg(soup)
-    replace_embed(soup)
+    bootstrapify_soup(content, soup)
 
     content._content = soup.decode()
 
 def register():
-    signals.content_object_init.connect(bootstrapify)
+    try:
+        from content_dom import register_pass
+    except ImportError:
+        register_pass = None
+    if register_pass:
+        register_pass(bootstrapify_soup)
+    else:
+        signals.content_object_init.connect(bootstrapify)
@@ -0,0 +1 @@
+from .content_dom import *
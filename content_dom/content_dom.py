@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Content DOM
+===========
+
+A shared parsed tree of the HTML of every content object, for the plugins
+that would otherwise each parse ``_content`` with BeautifulSoup, edit it and
+serialize it back.
+
+Plugins register passes, functions taking the content object and the parsed
+tree, with ``register_pass``. For every content object the passes of a stage
+run in registration order over a single tree, which is serialized back to
+``_content`` once, and only when a pass reports that it modified the tree.
+"""
+
+from __future__ import unicode_literals
+
+from bs4 import BeautifulSoup
+from pelican import signals, contents
+
+__all__ = ['register_pass', 'parse_content', 'serialize_content',
+           'run_passes', 'register']
+
+# stage -> list of passes, in registration order
+PASSES = {}
+
+
+def content_passes(instance):
+    run_passes(PASSES.get('content_object_init', []), [instance])
+
+
+def article_generator_passes(generator):
+    run_passes(PASSES.get('article_generator_finalized', []),
+               generator.articles)
+
+
+STAGES = {
+    'content_object_init': content_passes,
+    'article_generator_finalized': article_generator_passes,
+}
+
+
+def register_pass(func, stage='content_object_init'):
+    """
+    Run ``func(instance, soup)`` over the parsed content of every content
+    object at stage, which is the name of the signal the pass runs on:
+    ``content_object_init`` for every content object as it is created, or
+    ``article_generator_finalized`` for the articles once they are all read.
+
+    The pass must return True when it modified the tree, so that the tree
+    is serialized back to ``instance._content``.
+    """
+    if stage not in STAGES:
+        raise ValueError('Content DOM passes cannot run on {}'.format(stage))
+    signal = getattr(signals, stage)
+    passes = PASSES.setdefault(stage, [])
+    if func not in passes:
+        passes.append(func)
+    # connecting the same receiver again is a no-op
+    signal.connect(STAGES[stage])
+
+
+def parse_content(html, settings=None):
+    """Parse a fragment of HTML with CONTENT_DOM_PARSER"""
+    parser = (settings or {}).get('CONTENT_DOM_PARSER', 'html.parser')
+    return BeautifulSoup(html, parser)
+
+
+def serialize_content(soup):
+    """Serialize a tree returned by parse_content back to a fragment"""
+    # lxml and html5lib wrap the fragment in a whole document
+    if soup.body is not None and soup.html is not None and \
+            soup.html.parent is soup:
+        return soup.body.decode_contents()
+    return soup.decode()
+
+
+def run_passes(passes, instances):
+    """Run passes over a single parsed tree of each of instances"""
+    if not passes:
+        return
+    for instance in instances:
+        if isinstance(instance, contents.Static) or \
+                getattr(instance, '_content', None) is None:
+            continue
+        soup = parse_content(instance._content, instance.settings)
+        modified = False
+        for func in passes:
+            if func(instance, soup):
+                modified = True
+        if modified:
+            instance._content = serialize_content(soup)
+
+
+def register():
+    # Passes connect the signal of their stage when they are registered,
+    # there is nothing else to set up.
+    pass
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from . import content_dom
+
+HTML = '<p>One <a href="one.html">link</a></p>\n<table border="1"></table>'
+
+
+class FakeContent(object):
+
+    def __init__(self, content, **settings):
+        self._content = content
+        self.settings = settings
+
+
+def remove_border(instance, soup):
+    tables = soup.find_all('table')
+    for table in tables:
+        del table['border']
+    return bool(tables)
+
+
+class TestRunPasses(unittest.TestCase):
+
+    def test_passes_share_one_tree(self):
+        trees = []
+
+        def first(instance, soup):
+            trees.append(soup)
+            return False
+
+        def second(instance, soup):
+            trees.append(soup)
+            return remove_border(instance, soup)
+
+        content = FakeContent(HTML)
+        content_dom.run_passes([first, second], [content])
+
+        self.assertIs(trees[0], trees[1])
+        self.assertEqual(content._content,
+                         '<p>One <a href="one.html">link</a></p>\n<table></table>')
+
+    def test_unmodified_content_is_not_serialized(self):
+        html = '<p>Unbalanced <b>markup</p>'
+        content = FakeContent(html)
+        content_dom.run_passes([remove_border], [content])
+
+        self.assertIs(content._content, html)
+
+    def test_missing_content(self):
+        content = FakeContent(None)
+        content_dom.run_passes([remove_border], [content])
+
+        self.assertIsNone(content._content)
+
+    def test_document_parser(self):
+        try:
+            import lxml  # NOQA
+        except ImportError:
+            raise unittest.SkipTest('lxml is not installed')
+        content = FakeContent(HTML, CONTENT_DOM_PARSER='lxml')
+        content_dom.run_passes([remove_border], [content])
+
+        self.assertEqual(content._content,
+                         '<p>One <a href="one.html">link</a></p>\n<table></table>')
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            content_dom.register_pass(remove_border, 'content_written')
@@ -15,11 +15,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def extract_toc(content):
-    if isinstance(content, contents.Static):
-        return
-
-    soup = BeautifulSoup(content._content, 'html.parser')
+def extract_toc_soup(content, soup):
     filename = content.source_path
     extension = path.splitext(filename)[1][1:]
     toc = None
@@ -54,11 +50,28 @@ def extract_toc(content):
 
     if toc:
         toc.extract()
-        content._content = soup.decode()
         content.toc = toc.decode()
         if content.toc.startswith('<html>'):
             content.toc = content.toc[12:-14]
+        return True
+    return False
+
+
+def extract_toc(content):
+    if isinstance(content, contents.Static):
+        return
+
+    soup = BeautifulSoup(content._content, 'html.parser')
+    if extract_toc_soup(content, soup):
+        content._content = soup.decode()
 
 
 def register():
-    signals.content_object_init.connect(extract_toc)
+    try:
+        from content_dom import register_pass
+    except ImportError:
+        register_pass = None
+    if register_pass:
+        register_pass(extract_toc_soup)
+    else:
+        signals.content_object_init.connect(extract_toc)
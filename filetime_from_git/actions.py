@@ -95,9 +95,10 @@ def git_permalink(content, git_content):
         return
 
     permalink_hash = hashlib.sha1()
-    permalink_hash.update(str(git_content.get_oldest_commit()))
-    permalink_hash.update(str(git_content.get_oldest_filename()))
-    git_permalink_id = base64.urlsafe_b64encode(permalink_hash.digest())
+    permalink_hash.update(str(git_content.get_oldest_commit()).encode('utf-8'))
+    permalink_hash.update(str(git_content.get_oldest_filename()).encode('utf-8'))
+    git_permalink_id = base64.urlsafe_b64encode(
+        permalink_hash.digest()).decode('ascii')
     permalink_id_metadata_key = content.settings['PERMALINK_ID_METADATA_KEY']
 
     if permalink_id_metadata_key in content.metadata:
@@ -5,6 +5,7 @@ Wraps a content object to provide some git information
 import logging
 from pelican.utils import memoized
 from .git_wrapper import git_wrapper
+from .git_history import git_history_index
 
 DEV_LOGGER = logging.getLogger(__name__)
 
@@ -15,15 +16,21 @@ class GitContentAdapter(object):
     """
     def __init__(self, content):
         self.content = content
-        self.git = git_wrapper('.')
         self.tz_name = content.settings.get('TIMEZONE', None)
         self.follow = content.settings['GIT_HISTORY_FOLLOWS_RENAME']
+        self.git = git_wrapper('.')
+        self.index = None
+        if content.settings.get('GIT_HISTORY_INDEX', True):
+            self.index = git_history_index(
+                '.', content.settings.get('CACHE_PATH'))
 
     @memoized
     def is_committed(self):
         '''
         Is committed
         '''
+        if self.index:
+            return self.index.is_committed(self.content.source_path)
         return len(self.get_commits()) > 0
 
     @memoized
@@ -31,6 +38,8 @@ class GitContentAdapter(object):
         '''
         Has content been modified since last commit
         '''
+        if self.index:
+            return self.index.is_file_modified(self.content.source_path)
         return self.git.is_file_modified(self.content.source_path)
 
     @memoized
@@ -38,6 +47,8 @@ class GitContentAdapter(object):
         '''
         Is content stored in a file managed by git
         '''
+        if self.index:
+            return self.index.is_file_managed_by_git(self.content.source_path)
         return self.git.is_file_managed_by_git(self.content.source_path)
 
     @memoized
@@ -57,6 +68,9 @@ class GitContentAdapter(object):
 
         :returns: Oldest commit
         '''
+        if self.index:
+            return self.index.get_oldest_commit(
+                self.content.source_path, self.follow)
         return self.git.get_commits(self.content.source_path, self.follow)[-1]
 
     @memoized
@@ -66,6 +80,8 @@ class GitContentAdapter(object):
 
         :returns: Newest commit
         '''
+        if self.index:
+            return self.index.get_newest_commit(self.content.source_path)
         return self.git.get_commits(self.content.source_path, follow=False)[0]
 
     @memoized
@@ -73,9 +89,11 @@ class GitContentAdapter(object):
         '''
         Get the original filename of this content. Implies follow
         '''
+        if self.index:
+            return self.index.get_names(self.content.source_path)[0]
         commit_and_name_iter = self.git.get_commits_and_names_iter(
             self.content.source_path)
-        _commit, name = commit_and_name_iter.next()
+        _commit, name = next(commit_and_name_iter)
         return name
 
     @memoized
@@ -86,6 +104,8 @@ class GitContentAdapter(object):
         :returns: Datetime of oldest commit
         '''
         oldest_commit = self.get_oldest_commit()
+        if self.index:
+            return self.index.get_commit_date(oldest_commit, self.tz_name)
         return self.git.get_commit_date(oldest_commit, self.tz_name)
 
     @memoized
@@ -96,4 +116,6 @@ class GitContentAdapter(object):
         :returns: Datetime of newest commit
         '''
         newest_commit = self.get_newest_commit()
+        if self.index:
+            return self.index.get_commit_date(newest_commit, self.tz_name)
         return self.git.get_commit_date(newest_commit, self.tz_name)
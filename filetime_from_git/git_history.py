@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory index of the git history of every file in the repository
+
+The index is built from a single ``git log --name-status -M`` walk and a
+single ``git status --porcelain``, instead of running git once or more for
+every content file. It is persisted under ``CACHE_PATH`` and brought up to
+date from the last indexed HEAD on the next build.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from pelican.utils import set_date_tzinfo
+from git import Git
+from git.exc import GitCommandError
+
+DEV_LOGGER = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'filetime_from_git.json'
+COMMIT_MARKER = '\x01'
+
+
+class IndexedCommit(object):
+    '''
+    Lightweight stand-in for a git commit object
+    '''
+    def __init__(self, hexsha, committed_date):
+        self.hexsha = hexsha
+        self.committed_date = committed_date
+
+    def __str__(self):
+        return self.hexsha
+
+    def __repr__(self):
+        return '<IndexedCommit %s>' % self.hexsha
+
+    def __eq__(self, other):
+        return getattr(other, 'hexsha', None) == self.hexsha
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.hexsha)
+
+
+class GitHistoryIndex(object):
+    '''
+    First and last commits, and rename chain, of every path in a repository
+
+    ``paths`` maps a path relative to the repository root to a record
+    ``[oldest sha following renames, oldest sha, newest sha, names]`` where
+    ``names`` lists the names the file had, oldest first.
+    '''
+    def __init__(self, repo_path, cache_path=None):
+        self.git = Git(os.path.abspath(repo_path))
+        self.root = self.git.rev_parse('--show-toplevel')
+        self.cache_file = None
+        if cache_path:
+            self.cache_file = os.path.join(cache_path, INDEX_FILENAME)
+        self.head = None
+        self.commits = {}
+        self.paths = {}
+        self.status = {}
+        self.update()
+
+    def update(self):
+        '''
+        Load the persisted index and walk the commits added since
+        '''
+        try:
+            head = self.git.rev_parse('HEAD')
+        except GitCommandError:
+            # Repository without any commit yet
+            head = None
+
+        self.load()
+        if self.head != head:
+            if self.head and head and self.is_ancestor(self.head, head):
+                DEV_LOGGER.debug(
+                    'Updating git history index %s..%s', self.head, head)
+                self.walk('%s..%s' % (self.head, head))
+            else:
+                DEV_LOGGER.debug('Building git history index at %s', head)
+                self.commits = {}
+                self.paths = {}
+                if head:
+                    self.walk(head)
+            self.head = head
+            self.save()
+
+        self.status = self.read_status()
+
+    def is_ancestor(self, ancestor, descendant):
+        status, _stdout, _stderr = self.git.execute(
+            ['git', 'merge-base', '--is-ancestor', ancestor, descendant],
+            with_extended_output=True,
+            with_exceptions=False)
+        return status == 0
+
+    def walk(self, revisions):
+        '''
+        Apply ``git log`` of revisions, oldest first, to the index
+        '''
+        output = self.git.log(
+            '--reverse', '--name-status', '-M', '-z',
+            '--format=%s%%H %%ct' % COMMIT_MARKER, revisions, '--')
+        tokens = iter(output.split('\0'))
+        sha = None
+        for token in tokens:
+            token = token.lstrip('\n')
+            if not token:
+                continue
+            if token.startswith(COMMIT_MARKER):
+                sha, timestamp = token[1:].split()
+                self.commits[sha] = int(timestamp)
+            elif token[0] in 'RC':
+                old, new = next(tokens), next(tokens)
+                self.apply(sha, token[0], new, old)
+            else:
+                self.apply(sha, token[0], next(tokens))
+
+    def apply(self, sha, status, path, old_path=None):
+        if status == 'D':
+            self.paths.pop(path, None)
+        elif status == 'R' and old_path in self.paths:
+            oldest_following, _, _, names = self.paths.pop(old_path)
+            self.paths[path] = [oldest_following, sha, sha, names + [path]]
+        elif path in self.paths:
+            self.paths[path][2] = sha
+        else:
+            self.paths[path] = [sha, sha, sha, [path]]
+
+    def read_status(self):
+        '''
+        Map paths that differ from HEAD to their porcelain status
+        '''
+        output = self.git.status('--porcelain', '-z', '--untracked-files=no')
+        status = {}
+        tokens = iter(output.split('\0'))
+        for token in tokens:
+            if not token:
+                continue
+            status[token[3:]] = token[:2]
+            if token[0] in 'RC':
+                next(tokens)
+        return status
+
+    def load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as cache:
+                data = json.load(cache)
+        except (IOError, OSError, ValueError) as exc:
+            DEV_LOGGER.warning(
+                'Cannot load git history index %s: %s', self.cache_file, exc)
+            return
+        if data.get('version') != INDEX_VERSION or \
+                data.get('root') != self.root:
+            return
+        self.head = data['head']
+        self.commits = data['commits']
+        self.paths = data['paths']
+
+    def save(self):
+        if not self.cache_file:
+            return
+        directory = os.path.dirname(self.cache_file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.cache_file + '.tmp', 'w') as cache:
+            json.dump({
+                'version': INDEX_VERSION,
+                'root': self.root,
+                'head': self.head,
+                'commits': self.commits,
+                'paths': self.paths,
+            }, cache)
+        os.rename(self.cache_file + '.tmp', self.cache_file)
+
+    def relpath(self, path):
+        '''
+        Path relative to the repository root, as git reports it
+        '''
+        path = os.path.relpath(os.path.realpath(path), self.root)
+        return path.replace(os.sep, '/')
+
+    def commit(self, sha):
+        return IndexedCommit(sha, self.commits[sha])
+
+    def is_file_managed_by_git(self, path):
+        '''
+        :returns: True if path is committed or staged
+        '''
+        path = self.relpath(path)
+        return path in self.paths or self.status.get(path, '').startswith('A')
+
+    def is_file_modified(self, path):
+        '''
+        :returns: True if file has local changes not yet committed
+        '''
+        return self.relpath(path) in self.status
+
+    def is_committed(self, path):
+        return self.relpath(path) in self.paths
+
+    def get_oldest_commit(self, path, follow=False):
+        record = self.paths[self.relpath(path)]
+        return self.commit(record[0] if follow else record[1])
+
+    def get_newest_commit(self, path):
+        return self.commit(self.paths[self.relpath(path)][2])
+
+    def get_names(self, path):
+        '''
+        Names of path through renames, oldest first
+        '''
+        return list(self.paths[self.relpath(path)][3])
+
+    @staticmethod
+    def get_commit_date(commit, tz_name):
+        '''
+        Get datetime of commit comitted_date
+        '''
+        return set_date_tzinfo(
+            datetime.fromtimestamp(commit.committed_date),
+            tz_name=tz_name)
+
+
+_index_cache = {}
+# repositories whose index may be behind since the last build
+_outdated = set()
+
+
+def git_history_index(path, cache_path=None):
+    '''
+    Get the history index of the repository at path, built once per process
+    and brought up to date on its first use in each build
+    '''
+    path = os.path.abspath(path)
+    if path not in _index_cache:
+        _index_cache[path] = GitHistoryIndex(path, cache_path)
+    elif path in _outdated:
+        _index_cache[path].update()
+    _outdated.discard(path)
+
+    return _index_cache[path]
+
+
+def outdate_history_indexes(pelican_inst=None):
+    '''
+    Have the indexes updated when the next build (autoreload) uses them
+    '''
+    _outdated.update(_index_cache)
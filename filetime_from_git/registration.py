@@ -5,6 +5,7 @@ Handle registration and setup for plugin
 import logging
 from blinker import signal
 from .content_adapter import GitContentAdapter
+from .git_history import outdate_history_indexes
 from pelican import signals
 
 DEV_LOGGER = logging.getLogger(__name__)
@@ -20,11 +21,13 @@ def setup_option_defaults(pelican_inst):
     pelican_inst.settings.setdefault('GIT_HISTORY_FOLLOWS_RENAME', True)
     pelican_inst.settings.setdefault('GIT_SHA_METADATA', True)
     pelican_inst.settings.setdefault('GIT_GENERATE_PERMALINK', False)
+    pelican_inst.settings.setdefault('GIT_HISTORY_INDEX', True)
 
 
 def register():
     signals.content_object_init.connect(send_content_git_object_init)
     signals.initialized.connect(setup_option_defaults)
+    signals.finalized.connect(outdate_history_indexes)
 
     # Import actions
     from . import actions
@@ -35,7 +35,12 @@ def get_excludes(pelican):
 
 def parse_content(content):
     soup = bs4.BeautifulSoup(content._content, 'html.parser')
+    if parse_soup(content, soup):
+        content._content = str(soup)
 
+
+def parse_soup(content, soup):
+    modified = False
     for def_list in soup.find_all('dl'):
         defns = []
         for def_title in def_list.find_all('dt'):
@@ -44,6 +49,7 @@ def parse_content(content):
                 anchor_tag = bs4.Tag(name="a", attrs={'name': anchor_name})
                 index = def_list.parent.index(def_list)-1
                 def_list.parent.insert(index, anchor_tag)
+                modified = True
 
                 defns.append(
                     {'title': make_title(def_title),
@@ -56,7 +62,7 @@ def parse_content(content):
 
         Definitions.definitions += defns
 
-    content._content = str(soup)
+    return modified
 
 
 def parse_articles(generator):
@@ -66,5 +72,12 @@ def parse_articles(generator):
 
 def register():
     signals.initialized.connect(get_excludes)
-    signals.article_generator_finalized.connect(parse_articles)
+    try:
+        from content_dom import register_pass
+    except ImportError:
+        register_pass = None
+    if register_pass:
+        register_pass(parse_soup, 'article_generator_finalized')
+    else:
+        signals.article_generator_finalized.connect(parse_articles)
     signals.page_generator_context.connect(set_definitions)
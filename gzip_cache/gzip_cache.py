@@ -7,7 +7,10 @@ Gzip cache
 A plugin to create .gz cache files for optimization.
 '''
 
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import zlib
 
@@ -15,11 +18,23 @@ from pelican import signals
 
 logger = logging.getLogger(__name__)
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # A list of file types to exclude from possible compression
 EXCLUDE_TYPES = [
     # Compressed types
+    '.br',
     '.bz2',
     '.gz',
+    '.zst',
 
     # Audio types
     '.aac',
@@ -57,17 +72,164 @@ will be set to 255 (unknown)'
 WBITS = zlib.MAX_WBITS | 16
 
 
+BROTLI_QUALITY = 11
+ZSTD_LEVEL = 19
+
+BLOCK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = 'gzip_cache.json'
+
+
 def create_gzip_cache(pelican):
     '''Create a gzip cache file for every file that a webserver would
     reasonably want to cache (e.g., text type files).
 
+    Files whose content has not changed since the previous run, and whose
+    compressed siblings are still present, are skipped. With
+    ``GZIP_CACHE_JOBS`` the files are compressed by a pool of processes.
+
     :param pelican: The Pelican instance
     '''
-    for dirpath, _, filenames in os.walk(pelican.settings['OUTPUT_PATH']):
+    settings = pelican.settings
+    output_path = settings['OUTPUT_PATH']
+    overwrite = should_overwrite(settings)
+    formats = get_formats(settings)
+    manifest_path = None
+    manifest = {}
+    if not overwrite and settings.get('GZIP_CACHE_SKIP_UNCHANGED', True):
+        manifest_path = os.path.join(settings['CACHE_PATH'], MANIFEST_NAME)
+        manifest = load_manifest(manifest_path, formats)
+
+    tasks = []
+    for dirpath, _, filenames in os.walk(output_path):
         for name in filenames:
             if should_compress(name):
                 filepath = os.path.join(dirpath, name)
-                create_gzip_file(filepath, should_overwrite(pelican.settings))
+                relpath = os.path.relpath(filepath, output_path)
+                tasks.append((filepath, overwrite, formats,
+                              manifest.get(relpath)))
+
+    jobs = get_jobs(settings)
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(compress_task, tasks,
+                                      max(1, len(tasks) // (jobs * 8)))
+    else:
+        pool = None
+        results = (compress_task(task) for task in tasks)
+
+    entries = {}
+    compressed = 0
+    for filepath, entry, skipped in results:
+        if entry is not None:
+            entries[os.path.relpath(filepath, output_path)] = entry
+        if not skipped:
+            compressed += 1
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    logger.info('gzip_cache: compressed %d files, %d unchanged',
+                compressed, len(tasks) - compressed)
+
+    if manifest_path:
+        save_manifest(manifest_path, formats, entries)
+
+
+def get_formats(settings):
+    '''Return the precompressed formats to write, ``gz`` being the default.
+
+    Formats whose compression library is not installed are dropped with a
+    warning, and only ``gz`` can be used to overwrite the originals.
+
+    :param settings: The pelican instance settings
+    '''
+    formats = []
+    for fmt in settings.get('GZIP_CACHE_FORMATS', ('gz',)):
+        if fmt not in COMPRESSORS:
+            logger.warning('gzip_cache: unknown format %s' % fmt)
+        elif fmt == 'br' and brotli is None:
+            logger.warning('gzip_cache: brotli not found, not creating .br files')
+        elif fmt == 'zst' and zstandard is None:
+            logger.warning('gzip_cache: zstandard not found, not creating .zst files')
+        elif fmt not in formats:
+            formats.append(fmt)
+    if should_overwrite(settings) and formats != ['gz']:
+        logger.warning('gzip_cache: GZIP_CACHE_OVERWRITE only supports gz')
+        formats = ['gz']
+    return formats
+
+
+def get_jobs(settings):
+    '''Return the number of compression processes, 0 meaning one per core.
+
+    :param settings: The pelican instance settings
+    '''
+    jobs = settings.get('GZIP_CACHE_JOBS', 1)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    return jobs
+
+
+def load_manifest(path, formats):
+    '''Load the entries recorded by the previous run for the same formats.
+
+    :param path: The manifest file
+    :param formats: The formats requested for this run
+    '''
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('formats') != formats:
+        return {}
+    return data.get('files', {})
+
+
+def save_manifest(path, formats, entries):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as fh:
+        json.dump({'formats': formats, 'files': entries}, fh)
+    os.rename(path + '.tmp', path)
+
+
+def file_hash(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compress_task(task):
+    '''Compress one file unless the manifest entry shows it is unchanged.
+
+    Returns the file path, its new manifest entry and whether it was skipped.
+    An entry is ``[size, mtime, sha1, written formats]``.
+
+    :param task: A tuple of file path, overwrite flag, formats and the
+        previous manifest entry (or None)
+    '''
+    filepath, overwrite, formats, previous = task
+    try:
+        stat = os.stat(filepath)
+        if previous is not None and previous[0] == stat.st_size:
+            siblings = all(os.path.exists(filepath + '.' + fmt)
+                           for fmt in previous[3])
+            if siblings and (previous[1] == stat.st_mtime or
+                             previous[2] == file_hash(filepath)):
+                return filepath, [stat.st_size, stat.st_mtime, previous[2],
+                                  previous[3]], True
+        digest = None if overwrite else file_hash(filepath)
+        written = create_compressed_files(filepath, overwrite, formats)
+        return filepath, [stat.st_size, stat.st_mtime, digest, written], False
+    except Exception as ex:
+        logger.critical('Compression failed: %s: %s' % (filepath, ex))
+        return filepath, None, False
 
 
 def should_compress(filename):
@@ -88,37 +250,94 @@ def should_overwrite(settings):
     '''
     return settings.get('GZIP_CACHE_OVERWRITE', False)
 
+def gzip_compressor():
+    return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, WBITS)
+
+
+class BrotliCompressor(object):
+    '''Give brotli's streaming compressor the zlib compress/flush interface.'''
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def zstd_compressor():
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+COMPRESSORS = {
+    'gz': gzip_compressor,
+    'br': BrotliCompressor,
+    'zst': zstd_compressor,
+}
+
+
 def create_gzip_file(filepath, overwrite):
     '''Create a gzipped file in the same directory with a filepath.gz name.
 
     :param filepath: A file to compress
     :param overwrite: Whether the original file should be overwritten
     '''
-    compressed_path = filepath + '.gz'
-
-    with open(filepath, 'rb') as uncompressed:
-        gzip_compress_obj = zlib.compressobj(COMPRESSION_LEVEL,
-                                                zlib.DEFLATED, WBITS)
-
-        uncompressed_data = uncompressed.read()
-        gzipped_data = gzip_compress_obj.compress(uncompressed_data)
-        gzipped_data += gzip_compress_obj.flush()
-
-        if len(gzipped_data) >= len(uncompressed_data):
-            logger.debug('No improvement: %s' % filepath)
-            return
-
-        with open(compressed_path, 'wb') as compressed:
-            logger.debug('Compressing: %s' % filepath)
-            try:
-                compressed.write(gzipped_data)
-            except Exception as ex:
-                logger.critical('Gzip compression failed: %s' % ex)
-
-        if overwrite:
-            logger.debug('Overwriting: %s with %s' % (filepath, compressed_path))
-            os.remove(filepath)
-            os.rename(compressed_path, filepath)
+    create_compressed_files(filepath, overwrite, ['gz'])
+
+
+def create_compressed_files(filepath, overwrite, formats):
+    '''Create compressed siblings named filepath.<format> in one read.
+
+    The source is streamed through every compressor block by block, so large
+    files are never held in memory. A sibling is only kept if it is smaller
+    than the source. Returns the list of formats that were written.
+
+    :param filepath: A file to compress
+    :param overwrite: Whether the original file should be overwritten
+    :param formats: The formats to create, e.g. ``['gz', 'br']``
+    '''
+    outputs = []
+    try:
+        for fmt in formats:
+            compressed_path = filepath + '.' + fmt
+            outputs.append((fmt, compressed_path, COMPRESSORS[fmt](),
+                            open(compressed_path + '.tmp', 'wb')))
+
+        size = 0
+        with open(filepath, 'rb') as uncompressed:
+            for block in iter(lambda: uncompressed.read(BLOCK_SIZE), b''):
+                size += len(block)
+                for _, _, compress_obj, compressed in outputs:
+                    compressed.write(compress_obj.compress(block))
+        for _, _, compress_obj, compressed in outputs:
+            compressed.write(compress_obj.flush())
+            compressed.close()
+    except Exception as ex:
+        logger.critical('Gzip compression failed: %s' % ex)
+        for _, compressed_path, _, compressed in outputs:
+            compressed.close()
+            os.remove(compressed_path + '.tmp')
+        return []
+
+    written = []
+    for fmt, compressed_path, _, _ in outputs:
+        if os.path.getsize(compressed_path + '.tmp') >= size:
+            logger.debug('No improvement: %s' % compressed_path)
+            os.remove(compressed_path + '.tmp')
+            continue
+        logger.debug('Compressing: %s' % compressed_path)
+        os.rename(compressed_path + '.tmp', compressed_path)
+        written.append(fmt)
+
+    if overwrite and 'gz' in written:
+        compressed_path = filepath + '.gz'
+        logger.debug('Overwriting: %s with %s' % (filepath, compressed_path))
+        os.remove(filepath)
+        os.rename(compressed_path, filepath)
+
+    return written
 
 def register():
     signals.finalized.connect(create_gzip_cache)
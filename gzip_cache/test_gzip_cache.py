@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 '''Core plugins unit tests'''
 
+import gzip
 import os
 import tempfile
 import unittest
@@ -89,6 +90,83 @@ class TestGzipCache(unittest.TestCase):
             gzip_cache.create_gzip_file(a_html_filename, True)
             self.assertFalse(os.path.exists(a_html_filename + '.gz'))
 
+    def test_skips_unchanged_file(self):
+        # A file whose content and .gz are unchanged is not compressed again,
+        # even if it has been rewritten with a new mtime.
+        with temporary_folder() as tempdir:
+            a_html_filename = write_file(tempdir, 'a.html', b'<p>a</p>' * 100)
+            task = (a_html_filename, False, ['gz'], None)
+            _, entry, skipped = gzip_cache.compress_task(task)
+            self.assertFalse(skipped)
+            self.assertEqual(['gz'], entry[3])
+
+            os.utime(a_html_filename, (0, 0))
+            _, _, skipped = gzip_cache.compress_task(task[:3] + (entry,))
+            self.assertTrue(skipped)
+
+            write_file(tempdir, 'a.html', b'<p>b</p>' * 100)
+            _, _, skipped = gzip_cache.compress_task(task[:3] + (entry,))
+            self.assertFalse(skipped)
+
+            os.remove(a_html_filename + '.gz')
+            _, _, skipped = gzip_cache.compress_task(task[:3] + (entry,))
+            self.assertFalse(skipped)
+            self.assertTrue(os.path.exists(a_html_filename + '.gz'))
+
+    def test_streams_large_file(self):
+        # Files larger than one block are compressed to a valid gzip stream.
+        with temporary_folder() as tempdir:
+            data = b''.join(b'line %d\n' % i for i in range(300000))
+            self.assertTrue(len(data) > gzip_cache.BLOCK_SIZE)
+            a_js_filename = write_file(tempdir, 'a.js', data)
+            self.assertEqual(['gz'], gzip_cache.create_compressed_files(
+                a_js_filename, False, ['gz']))
+            with gzip.open(a_js_filename + '.gz', 'rb') as fh:
+                self.assertEqual(data, fh.read())
+
+    def test_create_gzip_cache_parallel(self):
+        # The process pool compresses every file and records a manifest.
+        with temporary_folder() as tempdir:
+            output_path = os.path.join(tempdir, 'output')
+            cache_path = os.path.join(tempdir, 'cache')
+            os.makedirs(os.path.join(output_path, 'sub'))
+            names = ['a.html', 'b.css', os.path.join('sub', 'c.js')]
+            for name in names:
+                write_file(output_path, name, b'body { color: red; }' * 50)
+            pelican = FakePelican({'OUTPUT_PATH': output_path,
+                                   'CACHE_PATH': cache_path,
+                                   'GZIP_CACHE_JOBS': 2})
+            gzip_cache.create_gzip_cache(pelican)
+            for name in names:
+                self.assertTrue(os.path.exists(
+                    os.path.join(output_path, name + '.gz')))
+            manifest = gzip_cache.load_manifest(
+                os.path.join(cache_path, gzip_cache.MANIFEST_NAME), ['gz'])
+            self.assertEqual(sorted(names), sorted(manifest))
+
+    @unittest.skipUnless(gzip_cache.brotli, 'brotli is not installed')
+    def test_creates_brotli_file(self):
+        with temporary_folder() as tempdir:
+            data = b'<p>brotli</p>' * 100
+            a_html_filename = write_file(tempdir, 'a.html', data)
+            gzip_cache.create_compressed_files(a_html_filename, False,
+                                               ['gz', 'br'])
+            with open(a_html_filename + '.br', 'rb') as fh:
+                self.assertEqual(data, gzip_cache.brotli.decompress(fh.read()))
+
+
+class FakePelican(object):
+    def __init__(self, settings):
+        self.settings = settings
+
+
+def write_file(dirpath, name, data):
+    filepath = os.path.join(dirpath, name)
+    with open(filepath, 'wb') as fh:
+        fh.write(data)
+    return filepath
+
+
 def get_md5(filepath):
     with open(filepath, 'rb') as fh:
         return md5(fh.read()).hexdigest()
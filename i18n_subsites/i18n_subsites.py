@@ -6,8 +6,11 @@ This plugin is designed for Pelican 3.4 and later
 
 import os
 import six
+import shutil
 import logging
 import posixpath
+import traceback
+import multiprocessing
 
 from copy import copy
 from itertools import chain
@@ -36,8 +39,13 @@ _SITES_RELPATH_DB = {}       # map: (lang, base_lang) -> relpath
 # map: generator -> list of removed contents that need interlinking
 _GENERATOR_DB = {}
 _NATIVE_CONTENT_URL_DB = {} # map: source_path -> content in its native lang
+_SUBSITE_WORKERS = []   # list of (lang, process, connection) in parallel mode
+_WORKER = None          # (connection, semaphore) in a subsite worker process
 _LOGGER = logging.getLogger(__name__)
 
+# reader-level content caches seeded from the main site into the subsites
+_READER_CACHES = ('ArticlesGenerator-Readers', 'PagesGenerator-Readers')
+
 
 @contextmanager
 def temporary_locale(temp_locale=None):
@@ -64,6 +72,16 @@ def initialize_dbs(settings):
     _MAIN_SITEURL = settings['SITEURL']
     _SUBSITE_QUEUE = settings.get('I18N_SUBSITES', {}).copy()
     prepare_site_db_and_overrides()
+    if _SUBSITE_QUEUE and shared_content_cache(settings):
+        # subsites can reuse what the main site parsed only if the
+        # main site caches the output of its readers
+        if not (settings.get('CACHE_CONTENT') and
+                settings.get('CONTENT_CACHING_LAYER') == 'reader'):
+            _LOGGER.info("i18n: I18N_SHARED_CONTENT_CACHE sets "
+                         "CACHE_CONTENT = True and "
+                         "CONTENT_CACHING_LAYER = 'reader'")
+        settings['CACHE_CONTENT'] = True
+        settings['CONTENT_CACHING_LAYER'] = 'reader'
     # clear databases in case of autoreload mode
     _SITES_RELPATH_DB.clear()
     _NATIVE_CONTENT_URL_DB.clear()
@@ -100,6 +118,40 @@ def prepare_site_db_and_overrides():
             overrides['THEME_STATIC_PATHS'] = []
         # to change what is perceived as translations
         overrides['DEFAULT_LANG'] = lang
+        if shared_content_cache(_MAIN_SETTINGS):
+            overrides.setdefault('CONTENT_CACHING_LAYER', 'reader')
+            overrides.setdefault('LOAD_CONTENT_CACHE', True)
+
+
+def subsite_processes(settings):
+    '''Get the number of subsites generated concurrently, 1 is serial'''
+    processes = settings.get('I18N_SUBSITES_PROCESSES', 1)
+    if processes is True or processes == 0:
+        processes = multiprocessing.cpu_count()
+    return processes or 1
+
+
+def shared_content_cache(settings):
+    '''Whether subsites start from the reader cache of the main site'''
+    return settings.get('I18N_SHARED_CONTENT_CACHE', False)
+
+
+def seed_content_cache(settings):
+    '''Copy the reader caches of the main site to the subsite cache path
+
+    The reader output does not depend on the language of the site, so
+    the subsite only has to parse files changed since the main site did.
+    '''
+    main_cache_path = _MAIN_SETTINGS['CACHE_PATH']
+    cache_path = settings['CACHE_PATH']
+    if os.path.abspath(main_cache_path) == os.path.abspath(cache_path):
+        return
+    for name in _READER_CACHES:
+        source = os.path.join(main_cache_path, name)
+        if os.path.exists(source):
+            if not os.path.isdir(cache_path):
+                os.makedirs(cache_path)
+            shutil.copyfile(source, os.path.join(cache_path, name))
 
 
 def subscribe_filter_to_signals(settings):
@@ -109,10 +161,14 @@ def subscribe_filter_to_signals(settings):
 
 
 def initialize_plugin(pelican_obj):
-    '''Initialize plugin variables and Pelican settings'''
+    '''Initialize plugin variables and Pelican settings
+
+    Returns the generator that waits for the subsite workers.
+    '''
     if _MAIN_SETTINGS is None:
         initialize_dbs(pelican_obj.settings)
         subscribe_filter_to_signals(pelican_obj.settings)
+    return SubsiteWorkersGenerator
 
 
 def get_site_path(url):
@@ -394,6 +450,16 @@ def get_pelican_cls(settings):
     return cls
 
 
+def subsite_settings(lang, overrides):
+    '''Get the settings of the subsite of lang'''
+    settings = _MAIN_SETTINGS.copy()
+    settings.update(overrides)
+    settings = configure_settings(settings)      # to set LOCALE, etc.
+    if shared_content_cache(_MAIN_SETTINGS):
+        seed_content_cache(settings)
+    return settings
+
+
 def create_next_subsite(pelican_obj):
     '''Create the next subsite using the lang-specific config
 
@@ -403,19 +469,25 @@ def create_next_subsite(pelican_obj):
     language and overrides for next the subsite in the queue and apply
     overrides.  Then generate the subsite using a PELICAN_CLASS
     instance and its run method. Finally, restore the previous locale.
+
+    With ``I18N_SUBSITES_PROCESSES`` greater than 1 all the subsites are
+    generated at once in worker processes instead, see
+    ``create_subsites_in_parallel``.
     '''
     global _MAIN_SETTINGS
-    if len(_SUBSITE_QUEUE) == 0:
+    if _WORKER is not None:
+        exchange_native_urls()
+    elif len(_SUBSITE_QUEUE) == 0:
         _LOGGER.debug(
             'i18n: Updating cross-site links and context of all generators.')
         update_generators()
         _MAIN_SETTINGS = None             # to initialize next time
+    elif subsite_processes(_MAIN_SETTINGS) > 1 and hasattr(os, 'fork'):
+        create_subsites_in_parallel()
     else:
         with temporary_locale():
-            settings = _MAIN_SETTINGS.copy()
             lang, overrides = _SUBSITE_QUEUE.popitem()
-            settings.update(overrides)
-            settings = configure_settings(settings)      # to set LOCALE, etc.
+            settings = subsite_settings(lang, overrides)
             cls = get_pelican_cls(settings)
 
             new_pelican_obj = cls(settings)
@@ -424,6 +496,134 @@ def create_next_subsite(pelican_obj):
             new_pelican_obj.run()
 
 
+def create_subsites_in_parallel():
+    '''Generate all queued subsites concurrently in forked processes
+
+    Each worker generates the content of its subsite and sends the
+    native URLs of its content back. Once all of them are merged, every
+    site (this one included) interlinks its own generators and writes
+    its output concurrently. The workers are joined by
+    ``SubsiteWorkersGenerator`` once the main site wrote its content.
+    '''
+    global _MAIN_SETTINGS
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        context = multiprocessing         # Python 2 always forks on POSIX
+    semaphore = context.BoundedSemaphore(subsite_processes(_MAIN_SETTINGS))
+    while _SUBSITE_QUEUE:
+        lang, overrides = _SUBSITE_QUEUE.popitem()
+        with temporary_locale():
+            settings = subsite_settings(lang, overrides)
+        connection, worker_connection = context.Pipe()
+        process = context.Process(
+            target=run_subsite_worker,
+            args=(lang, settings, worker_connection, semaphore),
+            name='i18n-subsite-{}'.format(lang))
+        process.start()
+        worker_connection.close()
+        _SUBSITE_WORKERS.append((lang, process, connection))
+        _LOGGER.debug("Generating i18n subsite for language '{}' in "
+                      "process {}".format(lang, process.pid))
+
+    try:
+        for lang, process, connection in _SUBSITE_WORKERS:
+            status, payload = connection.recv()
+            if status != 'urls':
+                raise RuntimeError(
+                    "i18n subsite for language '{}' failed:\n{}".format(
+                        lang, payload))
+            _NATIVE_CONTENT_URL_DB.update(payload)
+        for lang, process, connection in _SUBSITE_WORKERS:
+            connection.send(_NATIVE_CONTENT_URL_DB)
+    except Exception:
+        terminate_subsite_workers()
+        raise
+
+    _LOGGER.debug(
+        'i18n: Updating cross-site links and context of all generators.')
+    update_generators()
+    _MAIN_SETTINGS = None             # to initialize next time
+
+
+def run_subsite_worker(lang, settings, connection, semaphore):
+    '''Generate the subsite of lang in a worker process'''
+    global _WORKER
+    _WORKER = (connection, semaphore)
+    # generators of the main site were inherited from the parent
+    _GENERATOR_DB.clear()
+    del _SUBSITE_WORKERS[:]
+    semaphore.acquire()
+    try:
+        with temporary_locale():
+            cls = get_pelican_cls(settings)
+            cls(settings).run()
+    except BaseException:
+        connection.send(('error', traceback.format_exc()))
+    else:
+        connection.send(('done', None))
+    finally:
+        semaphore.release()
+        connection.close()
+
+
+def exchange_native_urls():
+    '''Merge step of a worker, run when its content is ready to be written
+
+    Sends the native URLs of the content of this subsite to the main
+    process and waits for those of all sites to interlink generators.
+    '''
+    connection, semaphore = _WORKER
+    semaphore.release()
+    connection.send(('urls', dict(_NATIVE_CONTENT_URL_DB)))
+    _NATIVE_CONTENT_URL_DB.update(connection.recv())
+    semaphore.acquire()
+    update_generators()
+
+
+def terminate_subsite_workers():
+    for lang, process, connection in _SUBSITE_WORKERS:
+        process.terminate()
+        process.join()
+        connection.close()
+    del _SUBSITE_WORKERS[:]
+
+
+class SubsiteWorkersGenerator(object):
+    '''Waits for the subsite workers when the main site writes its output
+
+    Pelican runs generators from get_generators before the
+    StaticGenerator and sends ``finalized`` only after all of them, so
+    the plugins run on ``finalized`` find every subsite written.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_output(self, writer):
+        join_subsite_workers()
+
+
+def join_subsite_workers(pelican_obj=None):
+    '''Wait for the subsites generated in worker processes'''
+    if not _SUBSITE_WORKERS or _WORKER is not None:
+        return
+    errors = []
+    for lang, process, connection in _SUBSITE_WORKERS:
+        try:
+            status, payload = connection.recv()
+        except EOFError:
+            status, payload = 'error', 'worker exited unexpectedly'
+        process.join()
+        connection.close()
+        if status != 'done':
+            errors.append("i18n subsite for language '{}' failed:\n{}".format(
+                lang, payload))
+    del _SUBSITE_WORKERS[:]
+    if errors:
+        raise RuntimeError('\n'.join(errors))
+
+
 # map: signal name -> function name
 _SIGNAL_HANDLERS_DB = {
     'get_generators': initialize_plugin,
@@ -432,6 +632,7 @@ _SIGNAL_HANDLERS_DB = {
     'get_writer': create_next_subsite,
     'static_generator_finalized': save_main_static_files,
     'generator_init': save_generator,
+    'finalized': join_subsite_workers,
 }
 
 
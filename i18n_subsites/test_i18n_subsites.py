@@ -47,7 +47,17 @@ class TestSettingsManipulation(unittest.TestCase):
         '''Test that we get correct class given by string'''
         cls = i18ns.get_pelican_cls(self.settings)
         self.assertIs(cls, Pelican)
-        
+
+    def test_subsite_processes(self):
+        '''Test that subsites are generated serially by default'''
+        self.assertEqual(i18ns.subsite_processes(self.settings), 1)
+        self.assertFalse(i18ns.shared_content_cache(self.settings))
+        self.settings['I18N_SUBSITES_PROCESSES'] = 4
+        self.assertEqual(i18ns.subsite_processes(self.settings), 4)
+        self.assertFalse(i18ns.shared_content_cache(self.settings))
+        self.settings['I18N_SHARED_CONTENT_CACHE'] = True
+        self.assertTrue(i18ns.shared_content_cache(self.settings))
+
 
 class TestSitesRelpath(unittest.TestCase):
     '''Test relative path between sites generation'''
@@ -79,6 +89,7 @@ class TestRegistration(unittest.TestCase):
     def test_return_on_missing_signal(self):
         '''Test return on missing required signal'''
         i18ns._SIGNAL_HANDLERS_DB['tmp_sig'] = None
+        self.addCleanup(i18ns._SIGNAL_HANDLERS_DB.pop, 'tmp_sig')
         i18ns.register()
         self.assertNotIn(id(i18ns.save_generator),
                          i18ns.signals.generator_init.receivers)
@@ -106,6 +117,39 @@ class TestFullRun(unittest.TestCase):
         rmtree(self.temp_path)
         rmtree(self.temp_cache)
 
+    def generate(self, output_path, cache_path, **overrides):
+        '''Generate the test sites with settings overrides'''
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        base_path = os.path.join(base_path, 'test_data')
+        override = {
+            'PATH': os.path.join(base_path, 'content'),
+            'OUTPUT_PATH': output_path,
+            'CACHE_PATH': cache_path,
+            'PLUGINS': [i18ns],
+            }
+        override.update(overrides)
+        settings = read_settings(
+            path=os.path.join(base_path, 'pelicanconf.py'), override=override)
+        Pelican(settings).run()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'parallel subsites need fork')
+    def test_parallel_sites_generation(self):
+        '''Test that subsites generated in workers match serial ones'''
+        parallel_path = mkdtemp(prefix='pelicantests.')
+        self.addCleanup(rmtree, parallel_path)
+        self.generate(self.temp_path, os.path.join(self.temp_cache, 'serial'))
+        self.generate(parallel_path, os.path.join(self.temp_cache, 'parallel'),
+                      I18N_SUBSITES_PROCESSES=2,
+                      I18N_SHARED_CONTENT_CACHE=True)
+        self.assertFalse(i18ns._SUBSITE_WORKERS)
+
+        out, err = subprocess.Popen(
+            ['git', 'diff', '--no-index', '--no-ext-diff', '--exit-code',
+             self.temp_path, parallel_path], env={'PAGER': ''},
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        self.assertFalse(out, 'non-empty `diff` stdout:\n{}'.format(out))
+        self.assertFalse(err, 'non-empty `diff` stderr:\n{}'.format(err))
+
     def test_sites_generation(self):
         '''Test generation of sites with the plugin
 
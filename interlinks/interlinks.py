@@ -8,47 +8,78 @@ This plugin allows you to include "interwiki" or shortcuts links into the blog,
 
 """
 
-from bs4 import BeautifulSoup
 from pelican import signals
 import re
 
 interlinks = {}
 
+# matches the attributes using a keyword, built from the settings
+interlinks_re = None
+keyword_re = None
+
+# an opening tag, its attributes may contain quoted '>'
+TAG = re.compile(r'''<([a-zA-Z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>''')
+ATTRIBUTE = re.compile(
+	r'''(\s(href|src)\s*=\s*)("[^"]*"|'[^']*'|[^\s"'>]+)''', re.IGNORECASE)
+
 def getSettings (generator):
 
-	global interlinks
+	global interlinks, interlinks_re, keyword_re
 
 	interlinks = {'this': generator.settings['SITEURL']+"/"}
 	if 'INTERLINKS' in generator.settings:
 		for key, value in generator.settings['INTERLINKS'].items():
 			interlinks[key] = value
 
+	# the keyword is all the url up to the first '>', which is escaped in
+	# the output of most readers
+	keywords = '|'.join(re.escape(key) for key in
+		sorted(interlinks, key=len, reverse=True))
+	interlinks_re = re.compile(
+		r'''(?:href|src)\s*=\s*["']?(?:%s)(?:>|&gt;)''' % keywords,
+		re.IGNORECASE)
+	keyword_re = re.compile(r'''^["']?(%s)(?:>|&gt;)''' % keywords)
+
+def escape(url, quote):
+	url = url.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+	if quote:
+		url = url.replace(quote, '&quot;' if quote == '"' else '&#x27;')
+	return url
+
+def replace_attribute(m, tag):
+
+	name = m.group(2).lower()
+	if name == 'src' and tag != 'img':
+		return m.group(0)
+	value = m.group(3)
+	keyword = keyword_re.match(value)
+	if not keyword:
+		return m.group(0)
+	keyword = keyword.group(1)
+	quote = value[0] if value[0] in '"\'' else ''
+	url = escape(interlinks[keyword], quote)
+	value = value.replace(keyword+">", url).replace(keyword+"&gt;", url)
+	return m.group(1) + value
+
+def replace_tag(m):
+
+	tag = m.group(1).lower()
+	attributes = ATTRIBUTE.sub(lambda a: replace_attribute(a, tag), m.group(2))
+	return '<' + m.group(1) + attributes + '>'
+
+def interlink(content):
+	"""Replace the keywords of the href and src attributes of content,
+	leaving everything else as it is"""
+
+	if interlinks_re is None or not interlinks_re.search(content):
+		return content
+	return TAG.sub(replace_tag, content)
+
 def content_object_init(instance):
 
 	if instance._content is not None:
-		content = instance._content
-		# use Python's built-in parser so no duplicated html & body tags appear, or use tag.unwrap()
-		text = BeautifulSoup(content, "html.parser")
-		
-		if 'a' in content:
-			for link in text.find_all(href=re.compile("(.+?)>")):
-				url = link.get('href')
-				m = re.search(r"(.+?)>", url).groups()
-				name = m[0]
-				if name in interlinks:
-					hi = url.replace(name+">",interlinks[name])
-					link['href'] = hi
-		if 'img' in content:
-			for img in text.find_all('img', src=re.compile("(.+?)>")):
-				url = img.get('src')
-				m = re.search(r"(.+?)>", url).groups()
-				name = m[0]
-				if name in interlinks:
-					hi = url.replace(name+">",interlinks[name])
-					img['src'] = hi
-
-		instance._content = text.decode()
+		instance._content = interlink(instance._content)
 
 def register():
 	signals.generator_init.connect(getSettings)
-	signals.content_object_init.connect(content_object_init)
\ No newline at end of file
+	signals.content_object_init.connect(content_object_init)
@@ -87,7 +87,7 @@ def get_diag(code, command):
         tmpdir = tempfile.mkdtemp()
         fd, diag_name = tempfile.mkstemp(dir=tmpdir)
 
-        f = os.fdopen(fd, "w")
+        f = os.fdopen(fd, "wb")
         f.write(code.encode('utf-8'))
         f.close()
 
@@ -120,6 +120,26 @@ def get_diag(code, command):
     return data
 
 
+DIAG_MODULES = {
+    'blockdiag': 'blockdiag',
+    'diagram': 'blockdiag',
+    'seqdiag': 'seqdiag',
+    'actdiag': 'actdiag',
+    'nwdiag': 'nwdiag',
+    'packetdiag': 'nwdiag',
+    'rackdiag': 'nwdiag',
+}
+
+
+def diag_version(command):
+    """ Version of the package that draws command diagrams """
+    try:
+        module = __import__(DIAG_MODULES[command])
+    except (KeyError, ImportError):
+        return ''
+    return getattr(module, '__version__', '')
+
+
 def diag(code, command):
     if command == "blockdiag":                      # blockdiag
         import blockdiag.command
@@ -163,12 +183,19 @@ def blockdiag_parser(preprocessor, tag, markup):
         diagram = m.group('diagram').strip()
         code = markup
 
-        # Run command
-        output = diag(code, diagram)
+        def render():
+            # Run command
+            output = diag(code, diagram)
+
+            if output:
+                # Return Base64 encoded image
+                return '<span class="blockdiag" style="align: center;"><img src="data:image/png;base64,%s"></span>' % base64.b64encode(output).decode('utf-8')
+            return None
 
-        if output:
-            # Return Base64 encoded image
-            return '<span class="blockdiag" style="align: center;"><img src="data:image/png;base64,%s"></span>' % base64.b64encode(output)
+        if diagram not in DIAG_MODULES:
+            return render()
+        return preprocessor.render_cached(tag, markup, render,
+                                          version=diag_version(diagram))
     else:
         raise ValueError('Error processing input. '
                          'Expected syntax: {0}'.format(SYNTAX))
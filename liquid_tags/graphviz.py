@@ -50,9 +50,15 @@ Output
 """
 
 import base64
+import os
 import re
 from .mdx_liquid_tags import LiquidTags
 
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
 SYNTAX = '{% dot graphviz [program] [dot code] %}'
 DOT_BLOCK_RE = re.compile(r'^\s*(?P<program>\w+)\s*\{\s*(?P<code>.*\})\s*\}$', re.MULTILINE | re.DOTALL)
 
@@ -101,6 +107,17 @@ def run_graphviz(program, code, options=[], format='png'):
     return stdout
 
 
+def program_version(program):
+    """ Identifies the installed program by its path, size and mtime,
+        without running it
+    """
+    path = which(program)
+    if not path:
+        return program
+    stat = os.stat(path)
+    return '%s:%d:%d' % (path, stat.st_size, stat.st_mtime)
+
+
 @LiquidTags.register('graphviz')
 def graphviz_parser(preprocessor, tag, markup):
     """ Simple Graphviz parser """
@@ -112,11 +129,15 @@ def graphviz_parser(preprocessor, tag, markup):
         code = m.group('code')
         program = m.group('program').strip()
 
-        # Run specified program with our markup
-        output = run_graphviz(program, code)
+        def render():
+            # Run specified program with our markup
+            output = run_graphviz(program, code)
+
+            # Return Base64 encoded image
+            return '<span class="graphviz" style="text-align: center;"><img src="data:image/png;base64,%s"></span>' % base64.b64encode(output).decode('utf-8')
 
-        # Return Base64 encoded image
-        return '<span class="graphviz" style="text-align: center;"><img src="data:image/png;base64,%s"></span>' % base64.b64encode(output).decode('utf-8')
+        return preprocessor.render_cached(tag, markup, render,
+                                          version=program_version(program))
     else:
         raise ValueError('Error processing input. '
                          'Expected syntax: {0}'.format(SYNTAX))
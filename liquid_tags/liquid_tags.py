@@ -1,5 +1,8 @@
+import os
+import shutil
+
 from pelican import signals
-from .mdx_liquid_tags import LiquidTags, LT_CONFIG
+from .mdx_liquid_tags import LiquidTags, LT_CONFIG, USED_IMAGES
 
 
 def addLiquidTags(gen):
@@ -21,5 +24,23 @@ def addLiquidTags(gen):
         )
 
 
+def copyLiquidTagsImages(pelican):
+    """Copy the images of rendered tags to LIQUID_TAGS_IMAGE_DIR"""
+    image_dir = pelican.settings.get('LIQUID_TAGS_IMAGE_DIR')
+    if not image_dir or not USED_IMAGES:
+        return
+    source = os.path.join(pelican.settings['CACHE_PATH'], 'liquid_tags',
+                          'images')
+    target = os.path.join(pelican.settings['OUTPUT_PATH'], image_dir.strip('/'))
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    for name in USED_IMAGES:
+        # names are content hashes, so an existing file is up to date
+        if not os.path.exists(os.path.join(target, name)):
+            shutil.copyfile(os.path.join(source, name),
+                            os.path.join(target, name))
+
+
 def register():
     signals.initialized.connect(addLiquidTags)
+    signals.finalized.connect(copyLiquidTagsImages)
@@ -9,6 +9,9 @@ Where "tag" is associated with some user-defined extension.
 These result in a preprocess step within markdown that produces
 either markdown or html.
 """
+import base64
+import hashlib
+import json
 import warnings
 import markdown
 import itertools
@@ -19,16 +22,114 @@ from functools import wraps
 # Define some regular expressions
 LIQUID_TAG = re.compile(r'\{%.*?%\}', re.MULTILINE | re.DOTALL)
 EXTRACT_TAG = re.compile(r'(?:\s*)(\S+)(?:\s*)')
+INLINE_IMAGE = re.compile(
+    r'src=(["\'])data:image/(?P<type>png|jpeg|gif|svg\+xml);base64,'
+    r'(?P<data>[A-Za-z0-9+/=\s]+)\1')
 LT_CONFIG = { 'CODE_DIR': 'code',
               'NOTEBOOK_DIR': 'notebooks',
               'FLICKR_API_KEY': 'flickr',
-              'GIPHY_API_KEY': 'giphy'
+              'GIPHY_API_KEY': 'giphy',
+              'LIQUID_TAGS_CACHE': True,
+              'LIQUID_TAGS_IMAGE_DIR': '',
+              'CACHE_PATH': 'cache',
+              'SITEURL': ''
 }
 LT_HELP = { 'CODE_DIR' : 'Code directory for include_code subplugin',
             'NOTEBOOK_DIR' : 'Notebook directory for notebook subplugin',
             'FLICKR_API_KEY': 'Flickr key for accessing the API',
-            'GIPHY_API_KEY': 'Giphy key for accessing the API'
+            'GIPHY_API_KEY': 'Giphy key for accessing the API',
+            'LIQUID_TAGS_CACHE': 'Cache the output of expensive tags',
+            'LIQUID_TAGS_IMAGE_DIR': 'Output directory for tag images, '
+                                     'inline images if empty',
+            'CACHE_PATH': 'Directory of the render cache',
+            'SITEURL': 'Base URL of the tag images'
 }
+RENDER_CACHE_VERSION = 1
+
+# Names of the images referenced by tags rendered in this process, copied
+# to LIQUID_TAGS_IMAGE_DIR once the site is written
+USED_IMAGES = set()
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+    """On-disk cache of the HTML rendered by tags
+
+    Every entry is a separate file named after the hash of the tag name,
+    its markup, the hashes of the files it reads and the version of the
+    tool that renders it, so concurrent builds never rewrite each other's
+    entries. When ``image_dir`` is set, inline base64 images are moved to
+    ``images/`` in the cache and linked from ``image_dir`` instead.
+    """
+    def __init__(self, path, image_dir='', siteurl='', enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.image_dir = image_dir.strip('/')
+        self.siteurl = siteurl
+
+    def key(self, tag, markup, files=(), version=''):
+        files = [file_hash(name) for name in files]
+        key = [RENDER_CACHE_VERSION, tag, markup, files, version,
+               self.image_dir, self.siteurl]
+        return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key + '.json')) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        images = entry.get('images', [])
+        if not all(os.path.exists(self.image_path(name)) for name in images):
+            return None
+        USED_IMAGES.update(images)
+        return entry['html']
+
+    def set(self, key, html):
+        html, images = self.externalize_images(html)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        name = os.path.join(self.path, key + '.json')
+        with open(name + '.tmp', 'w') as f:
+            json.dump({'html': html, 'images': images}, f)
+        os.rename(name + '.tmp', name)
+        return html
+
+    def image_path(self, name):
+        return os.path.join(self.path, 'images', name)
+
+    def externalize_images(self, html):
+        """Replace inline base64 images of html by links to image files"""
+        images = []
+        if not self.image_dir:
+            return html, images
+
+        def replace(match):
+            data = base64.b64decode(''.join(match.group('data').split()))
+            name = '%s.%s' % (hashlib.sha1(data).hexdigest(),
+                              match.group('type').split('+')[0])
+            path = self.image_path(name)
+            if not os.path.exists(path):
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.rename(path + '.tmp', path)
+            images.append(name)
+            USED_IMAGES.add(name)
+            return 'src=%s%s/%s/%s%s' % (match.group(1), self.siteurl,
+                                          self.image_dir, name,
+                                          match.group(1))
+
+        return INLINE_IMAGE.sub(replace, html), images
+
 
 class _LiquidTagsPreprocessor(markdown.preprocessors.Preprocessor):
     _tags = {}
@@ -57,6 +158,25 @@ class _LiquidTagsPreprocessor(markdown.preprocessors.Preprocessor):
         # resplit the lines
         return page.split("\n")
 
+    def render_cached(self, tag, markup, render, files=(), version=''):
+        """Return the output of render(), cached on disk
+
+        :param files: paths of the files the output depends on
+        :param version: version of the tool that renders the output
+        """
+        cache = self.configs.render_cache()
+        if not cache.enabled:
+            html = render()
+            # a tag that failed returns no output, which is not cached
+            return cache.externalize_images(html)[0] if html else html
+        key = cache.key(tag, markup, files, version)
+        html = cache.get(key)
+        if html is None:
+            html = render()
+            if html:
+                html = cache.set(key, html)
+        return html
+
 
 class LiquidTags(markdown.Extension):
     """Wrapper for MDPreprocessor"""
@@ -82,6 +202,16 @@ class LiquidTags(markdown.Extension):
             return func
         return dec
 
+    def render_cache(self):
+        """The render cache of this extension"""
+        if getattr(self, '_render_cache', None) is None:
+            self._render_cache = RenderCache(
+                os.path.join(self.getConfig('CACHE_PATH'), 'liquid_tags'),
+                self.getConfig('LIQUID_TAGS_IMAGE_DIR'),
+                self.getConfig('SITEURL'),
+                self.getConfig('LIQUID_TAGS_CACHE'))
+        return self._render_cache
+
     def extendMarkdown(self, md, md_globals):
         self.htmlStash = md.htmlStash
         md.registerExtension(self)
@@ -83,9 +83,13 @@ except ImportError:
 from pygments.formatters import HtmlFormatter
 
 try:
+    import nbconvert
     from nbconvert.exporters import HTMLExporter
+    # the version of the exporter, part of the cache keys
+    EXPORTER_VERSION = 'nbconvert ' + nbconvert.__version__
 except ImportError:
         from IPython.nbconvert.exporters import HTMLExporter
+        EXPORTER_VERSION = 'IPython ' + IPython.__version__
 
 try:
     from traitlets.config import Config
@@ -314,6 +318,31 @@ def notebook(preprocessor, tag, markup):
         if os.path.exists('pelicanhtml_1.tpl'):
             template_file = 'pelicanhtml_1'
 
+    def render():
+        return convert_notebook(nb_path, c, template_file,
+                                language_applied_highlighter)
+
+    # the header is only written when a notebook is converted
+    if not os.path.exists('_nb_header.html'):
+        body = render()
+    else:
+        files = [nb_path]
+        if os.path.exists(template_file + '.tpl'):
+            files.append(template_file + '.tpl')
+        body = preprocessor.render_cached(
+            tag, markup, render, files=files,
+            version='%s:%s' % (EXPORTER_VERSION, template_file))
+
+    # this will stash special characters so that they won't be transformed
+    # by subsequent processes.
+    body = preprocessor.configs.htmlStash.store(body, safe=True)
+    return body
+
+notebook.header_saved = False
+
+
+def convert_notebook(nb_path, c, template_file, highlighter):
+    """Convert the notebook at nb_path to HTML, saving the header once"""
     if IPYTHON_VERSION >= 2:
         subcell_kwarg = dict(preprocessors=[SubCell])
     else:
@@ -321,7 +350,7 @@ def notebook(preprocessor, tag, markup):
 
     exporter = HTMLExporter(config=c,
                             template_file=template_file,
-                            filters={'highlight2html': language_applied_highlighter},
+                            filters={'highlight2html': highlighter},
                             **subcell_kwarg)
 
     # read and parse the notebook
@@ -350,13 +379,8 @@ def notebook(preprocessor, tag, markup):
             f.write(header)
         notebook.header_saved = True
 
-    # this will stash special characters so that they won't be transformed
-    # by subsequent processes.
-    body = preprocessor.configs.htmlStash.store(body, safe=True)
     return body
 
-notebook.header_saved = False
-
 
 #----------------------------------------------------------------------
 # This import allows notebook to be a Pelican plugin
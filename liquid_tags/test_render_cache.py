@@ -0,0 +1,82 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import markdown
+
+from pelican.tests.support import unittest
+
+from . import mdx_liquid_tags
+from .mdx_liquid_tags import LiquidTags, LT_CONFIG
+
+PIXEL = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk'
+         '+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+CALLS = []
+
+
+@LiquidTags.register('rendercachetest')
+def rendercachetest(preprocessor, tag, markup):
+    def render():
+        CALLS.append(markup)
+        return '<img src="data:image/png;base64,%s">' % PIXEL
+
+    return preprocessor.render_cached(tag, markup, render)
+
+
+@LiquidTags.register('rendercachefailure')
+def rendercachefailure(preprocessor, tag, markup):
+    def render():
+        CALLS.append(markup)
+        return None
+
+    return preprocessor.render_cached(tag, markup, render) or 'failed'
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = mkdtemp(prefix='liquid_tags_cache.')
+        del CALLS[:]
+
+    def tearDown(self):
+        rmtree(self.cache_path)
+
+    def convert(self, text, **settings):
+        configs = dict(LT_CONFIG, CACHE_PATH=self.cache_path, **settings)
+        md = markdown.Markdown(extensions=[LiquidTags(configs)])
+        return md.convert(text)
+
+    def test_cached_output_is_reused(self):
+        first = self.convert('{% rendercachetest one %}')
+        second = self.convert('{% rendercachetest one %}')
+        self.convert('{% rendercachetest two %}')
+
+        self.assertEqual(first, second)
+        self.assertIn('data:image/png;base64,', first)
+        self.assertEqual(CALLS, ['one', 'two'])
+
+    def test_cache_disabled(self):
+        self.convert('{% rendercachetest one %}', LIQUID_TAGS_CACHE=False)
+        self.convert('{% rendercachetest one %}', LIQUID_TAGS_CACHE=False)
+
+        self.assertEqual(CALLS, ['one', 'one'])
+
+    def test_external_images(self):
+        html = self.convert('{% rendercachetest one %}',
+                            LIQUID_TAGS_IMAGE_DIR='images/tags',
+                            SITEURL='http://example.com')
+
+        self.assertNotIn('base64', html)
+        self.assertIn('src="http://example.com/images/tags/', html)
+        name = html.split('/images/tags/')[1].split('"')[0]
+        self.assertTrue(os.path.exists(os.path.join(
+            self.cache_path, 'liquid_tags', 'images', name)))
+        self.assertIn(name, mdx_liquid_tags.USED_IMAGES)
+
+    def test_failure_is_not_cached(self):
+        for _ in range(2):
+            html = self.convert('{% rendercachefailure one %}',
+                                LIQUID_TAGS_IMAGE_DIR='images/tags')
+            self.assertIn('failed', html)
+
+        self.assertEqual(CALLS, ['one', 'one'])
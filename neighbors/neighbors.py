@@ -6,60 +6,107 @@ Neighbor Articles Plugin for Pelican
 This plugin adds ``next_article`` (newer) and ``prev_article`` (older)
 variables to the article's context
 """
+from collections import defaultdict
+from operator import attrgetter
+
 from pelican import signals
 
 
-def iter3(seq):
-    """Generate one triplet per element in 'seq' following PEP-479."""
-    nxt, cur = None, None
-    for prv in seq:
-        if cur:
-            yield nxt, cur, prv
-        nxt, cur = cur, prv
-    # Don't yield anything if empty seq
-    if cur:
-        # Yield last element in seq (also if len(seq) == 1)
-        yield nxt, cur, None
+def translation_map(articles):
+    """Map (article, lang) to the translation of article in lang."""
+    translations = {}
+    for article in articles:
+        for translation in article.translations:
+            translations.setdefault((article, translation.lang), translation)
+    return translations
 
 
-def get_translation(article, prefered_language):
+def get_translation(article, prefered_language, translations=None):
     if not article:
         return None
+    if translations is not None:
+        return translations.get((article, prefered_language), article)
     for translation in article.translations:
         if translation.lang == prefered_language:
             return translation
     return article
 
 
-def set_neighbors(articles, next_name, prev_name):
-    for nxt, cur, prv in iter3(articles):
-        exec("cur.{} = nxt".format(next_name))
-        exec("cur.{} = prv".format(prev_name))
+def plural(name):
+    """'next_article_in_category' -> 'next_articles_in_category'"""
+    return name.replace('_article', '_articles', 1)
+
+
+def set_neighbors(articles, next_name, prev_name, translations=None,
+                  window=0):
+    last = len(articles) - 1
+    for index, cur in enumerate(articles):
+        nxt = articles[index - 1] if index > 0 else None
+        prv = articles[index + 1] if index < last else None
+        setattr(cur, next_name, nxt)
+        setattr(cur, prev_name, prv)
+        if window:
+            newer = articles[max(0, index - window):index][::-1]
+            older = articles[index + 1:index + 1 + window]
+            setattr(cur, plural(next_name), newer)
+            setattr(cur, plural(prev_name), older)
 
         for translation in cur.translations:
-            exec(
-                "translation.{} = get_translation(nxt, translation.lang)"
-                .format(next_name))
-            exec(
-                "translation.{} = get_translation(prv, translation.lang)"
-                .format(prev_name))
+            lang = translation.lang
+            setattr(translation, next_name,
+                    get_translation(nxt, lang, translations))
+            setattr(translation, prev_name,
+                    get_translation(prv, lang, translations))
+            if window:
+                setattr(translation, plural(next_name),
+                        [get_translation(a, lang, translations)
+                         for a in newer])
+                setattr(translation, plural(prev_name),
+                        [get_translation(a, lang, translations)
+                         for a in older])
+
+
+def derive_order(articles, ordered):
+    """Put articles in the order of ordered, the same articles by date"""
+    if ordered is not None and len(ordered) == len(articles):
+        articles[:] = ordered
+    else:
+        articles.sort(key=attrgetter('date'), reverse=True)
 
 
 def neighbors(generator):
-    set_neighbors(generator.articles, 'next_article', 'prev_article')
+    window = generator.settings.get('NEIGHBORS_WINDOW', 0)
+    translations = translation_map(generator.articles)
+    set_neighbors(generator.articles, 'next_article', 'prev_article',
+                  translations, window)
+
+    # Category and subcategory lists follow a single date order, newest
+    # first, instead of being sorted one by one.
+    by_date = sorted(generator.articles, key=attrgetter('date'), reverse=True)
+    by_category = defaultdict(list)
+    by_subcategory = defaultdict(list)
+    for article in by_date:
+        by_category[article.category].append(article)
+        for subcategory in getattr(article, 'subcategories', ()):
+            by_subcategory[subcategory].append(article)
 
     for category, articles in generator.categories:
-        articles.sort(key=lambda x: x.date, reverse=True)
+        derive_order(articles, by_category.get(category))
         set_neighbors(
-            articles, 'next_article_in_category', 'prev_article_in_category')
+            articles, 'next_article_in_category', 'prev_article_in_category',
+            translations, window)
 
     if hasattr(generator, 'subcategories'):
+        # lists of the subcategory tree are already sorted
+        presorted = hasattr(generator, 'subcategory_tree')
         for subcategory, articles in generator.subcategories:
-            articles.sort(key=lambda x: x.date, reverse=True)
+            if not presorted:
+                derive_order(articles, by_subcategory.get(subcategory))
             index = subcategory.name.count('/')
             next_name = 'next_article_in_subcategory{}'.format(index)
             prev_name = 'prev_article_in_subcategory{}'.format(index)
-            set_neighbors(articles, next_name, prev_name)
+            set_neighbors(articles, next_name, prev_name, translations,
+                          window)
 
 
 def register():
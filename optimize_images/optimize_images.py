@@ -5,55 +5,255 @@ Optimized images (jpg and png)
 Assumes that jpegtran and optipng are isntalled on path.
 http://jpegclub.org/jpegtran/
 http://optipng.sourceforge.net/
+Falls back to Pillow when they are not.
 Copyright (c) 2012 Irfan Ahmad (http://i.com.pk)
 """
 
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
 from subprocess import call
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
 
 from pelican import signals
 
 logger = logging.getLogger(__name__)
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # Display command output on DEBUG and TRACE
 SHOW_OUTPUT = logger.getEffectiveLevel() <= logging.DEBUG
 
 # A list of file types with their respective commands
 COMMANDS = {
-    # '.ext': ('command {flags} {filename', 'silent_flag', 'verbose_flag')
-    '.jpg': ('jpegtran {flags} -copy none -optimize -outfile "{filename}" "{filename}"', '', '-v'),
-    '.png': ('optipng {flags} "{filename}"', '--quiet', ''),
+    # '.ext': ([command, {flags}, args with {filename}], 'silent_flag', 'verbose_flag')
+    '.jpg': (['jpegtran', '{flags}', '-copy', 'none', '-optimize', '-outfile', '{filename}', '{filename}'], '', '-v'),
+    '.png': (['optipng', '{flags}', '{filename}'], '--quiet', ''),
+}
+
+# Options given to Pillow's save() when a command is not available
+PILLOW_OPTIONS = {
+    '.jpg': {'format': 'JPEG', 'optimize': True, 'quality': 'keep'},
+    '.png': {'format': 'PNG', 'optimize': True},
 }
 
+MANIFEST_NAME = 'optimize_images.json'
+REPORT_NAME = 'optimize_images_report.json'
+
 
 def optimize_images(pelican):
     """
     Optimized jpg and png images
 
+    Images whose content is the output of a previous optimization are
+    skipped, and images identical to an original optimized before are
+    restored from the cache instead of being optimized again.
+
     :param pelican: The Pelican instance
     """
-    for dirpath, _, filenames in os.walk(pelican.settings['OUTPUT_PATH']):
+    settings = pelican.settings
+    output_path = settings['OUTPUT_PATH']
+    cache = OptimizeCache(settings) if settings.get('OPTIMIZE_IMAGES_CACHE', True) else None
+    backend = settings.get('OPTIMIZE_IMAGES_BACKEND', 'auto')
+
+    tasks = []
+    for dirpath, _, filenames in os.walk(output_path):
         for name in filenames:
             if os.path.splitext(name)[1] in COMMANDS.keys():
-                optimize(dirpath, name)
+                tasks.append((dirpath, name))
+
+    jobs = settings.get('OPTIMIZE_IMAGES_JOBS', 1)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+
+    def run(task):
+        return optimize_cached(task[0], task[1], cache, backend)
+
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        results = pool.map(run, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = [run(task) for task in tasks]
+
+    report = dict((os.path.relpath(r['path'], output_path), r) for r in results)
+    before = sum(r['before'] for r in results)
+    after = sum(r['after'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    cached = sum(1 for r in results if r['status'] in ('unchanged', 'restored'))
+    logger.info('optimize_images: %d images, %d from cache, %d bytes saved '
+                '(%.1f%%) in %.1fs', len(results), cached, before - after,
+                100.0 * (before - after) / before if before else 0, seconds)
 
-def optimize(dirpath, filename):
+    if cache:
+        cache.save()
+    if settings.get('OPTIMIZE_IMAGES_REPORT', True):
+        write_report(settings['CACHE_PATH'], report)
+
+
+class OptimizeCache(object):
+    """
+    Persistent manifest of optimized images under CACHE_PATH
+
+    Maps the hash of every original to the hash of its optimized version,
+    a copy of which is kept to restore it when the original is copied to
+    the output again.
+    """
+
+    def __init__(self, settings):
+        self.path = os.path.join(settings['CACHE_PATH'], 'optimize_images')
+        self.manifest_path = os.path.join(settings['CACHE_PATH'], MANIFEST_NAME)
+        self.entries = {}
+        self.used = {}
+        try:
+            with open(self.manifest_path) as fd:
+                self.entries = json.load(fd)
+        except (IOError, OSError, ValueError):
+            pass
+        self.originals = {}
+        for original, optimized in self.entries.items():
+            self.originals.setdefault(optimized, []).append(original)
+        # created here, store() runs in the threads of the pool
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def lookup(self, digest):
+        """Return 'optimized' or the cached copy for digest, or None."""
+        if digest in self.originals:
+            for original in self.originals[digest]:
+                self.used[original] = digest
+            return 'optimized'
+        if digest in self.entries:
+            copy = self.blob(digest)
+            if os.path.exists(copy):
+                self.used[digest] = self.entries[digest]
+                return copy
+        return None
+
+    def blob(self, digest):
+        return os.path.join(self.path, digest)
+
+    def store(self, digest, filepath):
+        optimized = file_hash(filepath)
+        shutil.copyfile(filepath, self.blob(digest))
+        self.used[digest] = optimized
+
+    def save(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        else:
+            for name in os.listdir(self.path):
+                if name not in self.used:
+                    os.remove(os.path.join(self.path, name))
+        with open(self.manifest_path + '.tmp', 'w') as fd:
+            json.dump(self.used, fd)
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+
+def write_report(cache_path, report):
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    with open(os.path.join(cache_path, REPORT_NAME), 'w') as fd:
+        json.dump(report, fd, indent=1, sort_keys=True)
+
+
+def file_hash(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as fd:
+        for block in iter(lambda: fd.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def optimize_cached(dirpath, filename, cache, backend='auto'):
+    """
+    Optimize a file unless the cache knows its optimized version.
+
+    :returns: dict with the path, status, sizes before and after, and
+        the seconds spent
+    """
+    filepath = os.path.join(dirpath, filename)
+    started = time.time()
+    before = os.path.getsize(filepath)
+    status = 'optimized'
+    try:
+        digest = cache and file_hash(filepath)
+        found = cache and cache.lookup(digest)
+        if found == 'optimized':
+            status = 'unchanged'
+        elif found:
+            shutil.copyfile(found, filepath)
+            status = 'restored'
+        elif not optimize(dirpath, filename, backend):
+            logger.error('optimize_images: could not optimize %s', filepath)
+            status = 'failed'
+        elif cache:
+            cache.store(digest, filepath)
+    except Exception as e:
+        logger.error('optimize_images: could not optimize %s: %s', filepath, e)
+        status = 'failed'
+    after = os.path.getsize(filepath)
+    seconds = time.time() - started
+    logger.debug('optimize_images: %s %s, %d -> %d bytes in %.3fs',
+                 status, filepath, before, after, seconds)
+    return {'path': filepath, 'status': status, 'before': before,
+            'after': after, 'seconds': seconds}
+
+
+def optimize(dirpath, filename, backend='auto'):
     """
     Check if the name is a type of file that should be optimized.
     And optimizes it if required.
 
     :param dirpath: Path of the file to be optimzed
     :param name: A file name to be optimized
+    :param backend: 'command', 'pillow' or 'auto' to use Pillow only when
+        the command is not installed
+    :returns: whether the file was optimized
     """
     filepath = os.path.join(dirpath, filename)
     logger.info('optimizing %s', filepath)
 
     ext = os.path.splitext(filename)[1]
     command, silent, verbose = COMMANDS[ext]
+    if backend == 'pillow' or (backend == 'auto' and not which(command[0])):
+        optimize_with_pillow(filepath, ext)
+        return True
+
     flags = verbose if SHOW_OUTPUT else silent
-    command = command.format(filename=filepath, flags=flags)
-    call(command, shell=True)
+    command = [arg.format(filename=filepath, flags=flags) for arg in command]
+    return call([arg for arg in command if arg]) == 0
+
+
+def optimize_with_pillow(filepath, ext):
+    """
+    Re-save an image with Pillow's optimizer, keeping it only if smaller.
+    """
+    if Image is None:
+        raise RuntimeError('neither %s nor Pillow is installed' % COMMANDS[ext][0][0])
+    tmp = filepath + '.tmp'
+    image = Image.open(filepath)
+    options = dict(PILLOW_OPTIONS[ext])
+    if image.format != options['format']:
+        options.pop('quality', None)
+    image.save(tmp, **options)
+    image.close()
+    if os.path.getsize(tmp) < os.path.getsize(filepath):
+        os.rename(tmp, filepath)
+    else:
+        os.remove(tmp)
 
 
 def register():
@@ -3,6 +3,32 @@
 (require 'ox)
 
 (defun org->pelican (filename backend)
+  (princ (org->pelican-json filename backend)))
+
+(defun org->pelican-serve (backend)
+  "Export the org files named on the standard input until its end.
+Each line holds the org file and the file to write its JSON to,
+separated by a tab; \"org->pelican:done\" is written to the standard
+error once the JSON is written."
+  (let (line)
+    (while (setq line (ignore-errors (read-from-minibuffer "")))
+      (let* ((names (split-string line "\t"))
+             (filename (car names))
+             (output (cadr names))
+             (json (condition-case err
+                       (org->pelican-json filename backend)
+                     (error (json-encode
+                             (list :error (error-message-string err))))))
+             (buffer (get-file-buffer filename)))
+        ; do not keep the buffer, the file may change before its next export
+        (when buffer
+          (kill-buffer buffer))
+        (let ((coding-system-for-write 'utf-8))
+          (with-temp-file output
+            (insert json)))
+        (message "org->pelican:done")))))
+
+(defun org->pelican-json (filename backend)
   (progn
     (save-excursion
       ; open org file
@@ -22,7 +48,7 @@
             (error "Each page/article must have a #+TITLE: property"))
 
         ; construct the JSON object
-        (princ (json-encode
+        (json-encode
                 (list
                  ; org export environment
                  :title (substring-no-properties
@@ -54,7 +80,6 @@
                  :post (org-export-as backend nil nil t)
                  )
                 )
-               )
         )
       )
     )
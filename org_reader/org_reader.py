@@ -2,7 +2,7 @@
 Org Reader
 ==========
 
-Version 1.1.
+Version 1.2.
 
 Relevant Pelican settings:
 
@@ -16,6 +16,15 @@ Relevant Pelican settings:
 - ORG_READER_BACKEND: Optional. A custom backend to provide to Org. Defaults
   to 'html.
 
+- ORG_READER_WORKERS: Optional. Number of long-lived Emacs processes the org
+  files are exported by, all of them as soon as the generators start reading.
+  Defaults to 0, which runs a new Emacs for each file.
+
+- ORG_READER_CACHE: Optional. Keep the exports in CACHE_PATH/org_reader, by
+  the hash of the org file and of the files it includes with #+INCLUDE or
+  #+SETUPFILE, of the settings file and of the backend.
+  Defaults to True.
+
 To provide metadata to Pelican, the following properties can be defined in
 the org file's header:
 
@@ -42,10 +51,19 @@ the org file's header:
   empty, or if it is not defined at all.
 
 """
+import hashlib
+import io
 import os
 import json
+import re
 import logging
 import subprocess
+import tempfile
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 from pelican import readers
 from pelican import signals
 
@@ -53,12 +71,229 @@ from pelican import signals
 ELISP = os.path.join(os.path.dirname(__file__), 'org_reader.el')
 LOG = logging.getLogger(__name__)
 
+CACHE_VERSION = 1
+
+
+INCLUDE = re.compile(r'^[ \t]*#\+(?:INCLUDE|SETUPFILE):[ \t]*'
+                     r'(?:"([^"]+)"|(\S+))', re.I | re.M)
+
+
+def org_files(filename):
+    """filename and the files it pulls in with #+INCLUDE or #+SETUPFILE,
+    recursively, which the export depends on"""
+    files = [filename]
+    for path in files:
+        try:
+            with io.open(path, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except (IOError, OSError):
+            continue
+        for match in INCLUDE.finditer(text):
+            name = os.path.expanduser(match.group(1) or match.group(2))
+            name = os.path.join(os.path.dirname(path), name)
+            if name not in files:
+                files.append(name)
+    return files
+
+
+class EmacsWorker(object):
+    """A long-lived Emacs exporting the org files it is given one by one"""
+
+    ELISP_SERVE = "(org->pelican-serve {0})"
+    DONE = 'org->pelican:done'
+
+    def __init__(self, command, backend):
+        cmd = command + ['--eval', self.ELISP_SERVE.format(backend)]
+        LOG.debug("OrgReader: starting `{0}`".format(cmd))
+        self.devnull = open(os.devnull, 'w')
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=self.devnull,
+            stderr=subprocess.PIPE, universal_newlines=True)
+
+    def export(self, filename):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.process.stdin.write(filename + '\t' + output + '\n')
+            self.process.stdin.flush()
+            for line in iter(self.process.stderr.readline, ''):
+                if line.rstrip('\n') == self.DONE:
+                    break
+                LOG.debug("OrgReader: emacs: {0}".format(line.rstrip()))
+            else:
+                raise RuntimeError(
+                    "Emacs exited while exporting {0}".format(filename))
+            with io.open(output, encoding='utf-8') as f:
+                json_output = json.load(f)
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+        if 'error' in json_output:
+            # the Emacs is fine, the org file is not
+            raise ValueError("Emacs could not export {0}: {1}".format(
+                filename, json_output['error']))
+        return json_output
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.devnull.close()
+
+
+class OrgExporter(object):
+    """Exports org files to the JSON of `org->pelican`, from the cache, a
+    pool of EmacsWorker or a new Emacs for each file"""
+
+    ELISP_EXEC = "(org->pelican \"{0}\" {1})"
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.command = [settings['ORG_READER_EMACS_LOCATION']]
+        self.command.extend(OrgReader.EMACS_ARGS)
+        elisp = [ELISP]
+        if 'ORG_READER_EMACS_SETTINGS' in settings:
+            self.command.append('-l')
+            self.command.append(settings['ORG_READER_EMACS_SETTINGS'])
+            elisp.insert(0, settings['ORG_READER_EMACS_SETTINGS'])
+        self.command.append('-l')
+        self.command.append(ELISP)
+        self.backend = settings.get('ORG_READER_BACKEND', "'html")
+
+        self.cache_path = None
+        if settings.get('ORG_READER_CACHE', True):
+            self.cache_path = os.path.join(settings['CACHE_PATH'],
+                                           'org_reader')
+        # the exports also depend on the Elisp loaded and on the backend
+        self.version = hashlib.sha1(
+            '{0} {1}'.format(CACHE_VERSION, self.backend).encode('utf-8'))
+        for path in elisp:
+            with open(path, 'rb') as f:
+                self.version.update(f.read())
+
+        self.workers = settings.get('ORG_READER_WORKERS', 0)
+        # a slot for every worker, holding its Emacs once it is started
+        self.idle = Queue()
+        for _ in range(self.workers):
+            self.idle.put(None)
+        self.pool = None
+        self.pending = {}
+
+    def key(self, filename):
+        digest = self.version.copy()
+        for path in org_files(filename):
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            except (IOError, OSError):
+                digest.update(b'missing')
+        return digest.hexdigest()
+
+    def cached(self, key):
+        if self.cache_path:
+            try:
+                with io.open(os.path.join(self.cache_path, key + '.json'),
+                             encoding='utf-8') as f:
+                    return json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+        return None
+
+    def store(self, key, json_output):
+        if not self.cache_path:
+            return
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        path = os.path.join(self.cache_path, key + '.json')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(json.dumps(json_output).encode('utf-8'))
+        os.rename(path + '.tmp', path)
+
+    def export(self, filename):
+        key = self.key(filename)
+        json_output = self.cached(key)
+        if json_output is not None:
+            return json_output
+        pending = self.pending.pop(filename, None)
+        if pending is not None:
+            json_output = pending.get()
+        elif self.workers > 0:
+            json_output = self.export_with_worker(filename)
+        else:
+            json_output = self.export_with_emacs(filename)
+        self.store(key, json_output)
+        return json_output
+
+    def export_with_emacs(self, filename):
+        cmd = self.command + [
+            '--eval', self.ELISP_EXEC.format(filename, self.backend)]
+
+        LOG.debug("OrgReader: running command `{0}`".format(cmd))
+
+        json_result = subprocess.check_output(cmd, universal_newlines=True)
+        return json.loads(json_result)
+
+    def export_with_worker(self, filename):
+        worker = self.idle.get()
+        try:
+            if worker is None:
+                worker = EmacsWorker(self.command, self.backend)
+            return worker.export(filename)
+        except (IOError, OSError, RuntimeError):
+            # do not reuse an Emacs that may be in an unknown state
+            if worker is not None:
+                worker.close()
+                worker = None
+            raise
+        finally:
+            # give the slot back, a new Emacs is started for it if needed
+            self.idle.put(worker)
+
+    def prefetch(self, filenames):
+        """Start exporting the files that are not in the cache"""
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        for filename in filenames:
+            if filename in self.pending or \
+                    self.cached(self.key(filename)) is not None:
+                continue
+            self.pending[filename] = self.pool.apply_async(
+                self.export_with_worker, (filename,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+        # every slot is back once the pool is joined
+        for _ in range(self.workers):
+            worker = self.idle.get()
+            if worker is not None:
+                worker.close()
+            self.idle.put(None)
+
+
+_exporter = None
+
+
+def get_exporter(settings):
+    global _exporter
+    if _exporter is not None and _exporter.settings is not settings:
+        _exporter.close()
+        _exporter = None
+    if _exporter is None:
+        _exporter = OrgExporter(settings)
+    return _exporter
+
 
 class OrgReader(readers.BaseReader):
     enabled = True
 
     EMACS_ARGS = ["-Q", "--batch"]
-    ELISP_EXEC = "(org->pelican \"{0}\" {1})"
+    ELISP_EXEC = OrgExporter.ELISP_EXEC
 
     file_extensions = ['org']
 
@@ -69,25 +304,8 @@ class OrgReader(readers.BaseReader):
 
     def read(self, filename):
         LOG.info("Reading Org file {0}".format(filename))
-        cmd = [self.settings['ORG_READER_EMACS_LOCATION']]
-        cmd.extend(self.EMACS_ARGS)
-
-        if 'ORG_READER_EMACS_SETTINGS' in self.settings:
-            cmd.append('-l')
-            cmd.append(self.settings['ORG_READER_EMACS_SETTINGS'])
-
-        backend = self.settings.get('ORG_READER_BACKEND', "'html")
 
-        cmd.append('-l')
-        cmd.append(ELISP)
-
-        cmd.append('--eval')
-        cmd.append(self.ELISP_EXEC.format(filename, backend))
-
-        LOG.debug("OrgReader: running command `{0}`".format(cmd))
-
-        json_result = subprocess.check_output(cmd, universal_newlines=True)
-        json_output = json.loads(json_result)
+        json_output = get_exporter(self.settings).export(filename)
 
         # get default slug from .org filename
         default_slug, _ = os.path.splitext(os.path.basename(filename))
@@ -121,5 +339,36 @@ def add_reader(readers):
     readers.reader_classes['org'] = OrgReader
 
 
+def prefetch(generator, paths, excludes):
+    if 'ORG_READER_EMACS_LOCATION' not in generator.settings:
+        return
+    exporter = get_exporter(generator.settings)
+    if exporter.workers <= 0:
+        return
+    files = generator.get_files(generator.settings[paths],
+                                exclude=generator.settings[excludes],
+                                extensions=OrgReader.file_extensions)
+    exporter.prefetch([os.path.abspath(os.path.join(generator.path, f))
+                       for f in files])
+
+
+def prefetch_articles(generator):
+    prefetch(generator, 'ARTICLE_PATHS', 'ARTICLE_EXCLUDES')
+
+
+def prefetch_pages(generator):
+    prefetch(generator, 'PAGE_PATHS', 'PAGE_EXCLUDES')
+
+
+def close_exporter(pelican):
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+
+
 def register():
     signals.readers_init.connect(add_reader)
+    signals.article_generator_init.connect(prefetch_articles)
+    signals.page_generator_init.connect(prefetch_pages)
+    signals.finalized.connect(close_exporter)
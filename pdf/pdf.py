@@ -9,12 +9,16 @@ The pdf plugin generates PDF files from reStructuredText and Markdown sources.
 from __future__ import unicode_literals, print_function
 
 from io import open
+from itertools import chain
 from pelican import signals
 from pelican.generators import Generator
 from pelican.readers import MarkdownReader
 
-import os
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +35,53 @@ if 'pyPdf' not in dir(xhtml2pdf.util):
 from rst2pdf.createpdf import RstToPdf
 
 
+CACHE_VERSION = 1
+MANIFEST_NAME = 'pdf.json'
+
+
+def create_pdfcreator(stylesheets, style_path):
+    return RstToPdf(breakside=0,
+                    stylesheets=stylesheets,
+                    style_path=style_path,
+                    raw_html=True)
+
+
+def style_digest(stylesheets, style_path):
+    """Hash of the style settings and of the style sheets they point to"""
+    digest = hashlib.sha1(json.dumps([stylesheets, style_path]).encode('utf-8'))
+    paths = list(stylesheets)
+    for directory in style_path:
+        if os.path.isdir(directory):
+            paths.extend(os.path.join(directory, name)
+                         for name in sorted(os.listdir(directory)))
+    for path in paths:
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+# RstToPdf of the worker processes
+_pdfcreator = None
+
+
+def init_worker(stylesheets, style_path):
+    global _pdfcreator
+    _pdfcreator = create_pdfcreator(stylesheets, style_path)
+
+
+def create_pdf(task, pdfcreator=None):
+    """Write the PDF of (text, output_pdf), returns False on failure"""
+    text, output_pdf = task
+    logger.info(' [ok] writing %s' % output_pdf)
+    try:
+        (pdfcreator or _pdfcreator).createPdf(text=text, output=output_pdf)
+    except Exception as e:
+        logger.error('Could not write %s: %s', output_pdf, e)
+        return False
+    return True
+
+
 class PdfGenerator(Generator):
     "Generate PDFs on the output dir, for all articles and pages"
 
@@ -40,60 +91,55 @@ class PdfGenerator(Generator):
         super(PdfGenerator, self).__init__(*args, **kwargs)
 
         if 'PDF_STYLE_PATH' in self.settings:
-            pdf_style_path = [self.settings['PDF_STYLE_PATH']]
+            self.pdf_style_path = [self.settings['PDF_STYLE_PATH']]
         else:
-            pdf_style_path = []
+            self.pdf_style_path = []
 
         if 'PDF_STYLE' in self.settings:
-            pdf_style = [self.settings['PDF_STYLE']]
+            self.pdf_style = [self.settings['PDF_STYLE']]
         else:
-            pdf_style = []
+            self.pdf_style = []
 
-        self.pdfcreator = RstToPdf(breakside=0,
-                                   stylesheets=pdf_style,
-                                   style_path=pdf_style_path,
-                                   raw_html=True)
+        self.pdfcreator = create_pdfcreator(self.pdf_style,
+                                            self.pdf_style_path)
 
-    def _create_pdf(self, obj, output_path):
-        filename = obj.slug + '.pdf'
-        output_pdf = os.path.join(output_path, filename)
-        mdreader = MarkdownReader(self.settings)
+    def _get_text(self, obj):
+        """The reStructuredText rst2pdf converts to the PDF of obj"""
         _, ext = os.path.splitext(obj.source_path)
         if ext == '.rst':
             with open(obj.source_path, encoding='utf-8') as f:
                 text = f.read()
             header = ''
-        elif ext[1:] in mdreader.file_extensions and mdreader.enabled:
-            text, meta = mdreader.read(obj.source_path)
+        elif ext[1:] in MarkdownReader.file_extensions and \
+                MarkdownReader.enabled:
+            # Pelican already rendered the HTML of the document, there is
+            # no need to read it again
+            text = obj.content
             header = ''
 
-            if 'title' in meta:
-                title = meta['title']
+            title = obj.metadata.get('title')
+            if title:
                 header = title + '\n' + '#' * len(title) + '\n\n'
-                del meta['title']
 
-            for k in meta.keys():
-                # We can't support all fields, so we strip the ones that won't
-                # look good
-                if k not in self.supported_md_fields:
-                    del meta[k]
+            # We can't support all fields, so we keep only the ones that
+            # will look good
+            meta = [(k, obj.metadata[k]) for k in self.supported_md_fields
+                    if k in obj.metadata]
 
-            header += '\n'.join([':%s: %s' % (k, meta[k]) for k in meta])
+            header += '\n'.join([':%s: %s' % (k, v) for k, v in meta])
             header += '\n\n.. raw:: html\n\n\t'
             text = text.replace('\n', '\n\t')
 
             # rst2pdf casts the text to str and will break if it finds
             # non-escaped characters. Here we nicely escape them to XML/HTML
             # entities before proceeding
-            text = text.encode('ascii', 'xmlcharrefreplace')
+            text = text.encode('ascii', 'xmlcharrefreplace').decode('ascii')
         else:
             # We don't support this format
             logger.warn('Ignoring unsupported file ' + obj.source_path)
-            return
+            return None
 
-        logger.info(' [ok] writing %s' % output_pdf)
-        self.pdfcreator.createPdf(text=(header+text),
-                                  output=output_pdf)
+        return header + text
 
     def generate_context(self):
         pass
@@ -110,11 +156,74 @@ class PdfGenerator(Generator):
                 logger.error("Couldn't create the pdf output folder in " +
                              pdf_path)
 
-        for article in self.context['articles']:
-            self._create_pdf(article, pdf_path)
+        manifest_path = None
+        cached = {}
+        if self.settings.get('PDF_CACHE', True):
+            manifest_path = os.path.join(self.settings['CACHE_PATH'],
+                                         MANIFEST_NAME)
+            cached = load_manifest(manifest_path)
+
+        # PDFs whose text and style sheets did not change are not written
+        # again
+        style = style_digest(self.pdf_style, self.pdf_style_path)
+        entries = {}
+        tasks = []
+        for obj in chain(self.context['articles'], self.context['pages']):
+            text = self._get_text(obj)
+            if text is None:
+                continue
+            filename = obj.slug + '.pdf'
+            output_pdf = os.path.join(pdf_path, filename)
+            digest = hashlib.sha1(json.dumps(
+                [CACHE_VERSION, style, text]).encode('utf-8')).hexdigest()
+            entries[filename] = digest
+            if cached.get(filename) == digest and os.path.exists(output_pdf):
+                logger.debug('Skipping unchanged %s', output_pdf)
+                continue
+            tasks.append((text, output_pdf))
+
+        jobs = self.settings.get('PDF_JOBS', 0)
+        if jobs <= 0:
+            jobs = multiprocessing.cpu_count()
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(
+                min(jobs, len(tasks)), init_worker,
+                (self.pdf_style, self.pdf_style_path))
+            try:
+                results = pool.map(create_pdf, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [create_pdf(task, self.pdfcreator) for task in tasks]
+
+        for (text, output_pdf), written in zip(tasks, results):
+            if not written:
+                entries.pop(os.path.basename(output_pdf), None)
+
+        if manifest_path:
+            save_manifest(manifest_path, entries)
 
-        for page in self.context['pages']:
-            self._create_pdf(page, pdf_path)
+
+def load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('pdfs', {})
+
+
+def save_manifest(path, entries):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(json.dumps({'version': CACHE_VERSION,
+                            'pdfs': entries}).encode('utf-8'))
+    os.rename(path + '.tmp', path)
 
 
 def get_generators(generators):
@@ -20,6 +20,7 @@ class TestPdfGeneration(unittest.TestCase):
             'PATH': os.path.join(os.path.dirname(CUR_DIR), '..', 'test_data',
                                  'content'),
             'OUTPUT_PATH': self.temp_path,
+            'CACHE_PATH': os.path.join(self.temp_path, 'cache'),
             'PLUGINS': [pdf],
             'LOCALE': locale.normalize('en_US'),
         }
@@ -27,6 +28,9 @@ class TestPdfGeneration(unittest.TestCase):
             settings.update(override)
 
         self.settings = read_settings(override=settings)
+        self.run_pelican()
+
+    def run_pelican(self):
         pelican = Pelican(settings=self.settings)
 
         try:
@@ -46,3 +50,10 @@ class TestPdfGeneration(unittest.TestCase):
         if MarkdownReader.enabled:
             assert os.path.exists(os.path.join(self.temp_path, 'pdf',
                                   'a-markdown-powered-article.pdf'))
+
+    def test_unchanged_pdfs_are_not_written_again(self):
+        output_pdf = os.path.join(self.temp_path, 'pdf',
+                                  'this-is-a-super-article.pdf')
+        os.utime(output_pdf, (0, 0))
+        self.run_pelican()
+        self.assertEqual(os.path.getmtime(output_pdf), 0)
@@ -6,6 +6,7 @@ Author: Bernhard Scheirle
 from __future__ import unicode_literals
 
 import logging
+import multiprocessing
 import os
 
 import hashlib
@@ -27,7 +28,8 @@ _identicon_data = None
 _identicon_size = None
 _initialized = False
 _authors = None
-_missingAvatars = []
+_missingAvatars = set()
+_jobs = 1
 
 
 def _ready():
@@ -39,7 +41,7 @@ def _ready():
 
 
 def init(pelican_output_path, identicon_output_path, identicon_data,
-         identicon_size, authors):
+         identicon_size, authors, jobs=1):
     global _identicon_save_path
     global _identicon_output_path
     global _identicon_data
@@ -47,6 +49,7 @@ def init(pelican_output_path, identicon_output_path, identicon_data,
     global _initialized
     global _authors
     global _missingAvatars
+    global _jobs
 
     _identicon_save_path = os.path.join(pelican_output_path,
                                         identicon_output_path)
@@ -54,7 +57,8 @@ def init(pelican_output_path, identicon_output_path, identicon_data,
     _identicon_data = identicon_data
     _identicon_size = identicon_size
     _authors = authors
-    _missingAvatars = []
+    _missingAvatars = set()
+    _jobs = jobs or multiprocessing.cpu_count()
     _initialized = True
 
 
@@ -88,18 +92,47 @@ def getAvatarPath(comment_id, metadata):
 
     code = md5.hexdigest()
 
-    if not code in _missingAvatars:
-        _missingAvatars.append(code)
+    _missingAvatars.add(code)
 
     return os.path.join(_identicon_output_path, '%s.png' % code)
 
 
+def _avatarExists(avatar_save_path, size):
+    if not os.path.exists(avatar_save_path):
+        return False
+    # identicons only depend on their code and size
+    side = int(size * 3)
+    try:
+        with identicon.Image.open(avatar_save_path) as image:
+            return image.size == (side, side)
+    except IOError:
+        return False
+
+
+def _renderAvatar(task):
+    code, size, avatar_save_path = task
+    avatar = identicon.render_identicon(int(code, 16), size)
+    avatar.save(avatar_save_path, 'PNG')
+
+
 def generateAndSaveMissingAvatars():
     _createIdenticonOutputFolder()
     global _missingAvatars
-    for code in _missingAvatars:
+    tasks = []
+    for code in sorted(_missingAvatars):
         avatar_path = '%s.png' % code
-        avatar = identicon.render_identicon(int(code, 16), _identicon_size)
         avatar_save_path = os.path.join(_identicon_save_path, avatar_path)
-        avatar.save(avatar_save_path, 'PNG')
-    _missingAvatars = []
+        if not _avatarExists(avatar_save_path, _identicon_size):
+            tasks.append((code, _identicon_size, avatar_save_path))
+
+    if _jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(_jobs, len(tasks)))
+        try:
+            pool.map(_renderAvatar, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            _renderAvatar(task)
+    _missingAvatars = set()
@@ -11,6 +11,10 @@ from __future__ import unicode_literals
 import logging
 import os
 import copy
+import hashlib
+import json
+import pickle
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +27,123 @@ from . comment import Comment
 from . import avatars
 
 
-__version__ = "1.3.0"
+__version__ = "1.4.0"
 
 
 _all_comments = []
 _pelican_writer = None
 _pelican_obj = None
+_comment_store = None
+_comment_folders = None
+_comment_readers = None
+
+STORE_VERSION = 1
+STORE_NAME = 'pelican_comment_system.pickle'
+# Settings that change how comment files are read, or feeds are written
+STORE_SETTINGS = ('MARKDOWN', 'TYPOGRIFY', 'TYPOGRIFY_IGNORE_TAGS',
+                  'DEFAULT_DATE', 'DEFAULT_LANG', 'TIMEZONE', 'READERS',
+                  'FORMATTED_FIELDS', 'DOCUTILS_SETTINGS', 'PATH_METADATA',
+                  'FILENAME_METADATA', 'SITEURL', 'SITENAME', 'FEED_DOMAIN',
+                  'FEED_MAX_ITEMS', 'COMMENT_URL',
+                  'PELICAN_COMMENT_SYSTEM_FEED')
+
+
+def stable_repr(value):
+    # drop the addresses of objects, such as Markdown extension instances
+    return re.sub(r' at 0x[0-9a-fA-F]+', '', repr(value))
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CommentStore(object):
+    """
+    Output of the readers for every comment file, and the signature of every
+    comment feed, kept in CACHE_PATH between builds.
+
+    Comments whose file hash is unchanged are built from the stored content
+    and metadata instead of being read again, and feeds whose comments are
+    unchanged are not written again while the file exists.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = os.path.join(settings['CACHE_PATH'], STORE_NAME)
+        self.key = hashlib.sha1(json.dumps(
+            [STORE_VERSION, __version__] +
+            [stable_repr(settings.get(name)) for name in STORE_SETTINGS]
+        ).encode('utf-8')).hexdigest()
+        self.comments = {}
+        self.feeds = {}
+        self.hashes = {}
+        self.used_comments = {}
+        self.used_feeds = {}
+        if settings.get('PELICAN_COMMENT_SYSTEM_CACHE', True):
+            self.load()
+        else:
+            self.path = None
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return
+        if data.get('key') == self.key:
+            self.comments = data['comments']
+            self.feeds = data['feeds']
+
+    def save(self):
+        if not self.path:
+            return
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        try:
+            with open(self.path + '.tmp', 'wb') as f:
+                pickle.dump({'key': self.key,
+                             'comments': self.used_comments,
+                             'feeds': self.used_feeds}, f, -1)
+        except Exception as e:
+            logger.warning('Cannot save the comment store: %s', e)
+            return
+        os.rename(self.path + '.tmp', self.path)
+
+    def read(self, reader, folder, filename, context):
+        path = os.path.join(folder, filename)
+        digest = file_hash(path)
+        self.hashes[path] = digest
+        entry = self.comments.get(path)
+        if entry and entry[0] == digest:
+            self.used_comments[path] = entry
+            return Comment(content=entry[1], metadata=entry[2],
+                           settings=self.settings, source_path=entry[3],
+                           context=context)
+
+        def record(content, metadata, settings, source_path, context):
+            self.used_comments[path] = (digest, content, metadata, source_path)
+            return Comment(content=content, metadata=metadata,
+                           settings=settings, source_path=source_path,
+                           context=context)
+        record.__name__ = Comment.__name__
+
+        return reader.read_file(base_path=folder, path=filename,
+                                content_class=record, context=context)
+
+    def feed_changed(self, path, content, items):
+        """Record the signature of a feed, return False if unchanged"""
+        signature = hashlib.sha1(json.dumps(
+            [content.url, content.title] +
+            [[item.source_path, self.hashes.get(item.source_path)]
+             for item in items]).encode('utf-8')).hexdigest()
+        self.used_feeds[path] = signature
+        output = os.path.join(self.settings['OUTPUT_PATH'], path)
+        return self.feeds.get(path) != signature or \
+            not os.path.exists(output)
 
 def setdefault(pelican, settings):
     from pelican.settings import DEFAULT_CONFIG
@@ -51,6 +166,8 @@ def pelican_initialized(pelican):
         ('PELICAN_COMMENT_SYSTEM_IDENTICON_DATA', ()),
         ('PELICAN_COMMENT_SYSTEM_IDENTICON_SIZE', 72),
         ('PELICAN_COMMENT_SYSTEM_AUTHORS', {}),
+        ('PELICAN_COMMENT_SYSTEM_IDENTICON_JOBS', 0),
+        ('PELICAN_COMMENT_SYSTEM_CACHE', True),
         ('PELICAN_COMMENT_SYSTEM_FEED', os.path.join('feeds', 'comment.%s.atom.xml')),
         ('PELICAN_COMMENT_SYSTEM_FEED_ALL', os.path.join('feeds', 'comments.all.atom.xml')),
         ('COMMENT_URL', '#comment-{slug}')
@@ -80,13 +197,18 @@ def initialize(article_generator):
         article_generator.settings[
             'PELICAN_COMMENT_SYSTEM_IDENTICON_SIZE'] / 3,
         article_generator.settings['PELICAN_COMMENT_SYSTEM_AUTHORS'],
+        article_generator.settings['PELICAN_COMMENT_SYSTEM_IDENTICON_JOBS'],
     )
 
     # Reset old states (autoreload mode)
     global _all_comments
     global _pelican_writer
+    global _comment_store
+    global _comment_folders
     _pelican_writer = _pelican_obj.get_writer()
     _all_comments = []
+    _comment_store = CommentStore(article_generator.settings)
+    _comment_folders = None
 
 def warn_on_slug_collision(items):
     slugs = {}
@@ -126,17 +248,52 @@ def write_feed_all(gen, writer):
     writer.write_feed(_all_comments, context, path)
 
 
-def write_feed(gen, items, context, slug):
+def write_feed(gen, items, context, slug, content=None):
     if gen.settings['PELICAN_COMMENT_SYSTEM_FEED'] is None:
         return
 
     path = gen.settings['PELICAN_COMMENT_SYSTEM_FEED'] % slug
+    if content is not None and _comment_store is not None and \
+            not _comment_store.feed_changed(path, content, items):
+        logger.debug("Comment feed unchanged: %s", path)
+        return
+    if context is None:
+        context = comment_context(gen, content)
     _pelican_writer.write_feed(items, context, path)
 
 
+def comment_context(gen, content):
+    # Modify the local context, so we get proper values for the feed
+    context = copy.copy(gen.context)
+    context['SITEURL'] += "/" + content.url
+    context['SITENAME'] += " - Comments: " + content.title
+    context['SITESUBTITLE'] = ""
+    return context
+
+
+def scan_comment_folders(settings):
+    """Map the slug of every article with comments to their folder"""
+    path = os.path.join(settings['PATH'],
+                        settings['PELICAN_COMMENT_SYSTEM_DIR'])
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return {}
+    return dict((name, os.path.join(path, name)) for name in names
+                if os.path.isdir(os.path.join(path, name)))
+
+
 def process_comments(article_generator):
+    if article_generator.settings['PELICAN_COMMENT_SYSTEM'] is not True:
+        return
+
+    global _comment_folders
+    _comment_folders = scan_comment_folders(article_generator.settings)
     for article in article_generator.articles:
         add_static_comments(article_generator, article)
+    _comment_folders = None
+    if _comment_store is not None:
+        _comment_store.save()
 
 def mirror_to_translations(article):
     for translation in article.translations:
@@ -153,33 +310,36 @@ def add_static_comments(gen, content):
     content.comments = []
     mirror_to_translations(content)
 
-    # Modify the local context, so we get proper values for the feed
-    context = copy.copy(gen.context)
-    context['SITEURL'] += "/" + content.url
-    context['SITENAME'] += " - Comments: " + content.title
-    context['SITESUBTITLE'] = ""
-
-    folder = os.path.join(
-        gen.settings['PATH'],
-        gen.settings['PELICAN_COMMENT_SYSTEM_DIR'],
-        content.slug
-    )
-
-    if not os.path.isdir(folder):
+    if _comment_folders is not None:
+        folder = _comment_folders.get(content.slug)
+    else:
+        folder = os.path.join(
+            gen.settings['PATH'],
+            gen.settings['PELICAN_COMMENT_SYSTEM_DIR'],
+            content.slug
+        )
+        if not os.path.isdir(folder):
+            folder = None
+
+    if folder is None:
         logger.debug("No comments found for: %s", content.slug)
-        write_feed(gen, [], context, content.slug)
+        write_feed(gen, [], None, content.slug, content)
         return
 
-    reader = Readers(gen.settings)
+    context = comment_context(gen, content)
+    reader = _readers(gen.settings)
     comments = []
     replies = []
 
     for file in os.listdir(folder):
         name, extension = os.path.splitext(file)
         if extension[1:].lower() in reader.extensions:
-            com = reader.read_file(
-                base_path=folder, path=file,
-                content_class=Comment, context=context)
+            if _comment_store is not None:
+                com = _comment_store.read(reader, folder, file, context)
+            else:
+                com = reader.read_file(
+                    base_path=folder, path=file,
+                    content_class=Comment, context=context)
 
             com.article = content
             _all_comments.append(com)
@@ -193,17 +353,16 @@ def add_static_comments(gen, content):
     feed_items.reverse()
     warn_on_slug_collision(feed_items)
 
-    write_feed(gen, feed_items, context, content.slug)
+    write_feed(gen, feed_items, context, content.slug, content)
 
-    # TODO: Fix this O(n²) loop
+    by_slug = {}
+    for comment in chain(comments, replies):
+        by_slug.setdefault(comment.slug, comment)
     for reply in replies:
-        found_parent = False
-        for comment in chain(comments, replies):
-            if comment.slug == reply.replyto:
-                comment.addReply(reply)
-                found_parent = True
-                break
-        if not found_parent:
+        parent = by_slug.get(reply.replyto)
+        if parent is not None:
+            parent.addReply(reply)
+        else:
             logger.warning('Comment "%s/%s" is a reply to non-existent comment "%s". '
                 'Make sure the replyto attribute is set correctly.',
                 content.slug, reply.slug, reply.replyto)
@@ -220,6 +379,14 @@ def add_static_comments(gen, content):
     mirror_to_translations(content)
 
 
+def _readers(settings):
+    """One Readers instance per settings, instead of one per article"""
+    global _comment_readers
+    if _comment_readers is None or _comment_readers.settings is not settings:
+        _comment_readers = Readers(settings)
+    return _comment_readers
+
+
 def writeIdenticonsToDisk(gen, writer):
     avatars.generateAndSaveMissingAvatars()
 
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import datetime
+import hashlib
 import itertools
 import json
 import logging
@@ -9,7 +10,9 @@ import multiprocessing
 import os
 import pprint
 import re
+import shutil
 import sys
+import time
 
 from pelican.generators import ArticlesGenerator
 from pelican.generators import PagesGenerator
@@ -54,6 +57,10 @@ def initialized(pelican):
     DEFAULT_CONFIG.setdefault('PHOTO_WATERMARK_IMG', '')
     DEFAULT_CONFIG.setdefault('PHOTO_WATERMARK_IMG_SIZE', False)
     DEFAULT_CONFIG.setdefault('PHOTO_RESIZE_JOBS', 1)
+    DEFAULT_CONFIG.setdefault('PHOTO_RESIZE_CACHE', True)
+    DEFAULT_CONFIG.setdefault('PHOTO_RESIZE_CHUNK', 8)
+    DEFAULT_CONFIG.setdefault('PHOTO_RESIZE_MAXTASKS', 0)
+    DEFAULT_CONFIG.setdefault('PHOTO_RESIZE_WORKER_MEMORY', 256 * 1024 * 1024)
     DEFAULT_CONFIG.setdefault('PHOTO_EXIF_KEEP', False)
     DEFAULT_CONFIG.setdefault('PHOTO_EXIF_REMOVE_GPS', False)
     DEFAULT_CONFIG.setdefault('PHOTO_EXIF_AUTOROTATE', True)
@@ -80,6 +87,10 @@ def initialized(pelican):
         pelican.settings.setdefault('PHOTO_WATERMARK_IMG', '')
         pelican.settings.setdefault('PHOTO_WATERMARK_IMG_SIZE', False)
         pelican.settings.setdefault('PHOTO_RESIZE_JOBS', 1)
+        pelican.settings.setdefault('PHOTO_RESIZE_CACHE', True)
+        pelican.settings.setdefault('PHOTO_RESIZE_CHUNK', 8)
+        pelican.settings.setdefault('PHOTO_RESIZE_MAXTASKS', 0)
+        pelican.settings.setdefault('PHOTO_RESIZE_WORKER_MEMORY', 256 * 1024 * 1024)
         pelican.settings.setdefault('PHOTO_EXIF_KEEP', False)
         pelican.settings.setdefault('PHOTO_EXIF_REMOVE_GPS', False)
         pelican.settings.setdefault('PHOTO_EXIF_AUTOROTATE', True)
@@ -253,17 +264,24 @@ def manipulate_exif(img, settings):
     return (img, piexif.dump(exif))
 
 
-def resize_worker(orig, resized, spec, settings):
-
-    logger.info('photos: make photo {} -> {}'.format(orig, resized))
+def open_photo(orig, settings, size=None):
+    """Decodes an original once, ready to be rendered at any size up to `size`."""
     im = Image.open(orig)
 
+    if size and im.format == 'JPEG':
+        # Let libjpeg scale down while decoding, as thumbnail() would do.
+        im.draft(None, (size[0] * 2, size[1] * 2))
+
     if ispiexif and settings['PHOTO_EXIF_KEEP'] and im.format == 'JPEG':  # Only works with JPEG exif for sure.
         im, exif_copy = manipulate_exif(im, settings)
     else:
         exif_copy = b''
 
     icc_profile = im.info.get("icc_profile", None)
+    return im, exif_copy, icc_profile
+
+
+def save_photo(im, resized, spec, settings, exif_copy=b'', icc_profile=None):
     im.thumbnail((spec[0], spec[1]), Image.ANTIALIAS)
     directory = os.path.split(resized)[0]
 
@@ -279,13 +297,207 @@ def resize_worker(orig, resized, spec, settings):
         logger.debug('Directory already exists at {}'.format(os.path.split(resized)[0]))
 
     if settings['PHOTO_WATERMARK']:
-        isthumb = True if spec == settings['PHOTO_THUMB'] else False
+        isthumb = True if tuple(spec) == tuple(settings['PHOTO_THUMB']) else False
         if not isthumb or (isthumb and settings['PHOTO_WATERMARK_THUMB']):
             im = watermark_photo(im, settings)
 
     im.save(resized, 'JPEG', quality=spec[2], icc_profile=icc_profile, exif=exif_copy)
 
 
+def resize_worker(orig, resized, spec, settings):
+
+    logger.info('photos: make photo {} -> {}'.format(orig, resized))
+    im, exif_copy, icc_profile = open_photo(orig, settings)
+    save_photo(im, resized, spec, settings, exif_copy, icc_profile)
+
+
+RESIZE_CACHE_VERSION = 1
+
+RESIZE_SETTINGS = (
+    'PHOTO_THUMB',
+    'PHOTO_ALPHA_BACKGROUND_COLOR',
+    'PHOTO_WATERMARK',
+    'PHOTO_WATERMARK_THUMB',
+    'PHOTO_WATERMARK_TEXT',
+    'PHOTO_WATERMARK_TEXT_COLOR',
+    'PHOTO_WATERMARK_IMG',
+    'PHOTO_WATERMARK_IMG_SIZE',
+    'PHOTO_EXIF_KEEP',
+    'PHOTO_EXIF_REMOVE_GPS',
+    'PHOTO_EXIF_AUTOROTATE',
+    'PHOTO_EXIF_COPYRIGHT',
+    'PHOTO_EXIF_COPYRIGHT_AUTHOR',
+)
+
+
+def file_hash(path, blocksize=65536):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResizeCache(object):
+    """Persistent manifest of resized photos under CACHE_PATH.
+
+    Every output is keyed by the hash of its original plus the full resize
+    spec and the settings that alter the result, so a fresh checkout or a
+    touched mtime does not trigger a re-encode, while a changed quality or
+    watermark does.  A copy of every output is kept next to the manifest
+    and restored when the output folder has been cleaned.
+    """
+
+    def __init__(self, settings):
+        self.path = os.path.join(settings['CACHE_PATH'], 'photos')
+        self.objects = os.path.join(self.path, 'objects')
+        self.manifest_file = os.path.join(self.path, 'manifest.json')
+        self.options = [settings[name] for name in RESIZE_SETTINGS]
+        if settings['PHOTO_WATERMARK'] and settings['PHOTO_WATERMARK_IMG']:
+            self.options.append(file_hash(settings['PHOTO_WATERMARK_IMG']))
+        self.sources = {}
+        self.outputs = {}
+        self.hashed = {}
+        self.used = set()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_file) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            logger.debug('photos: no usable resize manifest at {}'.format(self.manifest_file))
+            return
+        if data.get('version') != RESIZE_CACHE_VERSION:
+            return
+        self.sources = data.get('sources', {})
+        self.outputs = data.get('outputs', {})
+
+    def save(self):
+        outputs = dict((k, v) for k, v in self.outputs.items() if v in self.used)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': RESIZE_CACHE_VERSION,
+                       'sources': self.hashed,
+                       'outputs': outputs}, f)
+        os.rename(tmp, self.manifest_file)
+        self.prune()
+
+    def prune(self):
+        if not os.path.isdir(self.objects):
+            return
+        for name in os.listdir(self.objects):
+            if os.path.splitext(name)[0] not in self.used:
+                os.remove(os.path.join(self.objects, name))
+
+    def source_hash(self, orig):
+        """Content hash of an original, rehashed only if size or mtime moved."""
+        if orig in self.hashed:
+            return self.hashed[orig][2]
+        st = os.stat(orig)
+        known = self.sources.get(orig)
+        if not known or known[0] != st.st_size or known[1] != st.st_mtime:
+            known = [st.st_size, st.st_mtime, file_hash(orig)]
+        self.hashed[orig] = known
+        return known[2]
+
+    def key(self, orig, spec):
+        blob = json.dumps([RESIZE_CACHE_VERSION, self.source_hash(orig), list(spec), self.options],
+                          sort_keys=True, default=repr)
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.objects, key + '.jpg')
+
+    def restore(self, resized, key):
+        """Makes `resized` current for `key`; False if it has to be rendered."""
+        self.used.add(key)
+        if self.outputs.get(resized) == key and os.path.isfile(resized):
+            return True
+        cached = self.object_path(key)
+        if not os.path.isfile(cached):
+            return False
+        directory = os.path.dirname(resized)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        logger.debug('photos: restore {} from cache'.format(resized))
+        shutil.copyfile(cached, resized)
+        self.outputs[resized] = key
+        return True
+
+    def store(self, resized, key):
+        if not os.path.isfile(resized):
+            return
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects)
+        shutil.copyfile(resized, self.object_path(key))
+        self.outputs[resized] = key
+
+
+_worker_settings = {}
+
+
+def resize_settings(settings):
+    """The subset of settings resize workers need, shipped once per worker."""
+    return dict((name, settings[name]) for name in RESIZE_SETTINGS)
+
+
+def init_resize_worker(settings, plugin_dir):
+    _worker_settings.clear()
+    _worker_settings.update(settings)
+    DEFAULT_CONFIG['plugin_dir'] = plugin_dir
+
+
+def resize_group(task):
+    """Renders every requested size of one original from a single decode.
+
+    Returns the original with a list of (resized, seconds, error) tuples, so
+    failures and timings are reported by the parent process.
+    """
+    orig, targets = task
+    settings = _worker_settings
+    results = []
+    started = time.time()
+    try:
+        largest = (max(spec[0] for _, spec in targets), max(spec[1] for _, spec in targets))
+        im, exif_copy, icc_profile = open_photo(orig, settings, largest)
+        im.load()
+    except Exception as e:
+        return orig, [(resized, time.time() - started, repr(e)) for resized, _ in targets]
+
+    for resized, spec in targets:
+        started = time.time()
+        try:
+            save_photo(im.copy(), resized, spec, settings, exif_copy, icc_profile)
+        except Exception as e:
+            results.append((resized, time.time() - started, repr(e)))
+        else:
+            results.append((resized, time.time() - started, None))
+    im.close()
+    return orig, results
+
+
+def available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def resize_jobs(settings):
+    """Worker count; PHOTO_RESIZE_JOBS = 0 sizes the pool from cores and free memory."""
+    jobs = settings['PHOTO_RESIZE_JOBS']
+    if jobs > 0:
+        return jobs
+    jobs = multiprocessing.cpu_count()
+    memory = available_memory()
+    if memory:
+        jobs = min(jobs, memory // settings['PHOTO_RESIZE_WORKER_MEMORY'])
+    return max(1, jobs)
+
+
 def resize_photos(generator, writer):
     if generator.settings['PHOTO_RESIZE_JOBS'] == -1:
         debug = True
@@ -293,19 +505,61 @@ def resize_photos(generator, writer):
     else:
         debug = False
 
-    pool = multiprocessing.Pool(generator.settings['PHOTO_RESIZE_JOBS'])
-    logger.debug('Debug Status: {}'.format(debug))
+    cache = ResizeCache(generator.settings) if generator.settings['PHOTO_RESIZE_CACHE'] else None
+    keys = {}
+
+    pending = {}
     for resized, what in DEFAULT_CONFIG['queue_resize'].items():
         resized = os.path.join(generator.output_path, resized)
         orig, spec = what
-        if (not os.path.isfile(resized) or os.path.getmtime(orig) > os.path.getmtime(resized)):
-            if debug:
-                resize_worker(orig, resized, spec, generator.settings)
-            else:
-                pool.apply_async(resize_worker, (orig, resized, spec, generator.settings))
+        if cache:
+            key = cache.key(orig, spec)
+            if cache.restore(resized, key):
+                continue
+            keys[resized] = key
+        elif os.path.isfile(resized) and os.path.getmtime(orig) <= os.path.getmtime(resized):
+            continue
+        pending.setdefault(orig, []).append((resized, tuple(spec)))
 
-    pool.close()
-    pool.join()
+    settings = resize_settings(generator.settings)
+    tasks = sorted(pending.items())
+    logger.debug('Debug Status: {}'.format(debug))
+    started = time.time()
+    if debug or not tasks:
+        init_resize_worker(settings, DEFAULT_CONFIG['plugin_dir'])
+        results = (resize_group(task) for task in tasks)
+        pool = None
+    else:
+        jobs = min(resize_jobs(generator.settings), len(tasks))
+        logger.info('photos: resizing {} originals with {} workers'.format(len(tasks), jobs))
+        pool = multiprocessing.Pool(
+            jobs, init_resize_worker, (settings, DEFAULT_CONFIG['plugin_dir']),
+            generator.settings['PHOTO_RESIZE_MAXTASKS'] or None)
+        chunksize = max(1, min(generator.settings['PHOTO_RESIZE_CHUNK'], len(tasks) // (jobs * 4)))
+        results = pool.imap_unordered(resize_group, tasks, chunksize)
+
+    made = failed = 0
+    for orig, outputs in results:
+        for resized, seconds, error in outputs:
+            if error:
+                failed += 1
+                logger.error('photos: could not make photo {} -> {}: {}'.format(orig, resized, error))
+                continue
+            made += 1
+            logger.debug('photos: made photo {} -> {} in {:.3f}s'.format(orig, resized, seconds))
+            if cache:
+                cache.store(resized, keys[resized])
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if tasks:
+        logger.info('photos: made {} photos from {} originals in {:.1f}s, {} failed'.format(
+            made, len(tasks), time.time() - started, failed))
+
+    if cache:
+        cache.save()
 
 
 def detect_content(content):
@@ -5,8 +5,9 @@ import os
 from pelican.generators import ArticlesGenerator
 from pelican.tests.support import unittest, get_settings
 from tempfile import mkdtemp
-from shutil import rmtree
+from shutil import copy, rmtree
 import photos
+from pelican.settings import DEFAULT_CONFIG
 
 CUR_DIR = os.path.dirname(__file__)
 
@@ -118,5 +119,64 @@ class TestPhotos(unittest.TestCase):
                 ('./test_data/agallery/night.png', (192, 144, 60)))]
         self.assertEqual(sorted(expected), sorted(photos.queue_resize.items()))
 
+
+class TestResizeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = mkdtemp(prefix='pelicantests.')
+        photos.initialized(None)
+        self.settings = dict((k, v) for k, v in DEFAULT_CONFIG.items()
+                             if k.startswith('PHOTO_'))
+        self.settings['CACHE_PATH'] = os.path.join(self.temp_path, 'cache')
+        self.orig = copy(os.path.join(CUR_DIR, 'test_data', 'agallery', 'best.jpg'),
+                         self.temp_path)
+        self.resized = os.path.join(self.temp_path, 'output', 'best.jpg')
+
+    def tearDown(self):
+        rmtree(self.temp_path)
+
+    def render(self, spec):
+        cache = photos.ResizeCache(self.settings)
+        key = cache.key(self.orig, spec)
+        restored = cache.restore(self.resized, key)
+        if not restored:
+            photos.resize_worker(self.orig, self.resized, spec, self.settings)
+            cache.store(self.resized, key)
+        cache.save()
+        return restored
+
+    def test_unchanged_spec_is_reused(self):
+        self.assertFalse(self.render((64, 64, 80)))
+        os.utime(self.orig, None)
+        self.assertTrue(self.render((64, 64, 80)))
+
+    def test_cleaned_output_is_restored(self):
+        self.render((64, 64, 80))
+        os.remove(self.resized)
+        self.assertTrue(self.render((64, 64, 80)))
+        self.assertTrue(os.path.isfile(self.resized))
+
+    def test_settings_invalidate(self):
+        self.render((64, 64, 80))
+        self.assertFalse(self.render((64, 64, 70)))
+        self.settings['PHOTO_ALPHA_BACKGROUND_COLOR'] = (0, 0, 0)
+        self.assertFalse(self.render((64, 64, 70)))
+
+    def test_resize_group(self):
+        photos.init_resize_worker(photos.resize_settings(self.settings),
+                                  DEFAULT_CONFIG['plugin_dir'])
+        thumb = os.path.join(self.temp_path, 'output', 'bestt.jpg')
+        broken = os.path.join(self.temp_path, 'output', 'missing', '\0.jpg')
+        orig, results = photos.resize_group(
+            (self.orig, [(self.resized, (64, 64, 80)),
+                         (thumb, (16, 16, 60)),
+                         (broken, (16, 16, 60))]))
+        self.assertEqual(self.orig, orig)
+        self.assertEqual([self.resized, thumb, broken], [r[0] for r in results])
+        self.assertEqual([None, None], [r[2] for r in results[:2]])
+        self.assertTrue(results[2][2])
+        self.assertTrue(os.path.isfile(thumb))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,7 +11,14 @@ import sys
 import os
 import tempfile
 import io
-
+import filecmp
+import hashlib
+import json
+import multiprocessing
+import shutil
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen,PIPE
 from zlib import adler32
 
@@ -26,6 +33,203 @@ from .generateUmlDiagram import generate_uml_image
 global_siteurl = "" # URL of the site, filled on plugin initialization
 
 
+TIKZ_HEADER = '\\documentclass{standalone}\n\\usepackage{xeCJK,fontspec,xunicode}\\usepackage{tikz}\\setCJKmainfont{Noto Sans CJK TC}\n%s\n\\begin{document}\\begin{tikzpicture}\n'
+TIKZ_FOOTER = '\n\\end{tikzpicture}\\end{document}'
+
+CACHE_VERSION = 1
+
+
+def run_command(cmdline, cwd=None):
+    """ Run cmdline, returns its return code, output and errors """
+    logger.debug("[plantuml] running: " + ' '.join(cmdline))
+    p = Popen(cmdline, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    out, err = p.communicate()
+    return p.returncode, out, err
+
+
+def render_plantuml(jobs, outopt):
+    """ Render the (source, target) jobs with a single plantuml run.
+
+    Returns None on success, the errors of plantuml otherwise.
+    """
+    workdir = tempfile.mkdtemp()
+    try:
+        names = []
+        for index, (body, target) in enumerate(jobs):
+            name = os.path.join(workdir, '%d.puml' % index)
+            with io.open(name, 'w', encoding='utf-8') as fd:
+                fd.write('@startuml\n' + body + '\n@enduml')
+            names.append(name)
+        returncode, out, err = run_command(
+            ['plantuml', '-o', workdir, outopt] + names)
+        if returncode != 0:
+            return err
+        for index, (body, target) in enumerate(jobs):
+            ext = os.path.splitext(target)[1]
+            shutil.move(os.path.join(workdir, '%d%s' % (index, ext)), target)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def render_tikz(body, libs, target):
+    if libs:
+        libs = '\n'.join(('\\usetikzlibrary{%s}' % x) for x in libs.split(','))
+    else:
+        libs = ''
+    # tikz2svg runs pdflatex in the current directory
+    workdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(workdir, 'tikz.tex')
+        with io.open(name, 'w', encoding='utf-8') as fd:
+            fd.write(TIKZ_HEADER % libs + body + TIKZ_FOOTER)
+        output_path = os.path.join(workdir, 'tikz.svg')
+        returncode, out, err = run_command(['tikz2svg', name, output_path],
+                                           cwd=workdir)
+        logger.debug("tikz2svg out: " + out.decode('utf-8'))
+        logger.debug("tikz2svg err: " + err.decode('utf-8'))
+        if returncode != 0:
+            return err
+        shutil.move(output_path, target)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def render_ditaa(body, option, target):
+    workdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(workdir, 'ditaa.txt')
+        with io.open(name, 'w', encoding='utf-8') as fd:
+            fd.write(body)
+        output_path = os.path.join(workdir, 'ditaa.png')
+        returncode, out, err = run_command(
+            ['ditaa', '-v', '-o', name, output_path])
+        if returncode != 0:
+            return err
+        shutil.move(output_path, target)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+RENDERERS = {
+    'uml': lambda body, outopt, target: render_plantuml([(body, target)], outopt),
+    'tikz': render_tikz,
+    'ditaa': render_ditaa,
+}
+
+
+class DiagramRenderer(object):
+    """ Renders the images of the directives.
+
+    Images rendered by previous builds are copied back from
+    ``CACHE_PATH/plantuml``, where they are stored by the hash of their
+    source and options.
+
+    In batch mode the directives only queue their diagrams, which are
+    rendered by ``flush`` before the static files are collected: all the
+    PlantUML diagrams of a format by a single ``plantuml`` run, the TikZ and
+    ditaa ones by a pool of workers.
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.path = None
+        if settings.get('PLANTUML_CACHE', True) and 'CACHE_PATH' in settings:
+            self.path = os.path.join(settings['CACHE_PATH'], 'plantuml')
+        self.batch = settings.get('PLANTUML_BATCH', False)
+        self.jobs = settings.get('PLANTUML_JOBS', 0)
+        if self.jobs <= 0:
+            self.jobs = multiprocessing.cpu_count()
+        self.queue = OrderedDict()  # target -> (kind, key, body, option)
+
+    def key(self, kind, body, option):
+        data = json.dumps([CACHE_VERSION, kind, body, option])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def cached(self, key, target):
+        if self.path:
+            return os.path.join(self.path, key + os.path.splitext(target)[1])
+
+    def restore(self, key, target):
+        """ Copy the cached image of key to target, if there is one """
+        cached = self.cached(key, target)
+        if not cached or not os.path.exists(cached):
+            return False
+        if not os.path.exists(target) or \
+                not filecmp.cmp(cached, target, shallow=False):
+            shutil.copyfile(cached, target)
+        return True
+
+    def store(self, key, target):
+        cached = self.cached(key, target)
+        if not cached or not os.path.exists(target):
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        shutil.copyfile(target, cached + '.tmp')
+        os.rename(cached + '.tmp', cached)
+
+    def render(self, kind, body, option, target):
+        """ Render a diagram to target, now or on flush in batch mode.
+
+        Returns None on success or when queued, the error otherwise.
+        """
+        key = self.key(kind, body, option)
+        if self.restore(key, target):
+            return None
+        if self.batch:
+            self.queue[target] = (kind, key, body, option)
+            return None
+        err = RENDERERS[kind](body, option, target)
+        if err is None:
+            self.store(key, target)
+        return err
+
+    def flush(self):
+        """ Render the queued diagrams """
+        if not self.queue:
+            return
+        queue, self.queue = self.queue, OrderedDict()
+        units = []
+        plantuml = OrderedDict()  # outopt -> targets
+        for target, (kind, key, body, option) in queue.items():
+            if kind == 'uml':
+                plantuml.setdefault(option, []).append(target)
+            else:
+                units.append([target])
+        units.extend(plantuml.values())
+
+        def run(targets):
+            kind, key, body, option = queue[targets[0]]
+            if kind == 'uml':
+                err = render_plantuml(
+                    [(queue[target][2], target) for target in targets], option)
+                if err is not None and len(targets) > 1:
+                    # find out which diagrams are wrong
+                    return [(target, run([target])[0][1])
+                            for target in targets]
+            else:
+                err = RENDERERS[kind](body, option, targets[0])
+            return [(target, err) for target in targets]
+
+        logger.info("[plantuml] rendering %d diagrams", len(queue))
+        pool = ThreadPool(min(self.jobs, len(units)))
+        try:
+            results = pool.map(run, units)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            for target, err in result:
+                if err is None:
+                    self.store(queue[target][1], target)
+                else:
+                    logger.error("[plantuml] Error rendering %s: %s",
+                                 target, err)
+
+
+global_renderer = DiagramRenderer()  # replaced on plugin initialization
+
+
 class PlantUML_rst(Directive):
     """ reST directive for PlantUML """
     required_arguments = 0
@@ -49,11 +253,6 @@ class PlantUML_rst(Directive):
 
         nodes = []
         body = '\n'.join(self.content)
-        tf = tempfile.NamedTemporaryFile(delete=True)
-        tf.write('@startuml\n'.encode('utf-8'))
-        tf.write(body.encode('utf8'))
-        tf.write('\n@enduml'.encode('utf-8'))
-        tf.flush()
 
         imgformat = self.options.get('format', 'png')
 
@@ -64,18 +263,20 @@ class PlantUML_rst(Directive):
             imgext = ".svg"
             outopt = "-tsvg"
         else:
-            logger.error("Bad uml image format: " + imgformat)
-
-        # make a name
-        name = tf.name + imgext
+            logger.error("Bad uml image format '" + imgformat + "', using png")
+            imgext = ".png"
+            outopt = "-tpng"
 
         alt = self.options.get('alt', 'uml diagram')
         classes = self.options.pop('class', ['uml'])
-        cmdline = ['plantuml', '-o', path, outopt, tf.name]
+
+        # naming the image using an hash code, just to not pollute
+        # output directory with a growing number of images
+        newname = os.path.join(path,
+            "uml_%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
 
         try:
-            p = Popen(cmdline, stdout=PIPE, stderr=PIPE)
-            out, err = p.communicate()
+            err = global_renderer.render('uml', body, outopt, newname)
         except Exception as exc:
             error = self.state_machine.reporter.error(
                 'Failed to run plantuml: %s' % exc,
@@ -83,19 +284,7 @@ class PlantUML_rst(Directive):
                 line=self.lineno)
             nodes.append(error)
         else:
-            if p.returncode == 0:
-                # renaming output image using an hash code, just to not pullate
-                # output directory with a growing number of images
-                name = os.path.join(path, os.path.basename(name))
-                newname = os.path.join(path,
-                    "uml_%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
-
-                try:  # for Windows
-                    os.remove(newname)
-                except Exception as exc:
-                    logger.debug('File '+newname+' does not exist, not deleted')
-
-                os.rename(name, newname)
+            if err is None:
                 url = global_siteurl + '/images/' + os.path.basename(newname)
                 imgnode = image(uri=url, classes=classes, alt=alt)
                 nodes.append(imgnode)
@@ -132,34 +321,20 @@ class Tikz(Directive):
 
         nodes = []
         body = '\n'.join(self.content)
-        if self.options.get('libs', False):
-            libs = '\n'.join(('\\usetikzlibrary{%s}' % x) for x in self.options.get('libs', False).split(','))
-        else:
-            libs = ''
-        tf = tempfile.NamedTemporaryFile(delete=False)
-        tf.write(('\\documentclass{standalone}\n\\usepackage{xeCJK,fontspec,xunicode}\\usepackage{tikz}\setCJKmainfont{Noto Sans CJK TC}\n%s\n\\begin{document}\\begin{tikzpicture}\n' % libs).encode('utf-8'))
-        tf.write(body.encode('utf8'))
-        tf.write('\n\\end{tikzpicture}\\end{document}'.encode('utf-8'))
-        tf.flush()
-
-        imgformat = self.options.get('format', 'svg')
-        imgext = ".svg"
-
+        libs = self.options.get('libs', '')
 
-        # make a name
-        name = tf.name + imgext
-        output_path = os.path.join(path, os.path.basename(name))
+        imgext = ".svg"
 
         alt = self.options.get('alt', 'tikz diagram')
         classes = self.options.pop('class', ['tikz'])
-        cmdline = ['tikz2svg', tf.name, output_path]
-        logger.debug("running: "+ ' '.join(cmdline))
+
+        # naming the image using an hash code, just to not pollute
+        # output directory with a growing number of images
+        newname = os.path.join(path,
+            "%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
 
         try:
-            p = Popen(cmdline, stdout=PIPE, stderr=PIPE)
-            out, err = p.communicate()
-            logger.debug("tikz2svg out: "+ out.decode('utf-8'))
-            logger.debug("tikz2svg err: "+ err.decode('utf-8'))
+            err = global_renderer.render('tikz', body, libs, newname)
         except Exception as exc:
             error = self.state_machine.reporter.error(
                 'Failed to run tikz: %s' % exc,
@@ -167,18 +342,7 @@ class Tikz(Directive):
                 line=self.lineno)
             nodes.append(error)
         else:
-            if p.returncode == 0:
-                # renaming output image using an hash code, just to not pullate
-                # output directory with a growing number of images
-                newname = os.path.join(path,
-                    "%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
-
-                try:  # for Windows
-                    os.remove(newname)
-                except Exception as exc:
-                    logger.debug('File '+newname+' does not exist, not deleted')
-
-                os.rename(output_path, newname)
+            if err is None:
                 url = global_siteurl + '/uml/' + os.path.basename(newname)
                 imgnode = image(uri=url, classes=classes, alt=alt)
                 nodes.append(imgnode)
@@ -213,24 +377,18 @@ class Ditaa(Directive):
         nodes = []
 
         body = '\n'.join(self.content)
-        tf = tempfile.NamedTemporaryFile(delete=True)
-        tf.write(body.encode('utf8'))
-        tf.flush()
 
         imgext = ".png"
 
-        # make a name
-        name = tf.name + imgext
-
-        output_path = os.path.join(path, os.path.basename(name))
-
         alt = self.options.get('alt', 'ditaa diagram')
         classes = self.options.pop('class', ['ditaa'])
-        cmdline = ['ditaa', '-v', '-o', tf.name, output_path]
+
+        # naming the image using an hash code, just to not pollute
+        # output directory with a growing number of images
+        newname = os.path.join(path, "ditaa_%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
 
         try:
-            p = Popen(cmdline, stdout=PIPE, stderr=PIPE)
-            out, err = p.communicate()
+            err = global_renderer.render('ditaa', body, None, newname)
         except Exception as exc:
             error = self.state_machine.reporter.error(
                 'Failed to run ditaa: %s' % (exc, ),
@@ -238,18 +396,7 @@ class Ditaa(Directive):
                 line=self.lineno)
             nodes.append(error)
         else:
-            if p.returncode == 0:
-                # renaming output image using an hash code, just to not pullate
-                # output directory with a growing number of images
-                name = os.path.join(path, os.path.basename(name))
-                newname = os.path.join(path, "ditaa_%08x" % (adler32(body.encode('utf8')) & 0xffffffff))+imgext
-
-                try:  # for Windows
-                    os.remove(newname)
-                except Exception as exc:
-                    logger.debug('File '+newname+' does not exist, not deleted')
-
-                os.rename(name, newname)
+            if err is None:
                 url = global_siteurl + '/images/' + os.path.basename(newname)
                 imgnode = image(uri=url, classes=classes, alt=alt)
                 nodes.append(imgnode)
@@ -319,10 +466,16 @@ def custom_url(generator, metadata):
 """
 
 
+def flush_diagrams(sender):
+    """ Render the diagrams queued in batch mode """
+    global_renderer.flush()
+
+
 def pelican_init(pelicanobj):
 
-    global global_siteurl
+    global global_siteurl, global_renderer
     global_siteurl = pelicanobj.settings['SITEURL']
+    global_renderer = DiagramRenderer(pelicanobj.settings)
 
     """ Prepare configurations for the MD plugin """
     try:
@@ -345,6 +498,8 @@ def pelican_init(pelicanobj):
 def register():
     """Plugin registration."""
     signals.initialized.connect(pelican_init)
+    signals.page_generator_finalized.connect(flush_diagrams)
+    signals.finalized.connect(flush_diagrams)
     """signals.article_generator_context.connect(custom_url)"""
     directives.register_directive('ditaa', Ditaa)
     directives.register_directive('uml', PlantUML_rst)
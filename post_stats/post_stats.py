@@ -11,61 +11,258 @@ word_counts: frquency count of all the words in the article; can be used for tag
 fi: Flesch-kincaid Index/ Reading Ease
 fk: Flesch-kincaid Grade Level
 
+Site-wide totals are stored in the post_stats variable of the context.
+
 """
 
-from pelican import signals
-from bs4 import BeautifulSoup
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
 import re
 from collections import Counter
+from itertools import chain
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+try:
+    from html.parser import HTMLParser
+    from html.entities import html5 as ENTITY_TEXT
+except ImportError:
+    from HTMLParser import HTMLParser
+    from htmlentitydefs import name2codepoint
+    ENTITY_TEXT = dict((name + ';', unichr(code))
+                       for name, code in name2codepoint.items())
+
+from pelican import signals
 
 from .readability import *
 
+# How fast do average people read?
+WPM = 250
 
-def calculate_stats(instance):
+CACHE_VERSION = 1
+CACHE_FILENAME = 'post_stats.json'
 
-    if instance._content is not None:
-        stats = {}
-        content = instance._content
+ENTITIES = re.compile(r'\&\#?.+?;')
+
+# Punctuation removed before counting the words
+DROP = u'.,?!@#$%^&*()_+-=\|/[]{}`~:;\'\"‘’—…“”'
+DROP_TABLE = dict((ord(c), u'') for c in DROP)
+
+
+class TextExtractor(HTMLParser):
+    """Collect the text of an HTML fragment, entities decoded, like the
+    getText() of BeautifulSoup"""
+
+    # elements whose text is not visible
+    SKIP = ('script', 'style', 'template')
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        # entities are decoded by the handlers below, on Python 2 as well
+        self.convert_charrefs = False
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.handle_data(data[6:])
+
+    def handle_entityref(self, name):
+        if self.skip:
+            return
+        if name + ';' in ENTITY_TEXT:
+            self.parts.append(ENTITY_TEXT[name + ';'])
+        else:
+            # kept as BeautifulSoup does, without the semicolon
+            self.parts.append('&' + name)
+
+    def handle_charref(self, name):
+        if self.skip:
+            return
+        try:
+            if name[:1] in ('x', 'X'):
+                self.parts.append(unichr(int(name[1:], 16)))
+            else:
+                self.parts.append(unichr(int(name)))
+        except (ValueError, OverflowError):
+            self.parts.append('\ufffd')
+
+
+def get_text(html):
+    """The visible text of an HTML fragment"""
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return ''.join(parser.parts)
+
+
+def text_statistics(raw_text):
+    stats = {}
 
-        # How fast do average people read?
-        WPM = 250
+    # Process the text to remove entities
+    raw_text = raw_text.replace('&nbsp;', ' ')
+    raw_text = ENTITIES.sub('', raw_text)
 
-        # Use BeautifulSoup to get readable/visible text
-        raw_text = BeautifulSoup(content, 'html.parser').getText()
+    # Flesch-kincaid readbility stats counts sentances,
+    # so save before removing punctuation
+    tmp = raw_text
 
-        # Process the text to remove entities
-        entities = r'\&\#?.+?;'
-        raw_text = raw_text.replace('&nbsp;', ' ')
-        raw_text = re.sub(entities, '', raw_text)
+    # Process the text to remove punctuation
+    raw_text = raw_text.translate(DROP_TABLE)
 
-        # Flesch-kincaid readbility stats counts sentances,
-        # so save before removing punctuation
-        tmp = raw_text
+    # Count the words in the text
+    words = raw_text.lower().split()
+    word_count = Counter(words)
 
-        # Process the text to remove punctuation
-        drop = u'.,?!@#$%^&*()_+-=\|/[]{}`~:;\'\"‘’—…“”'
-        raw_text = raw_text.translate(dict((ord(c), u'') for c in drop))
+    # Return the stats
+    stats['word_counts'] = word_count
+    stats['wc'] = sum(word_count.values())
 
-        # Count the words in the text
-        words = raw_text.lower().split()
-        word_count = Counter(words)
+    # Calulate how long it'll take to read, rounding up
+    stats['read_mins'] = read_minutes(stats['wc'])
 
-        # Return the stats
-        stats['word_counts'] = word_count
-        stats['wc'] = sum(word_count.values())
+    # Calculate Flesch-kincaid readbility stats
+    readability_stats = stcs, words, sbls = text_stats(tmp, stats['wc'])
+    stats['fi'] = "{:.2f}".format(flesch_index(readability_stats))
+    stats['fk'] = "{:.2f}".format(flesch_kincaid_level(readability_stats))
 
-        # Calulate how long it'll take to read, rounding up
-        stats['read_mins'] = (stats['wc'] + WPM - 1) // WPM
-        if stats['read_mins'] == 0:
-            stats['read_mins'] = 1
+    return stats
 
-        # Calculate Flesch-kincaid readbility stats
-        readability_stats = stcs, words, sbls = text_stats(tmp, stats['wc'])
-        stats['fi'] = "{:.2f}".format(flesch_index(readability_stats))
-        stats['fk'] = "{:.2f}".format(flesch_kincaid_level(readability_stats))
 
+def read_minutes(wc):
+    return max(1, (wc + WPM - 1) // WPM)
+
+
+class StatsCache(object):
+    """Statistics of the content of previous builds, by content hash"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = None
+        self.entries = {}
+        self.used = {}
+        if settings.get('POST_STATS_CACHE', True):
+            self.path = os.path.join(settings['CACHE_PATH'], CACHE_FILENAME)
+            try:
+                with open(self.path) as cache_file:
+                    data = json.load(cache_file)
+                if data.get('version') == CACHE_VERSION:
+                    self.entries = data.get('stats', {})
+            except (IOError, OSError, ValueError):
+                pass
+
+    def get(self, digest):
+        stats = self.used.get(digest) or self.entries.get(digest)
+        if stats is None:
+            return None
+        self.used[digest] = stats
+        stats = dict(stats)
+        stats['word_counts'] = Counter(stats['word_counts'])
+        return stats
+
+    def set(self, digest, stats):
+        self.used[digest] = stats
+
+    def save(self):
+        if not self.path or not self.used:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + '.tmp', 'w') as cache_file:
+            json.dump({'version': CACHE_VERSION, 'stats': self.used},
+                      cache_file)
+        os.rename(self.path + '.tmp', self.path)
+
+
+_cache = None
+
+
+def get_cache(settings):
+    global _cache
+    if _cache is not None and _cache.settings is not settings:
+        _cache.save()
+        _cache = None
+    if _cache is None:
+        _cache = StatsCache(settings)
+    return _cache
+
+
+def calculate_stats(instance, cache=None):
+
+    if instance._content is not None:
+        digest = hashlib.sha1(instance._content.encode('utf-8')).hexdigest()
+        stats = cache.get(digest) if cache else None
+        if stats is None:
+            stats = text_statistics(get_text(instance._content))
+            if cache:
+                cache.set(digest, stats)
         instance.stats = stats
 
 
+def site_statistics(articles):
+    """Total words and reading time, of the site and of each category"""
+    totals = {'articles': 0, 'wc': 0, 'categories': {}}
+    for article in articles:
+        stats = getattr(article, 'stats', None)
+        if stats is None:
+            continue
+        totals['articles'] += 1
+        totals['wc'] += stats['wc']
+        category = totals['categories'].setdefault(
+            article.category, {'articles': 0, 'wc': 0})
+        category['articles'] += 1
+        category['wc'] += stats['wc']
+    for total in chain([totals], totals['categories'].values()):
+        total['read_mins'] = read_minutes(total['wc'])
+    return totals
+
+
+def article_stats(generator):
+    cache = get_cache(generator.settings)
+    for article in chain(generator.articles, generator.translations,
+                         generator.drafts,
+                         getattr(generator, 'drafts_translations', [])):
+        calculate_stats(article, cache)
+    generator.context['post_stats'] = site_statistics(generator.articles)
+
+
+def page_stats(generator):
+    cache = get_cache(generator.settings)
+    for page in chain(generator.pages, generator.translations,
+                      generator.hidden_pages,
+                      getattr(generator, 'hidden_translations', []),
+                      getattr(generator, 'draft_pages', []),
+                      getattr(generator, 'draft_translations', [])):
+        calculate_stats(page, cache)
+
+
+def save_cache(pelican):
+    global _cache
+    if _cache is not None:
+        _cache.save()
+        _cache = None
+
+
 def register():
-    signals.content_object_init.connect(calculate_stats)
+    signals.article_generator_finalized.connect(article_stats)
+    signals.page_generator_finalized.connect(page_stats)
+    signals.finalized.connect(save_cache)
@@ -5,6 +5,18 @@
 
 from __future__ import division
 import re
+from collections import Counter
+
+TERMINATORS = ".!?:;"
+_term = re.escape(TERMINATORS)
+NOT_TEXT = re.compile(r"[^%s\sA-Za-z]+" % _term)
+TERMINATOR_RUN = re.compile(r"\s*([%s]+\s*)+" % _term)
+SPACES = re.compile(r"\s+")
+SUFFIX = re.compile(r"(es|ed|(?<!l)e)$")
+VOWELS = re.compile(r"[aeiouy]+")
+
+# syllables of the words seen so far, shared by all the texts
+_syllables = {}
 
 
 def mean(seq):
@@ -12,19 +24,23 @@ def mean(seq):
 
 
 def syllables(word):
-    if len(word) <= 3:
-        return 1
+    try:
+        return _syllables[word]
+    except KeyError:
+        pass
 
-    word = re.sub(r"(es|ed|(?<!l)e)$", "", word)
-    return len(re.findall(r"[aeiouy]+", word))
+    if len(word) <= 3:
+        count = 1
+    else:
+        count = len(VOWELS.findall(SUFFIX.sub("", word)))
+    _syllables[word] = count
+    return count
 
 
 def normalize(text):
-    terminators = ".!?:;"
-    term = re.escape(terminators)
-    text = re.sub(r"[^%s\sA-Za-z]+" % term, "", text)
-    text = re.sub(r"\s*([%s]+\s*)+" % term, ". ", text)
-    return re.sub(r"\s+", " ", text)
+    text = NOT_TEXT.sub("", text)
+    text = TERMINATOR_RUN.sub(". ", text)
+    return SPACES.sub(" ", text)
 
 
 def text_stats(text, wc):
@@ -37,7 +53,9 @@ def text_stats(text, wc):
     else:
         words = sum(len(s) for s in stcs)
 
-    sbls = sum(syllables(w) for s in stcs for w in s)
+    # count the syllables of each distinct word once
+    counts = Counter(w for s in stcs for w in s)
+    sbls = sum(syllables(w) * n for w, n in counts.items())
 
     return len(stcs), words, sbls
 
@@ -5,52 +5,197 @@ Related posts plugin for Pelican
 Adds related_posts variable to article's context
 """
 
-from pelican import signals
-from collections import Counter
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
 from itertools import chain
 
+from pelican import signals
+
+CACHE_VERSION = 2
+CACHE_FILENAME = 'related_posts.json'
+
+TITLE_TERM = re.compile(r'\w{3,}', re.UNICODE)
+
+
+class RelatedIndex(object):
+    """Tag -> articles inverted index, built once per generator.
+
+    ``score(article)`` only walks the posting lists of the article's own
+    tags, and ``signature(article)`` summarises everything its score depends
+    on, so cached results can be reused while that is unchanged.
+    """
+
+    def __init__(self, generator):
+        settings = generator.settings
+        self.scoring = settings.get('RELATED_POSTS_SCORING', 'count')
+        self.skipcategory = settings.get('RELATED_POSTS_SKIP_SAME_CATEGORY',
+                                         False)
+        self.category_weight = settings.get('RELATED_POSTS_CATEGORY_WEIGHT', 0)
+        self.title_weight = settings.get('RELATED_POSTS_TITLE_WEIGHT', 0)
+
+        self.postings = dict((tag, list(articles))
+                             for tag, articles in generator.tags.items())
+        self.by_slug = {}
+        for article in generator.articles:
+            self.by_slug.setdefault(article.slug, article)
+        self.by_path = dict((article.source_path, article)
+                            for article in chain(generator.articles,
+                                                 generator.drafts))
+        self.total = len(generator.articles)
+        self.tagsets = {}
+        self.titles = {}
+        self._signatures = {}
+
+    def tags(self, article):
+        if article not in self.tagsets:
+            self.tagsets[article] = frozenset(getattr(article, 'tags', ()))
+        return self.tagsets[article]
+
+    def ordered_tags(self, article):
+        """The tags of article in their order, without duplicates"""
+        seen = set()
+        ordered = []
+        for tag in getattr(article, 'tags', ()):
+            if tag not in seen:
+                seen.add(tag)
+                ordered.append(tag)
+        return ordered
+
+    def title_terms(self, article):
+        if article not in self.titles:
+            self.titles[article] = frozenset(
+                TITLE_TERM.findall(article.title.lower()))
+        return self.titles[article]
+
+    def idf(self, tag):
+        return math.log(float(self.total + 1) / len(self.postings[tag]))
+
+    def posting_signature(self, tag):
+        if tag not in self._signatures:
+            digest = hashlib.sha1()
+            for other in self.postings.get(tag, ()):
+                entry = [other.source_path, str(other.category),
+                         sorted(str(t) for t in self.tags(other))]
+                if self.title_weight:
+                    entry.append(other.title)
+                digest.update(json.dumps(entry).encode('utf-8'))
+            self._signatures[tag] = digest.hexdigest()
+        return self._signatures[tag]
+
+    def signature(self, article, numentries):
+        """Key of the related posts of article: its own features, the
+        options, and the posting lists of its tags."""
+        tags = self.ordered_tags(article)
+        key = [CACHE_VERSION, numentries, self.scoring, self.skipcategory,
+               self.category_weight, self.title_weight,
+               str(article.category), article.title,
+               [(str(tag), self.posting_signature(tag)) for tag in tags]]
+        if self.scoring == 'tfidf':
+            key.append(self.total)
+        return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def score(self, article, numentries):
+        tags = self.tags(article)
+        scores = {}
+        # ties are ranked by first appearance, as Counter.most_common did
+        first_seen = {}
+        for tag in self.ordered_tags(article):
+            if tag not in self.postings:
+                continue
+            weight = self.idf(tag) if self.scoring == 'tfidf' else 1
+            for other in self.postings[tag]:
+                if self.skipcategory and other.category == article.category:
+                    continue
+                first_seen.setdefault(other, len(first_seen))
+                scores[other] = scores.get(other, 0) + weight
+
+        # remove itself
+        scores.pop(article, None)
+
+        if self.scoring == 'jaccard':
+            for other, shared in scores.items():
+                scores[other] = shared / float(
+                    len(tags | self.tags(other)))
+        if self.category_weight:
+            for other in scores:
+                if other.category == article.category:
+                    scores[other] += self.category_weight
+        if self.title_weight:
+            terms = self.title_terms(article)
+            for other in scores:
+                scores[other] += self.title_weight * len(
+                    terms & self.title_terms(other))
+
+        return [other for other, _ in heapq.nlargest(
+            numentries, scores.items(),
+            key=lambda item: (item[1], -first_seen[item[0]]))]
+
+
+def load_cache(path):
+    try:
+        with open(path) as cache_file:
+            data = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('articles', {})
+
+
+def save_cache(path, entries):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as cache_file:
+        json.dump({'version': CACHE_VERSION, 'articles': entries}, cache_file)
+    os.rename(path + '.tmp', path)
+
 
 def add_related_posts(generator):
     # get the max number of entries from settings
     # or fall back to default (5)
     numentries = generator.settings.get('RELATED_POSTS_MAX', 5)
-    # Skip all posts in the same category as the article
-    skipcategory = generator.settings.get('RELATED_POSTS_SKIP_SAME_CATEGORY', False)
+    index = RelatedIndex(generator)
+
+    cache_path = None
+    cached = {}
+    entries = {}
+    if generator.settings.get('RELATED_POSTS_CACHE', True):
+        cache_path = os.path.join(generator.settings['CACHE_PATH'],
+                                  CACHE_FILENAME)
+        cached = load_cache(cache_path)
+
     for article in chain(generator.articles, generator.drafts):
         # set priority in case of forced related posts
         if hasattr(article,'related_posts'):
-            # split slugs 
-            related_posts = article.related_posts.split(',')
-            posts = [] 
-            # get related articles
-            for slug in related_posts:
-                i = 0
-                slug = slug.strip()
-                for a in generator.articles:
-                    if i >= numentries: # break in case there are max related psots
-                        break
-                    if a.slug == slug:
-                        posts.append(a)
-                        i += 1
-
-            article.related_posts = posts
-        else:
-            # no tag, no relation
-            if not hasattr(article, 'tags'):
-                continue
+            # split slugs
+            slugs = (slug.strip() for slug in article.related_posts.split(','))
+            posts = [index.by_slug[slug] for slug in slugs
+                     if slug in index.by_slug]
+            article.related_posts = posts[:numentries]
+            continue
+
+        # no tag, no relation
+        if not hasattr(article, 'tags'):
+            continue
 
-            # score = number of common tags
-            related = chain(*(generator.tags[tag] for tag in article.tags))
-            if skipcategory:
-                related = (other for other in related
-                                 if other.category != article.category)
-            scores = Counter(related)
+        signature = index.signature(article, numentries)
+        entry = cached.get(article.source_path)
+        if entry and entry[0] == signature and \
+                all(path in index.by_path for path in entry[1]):
+            article.related_posts = [index.by_path[path] for path in entry[1]]
+        else:
+            article.related_posts = index.score(article, numentries)
+        entries[article.source_path] = [
+            signature, [other.source_path for other in article.related_posts]]
 
-            # remove itself
-            scores.pop(article, None)
+    if cache_path:
+        save_cache(cache_path, entries)
 
-            article.related_posts = [other for other, count 
-                in scores.most_common(numentries)]
 
 def register():
     signals.article_generator_finalized.connect(add_related_posts)
@@ -1,8 +1,16 @@
 #-*- conding: utf-8 -*-
 
+import hashlib
+import io
+import json
 import os
+import re
+import shutil
+import subprocess
+import tempfile
 import warnings
 import logging
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger('RMD_READER')
 
@@ -15,6 +23,11 @@ RMD = False
 FIG_PATH = None
 R_STARTED = False
 
+CACHE_VERSION = 1
+
+# figures referenced by the markdown knitr writes
+FIGURE = re.compile(r'''!\[[^\]]*\]\(([^)\s]+)|<img [^>]*src="([^"]+)"''')
+
 def startr():
     global KNITR, R_OBJECTS, R_STARTED
     if R_STARTED:
@@ -37,26 +50,285 @@ def initsignal(pelicanobj):
         R_OBJECTS.r('Sys.setlocale("LC_ALL", "C")')
         R_OBJECTS.r('Sys.setlocale("LC_NUMERIC", "C")')
         R_OBJECTS.r('Sys.setlocale("LC_MESSAGES", "C")')
-        
+
         idx = KNITR.opts_knit.names.index('set')
         path = pelicanobj.settings.get('PATH','%s/content' % settings.DEFAULT_CONFIG.get('PATH'))
         logger.debug("RMD_READER PATH = %s", path)
         KNITR.opts_knit[idx](**{'base.dir': path})
-        
+
         knitroptsknit = pelicanobj.settings.get('RMD_READER_KNITR_OPTS_KNIT', None)
         if knitroptsknit:
             KNITR.opts_knit[idx](**{str(k): v for k,v in knitroptsknit.items()})
-        
+
         idx = KNITR.opts_chunk.names.index('set')
         knitroptschunk = pelicanobj.settings.get('RMD_READER_KNITR_OPTS_CHUNK', None)
         if knitroptschunk:
             FIG_PATH = knitroptschunk['fig.path'] if 'fig.path' in knitroptschunk else 'figure/'
             KNITR.opts_chunk[idx](**{str(k): v for k,v in knitroptschunk.items()})
-        
+
         RMD = True
     except ImportError as ex:
         RMD = False
 
+def r_literal(value):
+    """R source of a Python value given as a knitr option"""
+    if value is None:
+        return 'NULL'
+    if value is True or value is False:
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return 'c(%s)' % ', '.join(r_literal(v) for v in value)
+    if isinstance(value, dict):
+        return 'list(%s)' % r_arguments(value)
+    if not isinstance(value, str):
+        value = str(value)
+    return json.dumps(value)
+
+def r_arguments(options):
+    return ', '.join('`%s`=%s' % (k, r_literal(v)) for k, v in sorted(options.items()))
+
+def knit_options(settings_, filename):
+    """Everything the output of knitting filename depends on"""
+    QUIET = settings_.get('RMD_READER_KNITR_QUIET', True)
+    ENCODING = settings_.get('RMD_READER_KNITR_ENCODING', 'UTF-8')
+    RENAME_PLOT = settings_.get('RMD_READER_RENAME_PLOT', 'chunklabel')
+    if type(RENAME_PLOT) is bool:
+        logger.error("RMD_READER_RENAME_PLOT takes a string value (either chunklabel or directory), please see the readme.")
+        if RENAME_PLOT:
+            RENAME_PLOT = 'chunklabel'
+            logger.error("Defaulting to chunklabel")
+        else:
+            RENAME_PLOT = 'disabled'
+            logger.error("Disabling plot renaming")
+    PATH = settings_.get('PATH','%s/content' % settings.DEFAULT_CONFIG.get('PATH'))
+    options = {
+        'quiet': QUIET,
+        'encoding': ENCODING,
+        'rename_plot': RENAME_PLOT,
+        'base_dir': PATH,
+        'opts_knit': settings_.get('RMD_READER_KNITR_OPTS_KNIT', None) or {},
+        'opts_chunk': dict(settings_.get('RMD_READER_KNITR_OPTS_CHUNK', None) or {}),
+        'chunk_label': None,
+    }
+    if RENAME_PLOT == 'chunklabel':
+        options['chunk_label'] = os.path.splitext(os.path.basename(filename))[0]
+    elif RENAME_PLOT == 'directory':
+        options['chunk_label'] = 'unnamed-chunk'
+        fig_path = options['opts_chunk'].get('fig.path', 'figure/')
+        src_name = os.path.splitext(os.path.relpath(filename, PATH))[0]
+        options['opts_chunk']['fig.path'] = '%s-' % os.path.join(fig_path, src_name)
+    return options
+
+def declared_dependencies(filename, settings_):
+    """Files the output of filename depends on: RMD_READER_DEPENDENCIES, and
+    the comma separated Dependencies metadata of the document"""
+    PATH = settings_.get('PATH','%s/content' % settings.DEFAULT_CONFIG.get('PATH'))
+    paths = [os.path.join(PATH, p) for p in settings_.get('RMD_READER_DEPENDENCIES', [])]
+    with io.open(filename, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip():
+                break
+            key, _, value = line.partition(':')
+            if key.strip().lower() == 'dependencies':
+                paths.extend(os.path.join(os.path.dirname(filename), p.strip())
+                             for p in value.split(',') if p.strip())
+    return paths
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class KnitCache(object):
+    """Markdown and figures knitted from the Rmd files, under CACHE_PATH
+
+    Documents are keyed by the hash of the Rmd file, of the knitr options
+    and of their declared dependencies; figures are stored by their hash.
+    """
+
+    def __init__(self, settings_):
+        self.path = None
+        if settings_.get('RMD_READER_CACHE', True):
+            self.path = os.path.join(settings_['CACHE_PATH'], 'rmd_reader')
+
+    def key(self, filename, options, dependencies):
+        digest = hashlib.sha1(json.dumps([CACHE_VERSION, options], sort_keys=True, default=str).encode('utf-8'))
+        for path in [filename] + dependencies:
+            digest.update(path.encode('utf-8'))
+            digest.update((file_digest(path) if os.path.isfile(path) else 'missing').encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry(self, key):
+        """The cached markdown and figures of key, None when one of them is
+        missing"""
+        if not self.path:
+            return None
+        try:
+            with io.open(os.path.join(self.path, key + '.json'), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        for digest in entry['figures'].values():
+            if not os.path.exists(os.path.join(self.path, 'figures', digest)):
+                return None
+        return entry
+
+    def restore(self, key, md_filename, base_dir):
+        """Write the cached markdown of key to md_filename and its figures
+        back to base_dir, returns False when key is not cached"""
+        entry = self.entry(key)
+        if entry is None:
+            return False
+        for figure, digest in entry['figures'].items():
+            blob = os.path.join(self.path, 'figures', digest)
+            target = os.path.join(base_dir, figure)
+            if os.path.exists(target) and file_digest(target) == digest:
+                continue
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(blob, target)
+        with io.open(md_filename, 'w', encoding='utf-8') as f:
+            f.write(entry['markdown'])
+        logger.debug('Restored %s from the cache', md_filename)
+        return True
+
+    def store(self, key, md_filename, base_dir):
+        if not self.path:
+            return
+        with io.open(md_filename, encoding='utf-8') as f:
+            markdown = f.read()
+        figures = {}
+        for match in FIGURE.finditer(markdown):
+            figure = match.group(1) or match.group(2)
+            if figure.startswith('{filename}/'):
+                figure = figure[len('{filename}/'):]
+            path = os.path.join(base_dir, figure)
+            if os.path.isfile(path):
+                figures[figure] = file_digest(path)
+                blob = os.path.join(self.path, 'figures', figures[figure])
+                if not os.path.exists(blob):
+                    if not os.path.isdir(os.path.dirname(blob)):
+                        os.makedirs(os.path.dirname(blob))
+                    shutil.copyfile(path, blob + '.tmp')
+                    os.rename(blob + '.tmp', blob)
+        path = os.path.join(self.path, key + '.json')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(json.dumps({'markdown': markdown, 'figures': figures}).encode('utf-8'))
+        os.rename(path + '.tmp', path)
+
+RSCRIPT_TEMPLATE = '''
+suppressMessages(library(knitr))
+invisible(Sys.setlocale("LC_ALL", "C"))
+invisible(Sys.setlocale("LC_NUMERIC", "C"))
+invisible(Sys.setlocale("LC_MESSAGES", "C"))
+opts_knit$set(base.dir={base_dir})
+opts_knit$set({opts_knit})
+opts_chunk$set({opts_chunk})
+{rename_plot}
+knit({filename}, {md_filename}, quiet={quiet}, encoding={encoding})
+'''
+
+RENAME_PLOT_TEMPLATE = '''
+opts_knit$set(unnamed.chunk.label="{unnamed_chunk_label}")
+render_markdown()
+hook_plot <- knit_hooks$get('plot')
+knit_hooks$set(plot=function(x, options) hook_plot(paste0("{{filename}}/", x), options))
+'''
+
+def knit_with_rscript(rscript, filename, md_filename, options):
+    """Knit filename in a new R process"""
+    rename_plot = ''
+    if options['chunk_label'] is not None:
+        rename_plot = RENAME_PLOT_TEMPLATE.format(unnamed_chunk_label=options['chunk_label'])
+    script = RSCRIPT_TEMPLATE.format(
+        base_dir=r_literal(options['base_dir']),
+        opts_knit=r_arguments(options['opts_knit']),
+        opts_chunk=r_arguments(options['opts_chunk']),
+        rename_plot=rename_plot,
+        filename=r_literal(filename),
+        md_filename=r_literal(md_filename),
+        quiet=r_literal(options['quiet']),
+        encoding=r_literal(options['encoding']))
+    fd, script_filename = tempfile.mkstemp(suffix='.R')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(script)
+        logger.debug('Knitting %s with %s', filename, rscript)
+        subprocess.check_call([rscript, '--vanilla', script_filename])
+    finally:
+        os.remove(script_filename)
+
+class Knitter(object):
+    """Knits Rmd files, from the cache when possible, with the embedded R
+    or, when RMD_READER_WORKERS is set, with a pool of Rscript processes
+    started as soon as the generators start reading"""
+
+    def __init__(self, settings_):
+        self.settings = settings_
+        self.cache = KnitCache(settings_)
+        self.workers = settings_.get('RMD_READER_WORKERS', 0)
+        self.rscript = settings_.get('RMD_READER_RSCRIPT', 'Rscript')
+        self.pool = None
+        self.pending = {}
+
+    def prepare(self, filename):
+        md_filename = filename.replace('.Rmd', '.aux').replace('.rmd', '.aux')
+        options = knit_options(self.settings, filename)
+        key = self.cache.key(filename, options,
+                             declared_dependencies(filename, self.settings))
+        return md_filename, options, key
+
+    def knit(self, filename, knit_embedded):
+        """Write the markdown of filename to its .aux file, returns its name"""
+        md_filename, options, key = self.prepare(filename)
+        pending = self.pending.pop(filename, None)
+        if pending is not None:
+            pending.get()
+        elif self.cache.restore(key, md_filename, options['base_dir']):
+            return md_filename
+        elif self.workers > 0:
+            knit_with_rscript(self.rscript, filename, md_filename, options)
+        else:
+            knit_embedded(filename, md_filename, options)
+        self.cache.store(key, md_filename, options['base_dir'])
+        return md_filename
+
+    def prefetch(self, filenames):
+        """Start knitting the files that are not in the cache"""
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        for filename in filenames:
+            if filename in self.pending:
+                continue
+            md_filename, options, key = self.prepare(filename)
+            # restored by knit(), only when the file is read
+            if self.cache.entry(key) is not None:
+                continue
+            self.pending[filename] = self.pool.apply_async(
+                knit_with_rscript, (self.rscript, filename, md_filename, options))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+
+_knitter = None
+
+def get_knitter(settings_):
+    global _knitter
+    if _knitter is not None and _knitter.settings is not settings_:
+        _knitter.close()
+        _knitter = None
+    if _knitter is None:
+        _knitter = Knitter(settings_)
+    return _knitter
+
 class RmdReader(readers.BaseReader):
     file_extensions = ['Rmd', 'rmd']
 
@@ -68,47 +340,10 @@ class RmdReader(readers.BaseReader):
     # some content and the associated metadata.
     def read(self, filename):
         """Parse content and metadata of markdown files"""
-        QUIET = self.settings.get('RMD_READER_KNITR_QUIET', True)
-        ENCODING = self.settings.get('RMD_READER_KNITR_ENCODING', 'UTF-8')
         CLEANUP = self.settings.get('RMD_READER_CLEANUP', True)
-        RENAME_PLOT = self.settings.get('RMD_READER_RENAME_PLOT', 'chunklabel')
-        if type(RENAME_PLOT) is bool:
-            logger.error("RMD_READER_RENAME_PLOT takes a string value (either chunklabel or directory), please see the readme.")
-            if RENAME_PLOT:
-                RENAME_PLOT = 'chunklabel'
-                logger.error("Defaulting to chunklabel")
-            else:
-                RENAME_PLOT = 'disabled'
-                logger.error("Disabling plot renaming")
-        logger.debug("RMD_READER_KNITR_QUIET = %s", QUIET)
-        logger.debug("RMD_READER_KNITR_ENCODING = %s", ENCODING)
         logger.debug("RMD_READER_CLEANUP = %s", CLEANUP)
-        logger.debug("RMD_READER_RENAME_PLOT = %s", RENAME_PLOT)
-        # replace single backslashes with double backslashes
-        filename = filename.replace('\\', '\\\\')
         # parse Rmd file - generate md file
-        md_filename = filename.replace('.Rmd', '.aux').replace('.rmd', '.aux')
-        if RENAME_PLOT == 'chunklabel' or RENAME_PLOT == 'directory':
-            if RENAME_PLOT == 'chunklabel':
-                chunk_label = os.path.splitext(os.path.basename(filename))[0]
-                logger.debug('Chunk label: %s', chunk_label)
-            elif RENAME_PLOT == 'directory':
-                chunk_label = 'unnamed-chunk'
-                PATH = self.settings.get('PATH','%s/content' % settings.DEFAULT_CONFIG.get('PATH'))
-                src_name = os.path.splitext(os.path.relpath(filename, PATH))[0]
-                idx = KNITR.opts_chunk.names.index('set')
-                knitroptschunk = { 'fig.path': '%s-' % os.path.join(FIG_PATH, src_name) }
-                KNITR.opts_chunk[idx](**{str(k): v for k,v in knitroptschunk.items()})
-                logger.debug('Figures path: %s, chunk label: %s', knitroptschunk['fig.path'], chunk_label)
-            R_OBJECTS.r('''
-opts_knit$set(unnamed.chunk.label="{unnamed_chunk_label}")
-render_markdown()
-hook_plot <- knit_hooks$get('plot')
-knit_hooks$set(plot=function(x, options) hook_plot(paste0("{{filename}}/", x), options))
-            '''.format(unnamed_chunk_label=chunk_label))
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            KNITR.knit(filename, md_filename, quiet=QUIET, encoding=ENCODING)
+        md_filename = get_knitter(self.settings).knit(filename, self.knit)
         # read md file - create a MarkdownReader
         md_reader = readers.MarkdownReader(self.settings)
         content, metadata = md_reader.read(md_filename)
@@ -117,9 +352,54 @@ knit_hooks$set(plot=function(x, options) hook_plot(paste0("{{filename}}/", x), o
             os.remove(md_filename)
         return content, metadata
 
+    def knit(self, filename, md_filename, options):
+        """Knit filename with the embedded R"""
+        logger.debug("RMD_READER_KNITR_QUIET = %s", options['quiet'])
+        logger.debug("RMD_READER_KNITR_ENCODING = %s", options['encoding'])
+        logger.debug("RMD_READER_RENAME_PLOT = %s", options['rename_plot'])
+        if options['chunk_label'] is not None:
+            logger.debug('Chunk label: %s', options['chunk_label'])
+            if options['rename_plot'] == 'directory':
+                idx = KNITR.opts_chunk.names.index('set')
+                knitroptschunk = { 'fig.path': options['opts_chunk']['fig.path'] }
+                KNITR.opts_chunk[idx](**{str(k): v for k,v in knitroptschunk.items()})
+                logger.debug('Figures path: %s', knitroptschunk['fig.path'])
+            R_OBJECTS.r(RENAME_PLOT_TEMPLATE.format(unnamed_chunk_label=options['chunk_label']))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            # replace single backslashes with double backslashes
+            KNITR.knit(filename.replace('\\', '\\\\'),
+                       md_filename.replace('\\', '\\\\'),
+                       quiet=options['quiet'], encoding=options['encoding'])
+
 def add_reader(readers):
     readers.reader_classes['rmd'] = RmdReader
 
+def prefetch(generator, paths, excludes):
+    knitter = get_knitter(generator.settings)
+    if knitter.workers <= 0:
+        return
+    files = generator.get_files(generator.settings[paths],
+                                exclude=generator.settings[excludes],
+                                extensions=RmdReader.file_extensions)
+    knitter.prefetch([os.path.abspath(os.path.join(generator.path, f))
+                      for f in files])
+
+def prefetch_articles(generator):
+    prefetch(generator, 'ARTICLE_PATHS', 'ARTICLE_EXCLUDES')
+
+def prefetch_pages(generator):
+    prefetch(generator, 'PAGE_PATHS', 'PAGE_EXCLUDES')
+
+def close_knitter(pelicanobj):
+    global _knitter
+    if _knitter is not None:
+        _knitter.close()
+        _knitter = None
+
 def register():
     signals.readers_init.connect(add_reader)
     signals.initialized.connect(initsignal)
+    signals.article_generator_init.connect(prefetch_articles)
+    signals.page_generator_init.connect(prefetch_pages)
+    signals.finalized.connect(close_knitter)
@@ -153,6 +153,45 @@ plot(cars)
         logging.debug(images)
         self.assertTrue(len(images) == 1,'Contents of images dir is not correct: %s' % ','.join(images))
 
+    def testCache(self):
+        settings = read_settings(path=None, override={
+            'LOAD_CONTENT_CACHE': False,
+            'PATH': self.contentdir,
+            'OUTPUT_PATH': self.outputdir,
+            'CACHE_PATH': os.path.join(self.outputdir, 'cache'),
+            'RMD_READER_KNITR_OPTS_CHUNK': {'fig.path' : '%s/' % self.figpath},
+            'RMD_READER_RENAME_PLOT': 'chunklabel',
+            'PLUGIN_PATHS': ['../'],
+            'PLUGINS': ['rmd_reader'],
+        })
+        pelican = Pelican(settings=settings)
+        pelican.run()
+
+        figure = os.path.join(self.contentdir, self.figpath, 'test-1-1.png')
+        self.assertTrue(os.path.exists(figure), 'figure not created.')
+        os.remove(figure)
+        shutil.rmtree(os.path.join(self.outputdir, self.figpath))
+
+        # restored from the cache, without knitting
+        import rmd_reader.rmd_reader
+        reader = rmd_reader.rmd_reader.RmdReader
+        knit = reader.knit
+        knitted = []
+        def counting_knit(self, filename, md_filename, options):
+            knitted.append(filename)
+            return knit(self, filename, md_filename, options)
+        reader.knit = counting_knit
+        try:
+            pelican = Pelican(settings=settings)
+            pelican.run()
+        finally:
+            reader.knit = knit
+
+        self.assertEqual(knitted, [], 'cached file knitted again.')
+        self.assertTrue(os.path.exists(figure), 'figure not restored.')
+        imagefile = os.path.join(self.outputdir, self.figpath, 'test-1-1.png')
+        self.assertTrue(os.path.exists(imagefile), 'figure not copied.')
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
@@ -10,6 +10,7 @@ manage the series in the template.
 """
 
 from collections import defaultdict
+from itertools import islice
 
 from pelican import signals
 
@@ -17,6 +18,72 @@ from logging import warning
 
 from operator import itemgetter
 
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+
+class SeriesView(Sequence):
+    """
+    Read-only slice of the list of articles of a series
+
+    All the members of a series share the same list, instead of each
+    holding copies of the articles before and after it.
+    """
+
+    def __init__(self, articles, start, stop):
+        self.articles = articles
+        self.start = start
+        self.stop = max(start, stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('series index out of range')
+        return self.articles[self.start + index]
+
+    def __iter__(self):
+        return islice(self.articles, self.start, self.stop)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Sequence, list)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def set_series(article, series_name, ordered_articles, index):
+    article.series = dict()
+    article.series['name'] = series_name
+    article.series['index'] = index + 1
+    article.series['all'] = ordered_articles
+    article.series['all_previous'] = SeriesView(ordered_articles, 0, index)
+    article.series['all_next'] = SeriesView(
+        ordered_articles, index + 1, len(ordered_articles))
+
+    if index > 0:
+        article.series['previous'] = ordered_articles[index - 1]
+    else:
+        article.series['previous'] = None
+
+    try:
+        article.series['next'] = ordered_articles[index + 1]
+    except IndexError:
+        article.series['next'] = None
+
 
 def aggregate_series(generator):
     series = defaultdict(list)
@@ -34,9 +101,6 @@ def aggregate_series(generator):
 
             series[article.metadata['series']].append(article_entry)
 
-    # This uses items() which on Python2 is not a generator
-    # but we are dealing with a small amount of data so
-    # there shouldn't be performance issues =)
     for series_name, series_articles in series.items():
         # This is not DRY but very simple to understand
         forced_order_articles = [
@@ -50,47 +114,17 @@ def aggregate_series(generator):
 
         all_articles = forced_order_articles + date_order_articles
         ordered_articles = [art_tup[2] for art_tup in all_articles]
-        enumerated_articles = enumerate(ordered_articles)
-
-        for index, article in enumerated_articles:
-            article.series = dict()
-            article.series['name'] = series_name
-            article.series['index'] = index + 1
-            article.series['all'] = ordered_articles
-            article.series['all_previous'] = ordered_articles[0: index]
-            article.series['all_next'] = ordered_articles[index + 1:]
-
-            if index > 0:
-                article.series['previous'] = ordered_articles[index - 1]
-            else:
-                article.series['previous'] = None
-
-            try:
-                article.series['next'] = ordered_articles[index + 1]
-            except IndexError:
-                article.series['next'] = None
 
+        # (series, lang) -> translations in series order, built in one pass
+        translations = defaultdict(list)
+        for index, article in enumerate(ordered_articles):
+            set_series(article, series_name, ordered_articles, index)
             for tran in article.translations:
-                lang = tran.lang
-                tran.series = dict()
-                article.series['index'] = index + 1
-                all_trans = [t
-                             for a in ordered_articles
-                             for t in a.translations
-                             if t.lang == tran.lang]
-                tran.series['all'] = all_trans
-                tran.series['all_previous'] = all_trans[0: index]
-                tran.series['all_next'] = all_trans[index + 1:]
-
-                if index > 0:
-                    tran.series['previous'] = all_trans[index - 1]
-                else:
-                    tran.series['previous'] = None
-
-                try:
-                    tran.series['next'] = all_trans[index + 1]
-                except IndexError:
-                    tran.series['next'] = None
+                translations[tran.lang].append(tran)
+
+        for all_trans in translations.values():
+            for index, tran in enumerate(all_trans):
+                set_series(tran, series_name, all_trans, index)
 
 
 def register():
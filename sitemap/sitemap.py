@@ -10,6 +10,8 @@ from __future__ import unicode_literals
 
 import re
 import collections
+import gzip
+import itertools
 import os.path
 
 from datetime import datetime
@@ -45,6 +47,90 @@ XML_FOOTER = """
 </urlset>
 """
 
+XML_INDEX_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+"""
+
+XML_INDEX_SITEMAP = """
+<sitemap>
+<loc>{0}/{1}</loc>
+<lastmod>{2}</lastmod>
+</sitemap>
+"""
+
+XML_INDEX_FOOTER = """
+</sitemapindex>
+"""
+
+# Limits of a single sitemap file, from http://www.sitemaps.org/protocol.html
+MAX_URLS = 50000
+MAX_BYTES = 50 * 1024 * 1024
+
+
+def compile_excludes(patterns):
+    '''Compile the exclude regexes once. They are not joined into a single
+    one, whose inline flags, group numbers and backreferences would differ.'''
+    return [re.compile(p) for p in patterns]
+
+
+class SitemapWriter(object):
+    '''Write URL entries to ``sitemap-N.xml.gz`` files, starting a new file
+    before one would exceed the URL count or size limits of the protocol.'''
+
+    def __init__(self, output_path, compress=True, max_urls=MAX_URLS,
+                 max_bytes=MAX_BYTES):
+        self.output_path = output_path
+        self.compress = compress
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.sitemaps = []
+        self.fd = None
+
+    def open_sitemap(self):
+        name = 'sitemap-{0}.xml'.format(len(self.sitemaps) + 1)
+        if self.compress:
+            name += '.gz'
+            raw = open(os.path.join(self.output_path, name), 'wb')
+            self.fd = gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                                    mtime=0)
+            self.raw = raw
+        else:
+            self.fd = open(os.path.join(self.output_path, name), 'wb')
+            self.raw = None
+        self.sitemaps.append([name, None])
+        self.urls = 0
+        self.size = 0
+        self.write_bytes(XML_HEADER.encode('utf-8'))
+
+    def close_sitemap(self):
+        self.write_bytes(XML_FOOTER.encode('utf-8'))
+        self.fd.close()
+        if self.raw:
+            self.raw.close()
+        self.fd = None
+
+    def write_bytes(self, data):
+        self.fd.write(data)
+        self.size += len(data)
+
+    def write(self, entry, lastmod):
+        data = entry.encode('utf-8')
+        footer = len(XML_FOOTER.encode('utf-8'))
+        if self.fd is not None and (
+                self.urls >= self.max_urls or
+                self.size + len(data) + footer > self.max_bytes):
+            self.close_sitemap()
+        if self.fd is None:
+            self.open_sitemap()
+        self.write_bytes(data)
+        self.urls += 1
+        if self.sitemaps[-1][1] is None or lastmod > self.sitemaps[-1][1]:
+            self.sitemaps[-1][1] = lastmod
+
+    def close(self):
+        if self.fd is not None:
+            self.close_sitemap()
+
 
 def format_date(date):
     if date.tzinfo:
@@ -83,6 +169,8 @@ class SitemapGenerator(object):
         }
 
         self.sitemapExclude = []
+        self.index = False
+        self.compress = True
 
         config = settings.get('SITEMAP', {})
 
@@ -93,6 +181,8 @@ class SitemapGenerator(object):
             pris = config.get('priorities')
             chfreqs = config.get('changefreqs')
             self.sitemapExclude = config.get('exclude', [])
+            self.index = config.get('index', False)
+            self.compress = config.get('gzip', True)
 
             if fmt not in ('xml', 'txt'):
                 warning("sitemap plugin: SITEMAP['format'] must be `txt' or `xml'")
@@ -133,7 +223,22 @@ class SitemapGenerator(object):
                 warning("sitemap plugin: SITEMAP['changefreqs'] must be a dict")
                 warning("sitemap plugin: using the default values")
 
+        self.exclude = compile_excludes(self.sitemapExclude)
+        self.written_files = None
+
     def write_url(self, page, fd):
+        url = self.format_url(page)
+        if url:
+            fd.write(url[0])
+
+    def page_exists(self, save_as):
+        page_path = os.path.abspath(os.path.join(self.output_path, save_as))
+        if self.written_files and page_path in self.written_files:
+            return True
+        return os.path.exists(page_path)
+
+    def format_url(self, page):
+        '''Return the sitemap entry of page with its lastmod, or None.'''
 
         if getattr(page, 'status', 'published') != 'published':
             return
@@ -145,8 +250,7 @@ class SitemapGenerator(object):
         if not page.save_as:
             return
 
-        page_path = os.path.join(self.output_path, page.save_as)
-        if not os.path.exists(page_path):
+        if not self.page_exists(page.save_as):
             return
 
         lastdate = getattr(page, 'date', self.now)
@@ -171,15 +275,11 @@ class SitemapGenerator(object):
 
         #Exclude URLs from the sitemap:
         if self.format == 'xml':
-            flag = False
-            for regstr in self.sitemapExclude:
-                if re.match(regstr, pageurl):
-                    flag = True
-                    break
-            if not flag:
-                fd.write(XML_URL.format(self.siteurl, pageurl, lastmod, chfreq, pri))
+            if any(p.match(pageurl) for p in self.exclude):
+                return
+            return XML_URL.format(self.siteurl, pageurl, lastmod, chfreq, pri), lastmod
         else:
-            fd.write(self.siteurl + '/' + pageurl + '\n')
+            return self.siteurl + '/' + pageurl + '\n', lastmod
 
     def get_date_modified(self, page, default):
         if hasattr(page, 'modified'):
@@ -202,21 +302,80 @@ class SitemapGenerator(object):
                     pass
             setattr(wrapper, 'modified', str(lastmod))
 
-    def generate_output(self, writer):
-        path = os.path.join(self.output_path, 'sitemap.{0}'.format(self.format))
+    def iter_pages(self):
+        '''Yield every page of the sitemap, without building a list.'''
+        FakePage = collections.namedtuple('FakePage',
+                                          ['status',
+                                           'date',
+                                           'url',
+                                           'save_as'])
+
+        for standard_page_url in ['index.html',
+                                  'archives.html',
+                                  'tags.html',
+                                  'categories.html']:
+            yield FakePage(status='published',
+                           date=self.now,
+                           url=standard_page_url,
+                           save_as=standard_page_url)
+
+        # add template pages
+        # We use items for Py3k compat. .iteritems() otherwise
+        for path, template_page_url in self.context['TEMPLATE_PAGES'].items():
+
+            # don't add duplicate entry for index page
+            if template_page_url == 'index.html':
+                continue
+
+            yield FakePage(status='published',
+                           date=self.now,
+                           url=template_page_url,
+                           save_as=template_page_url)
+
+        for page in itertools.chain(
+                self.context['pages'],
+                self.context['articles'],
+                (c for (c, a) in self.context['categories']),
+                (t for (t, a) in self.context['tags']),
+                (a for (a, b) in self.context['authors'])):
+            yield page
 
-        pages = self.context['pages'] + self.context['articles'] \
-                + [ c for (c, a) in self.context['categories']] \
-                + [ t for (t, a) in self.context['tags']] \
-                + [ a for (a, b) in self.context['authors']]
+        for article in self.context['articles']:
+            for translation in article.translations:
+                yield translation
+
+    def iter_urls(self):
+        for page in self.iter_pages():
+            url = self.format_url(page)
+            if url:
+                yield url
+
+    def count_pages(self):
+        return (4 + len(self.context['TEMPLATE_PAGES']) +
+                len(self.context['pages']) + len(self.context['articles']) +
+                len(self.context['categories']) + len(self.context['tags']) +
+                len(self.context['authors']) +
+                sum(len(a.translations) for a in self.context['articles']))
 
+    def generate_output(self, writer):
         self.set_url_wrappers_modification_date(self.context['categories'])
         self.set_url_wrappers_modification_date(self.context['tags'])
         self.set_url_wrappers_modification_date(self.context['authors'])
 
-        for article in self.context['articles']:
-            pages += article.translations
+        # Files written by the other generators need not be looked up on disk
+        self.written_files = getattr(writer, '_written_files', None)
+
+        if self.format == 'xml' and not self.index and \
+                self.count_pages() > MAX_URLS:
+            info('sitemap plugin: more than {0} URLs, writing a sitemap '
+                 'index'.format(MAX_URLS))
+            self.index = True
 
+        if self.format == 'xml' and self.index:
+            self.write_index()
+            return
+
+        path = os.path.join(self.output_path, 'sitemap.{0}'.format(self.format))
         info('writing {0}'.format(path))
 
         with open(path, 'w', encoding='utf-8') as fd:
@@ -226,42 +385,27 @@ class SitemapGenerator(object):
             else:
                 fd.write(TXT_HEADER.format(self.siteurl))
 
-            FakePage = collections.namedtuple('FakePage',
-                                              ['status',
-                                               'date',
-                                               'url',
-                                               'save_as'])
-
-            for standard_page_url in ['index.html',
-                                      'archives.html',
-                                      'tags.html',
-                                      'categories.html']:
-                fake = FakePage(status='published',
-                                date=self.now,
-                                url=standard_page_url,
-                                save_as=standard_page_url)
-                self.write_url(fake, fd)
-
-            # add template pages
-            # We use items for Py3k compat. .iteritems() otherwise
-            for path, template_page_url in self.context['TEMPLATE_PAGES'].items():
-
-                # don't add duplicate entry for index page
-                if template_page_url == 'index.html':
-                    continue
-
-                fake = FakePage(status='published',
-                                date=self.now,
-                                url=template_page_url,
-                                save_as=template_page_url)
-                self.write_url(fake, fd)
-
-            for page in pages:
-                self.write_url(page, fd)
+            for url, lastmod in self.iter_urls():
+                fd.write(url)
 
             if self.format == 'xml':
                 fd.write(XML_FOOTER)
 
+    def write_index(self):
+        path = os.path.join(self.output_path, 'sitemap_index.xml')
+        info('writing {0}'.format(path))
+
+        sitemaps = SitemapWriter(self.output_path, self.compress)
+        for url, lastmod in self.iter_urls():
+            sitemaps.write(url, lastmod)
+        sitemaps.close()
+
+        with open(path, 'w', encoding='utf-8') as fd:
+            fd.write(XML_INDEX_HEADER)
+            for name, lastmod in sitemaps.sitemaps:
+                fd.write(XML_INDEX_SITEMAP.format(self.siteurl, name, lastmod))
+            fd.write(XML_INDEX_FOOTER)
+
 
 def get_generators(generators):
     return SitemapGenerator
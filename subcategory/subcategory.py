@@ -43,6 +43,59 @@ class SubCategory(URLWrapper):
     def _key(self):
         return self.fullurl
 
+class SubCategoryTree(object):
+    """Subcategories indexed by full name
+
+    Nodes are added as article metadata is read, and articles once the
+    articles are final. Every node then has ``articles``, its articles and
+    those of its descendants, newest first, ``count`` and ``children``, the
+    subcategories below it that have articles (drafts have no pages).
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.nodes = {}
+        self.children = defaultdict(list)
+
+    def add_path(self, category, names):
+        """Nodes of the subcategories names of category, created as needed"""
+        parent = category
+        path = []
+        for name in names:
+            node = self.nodes.get(name)
+            if node is None:
+                node = SubCategory(name, parent, self.settings)
+                node.articles = []
+                node.count = 0
+                node.children = self.children[name]
+                self.nodes[name] = node
+            path.append(node)
+            parent = node
+        return path
+
+    def add_articles(self, articles):
+        """Attach articles to their subcategories
+
+        :returns: list of (subcategory, articles) in order of first use
+        """
+        used = []
+        for article in articles:
+            path = self.add_path(article.category, article.subcategories)
+            for node in path:
+                if not node.articles:
+                    used.append((node, node.articles))
+                    self.children[node.parent.name].append(node)
+                node.articles.append(article)
+            article.subcategories = path
+        for node, node_articles in used:
+            node_articles.sort(key=attrgetter('date'), reverse=True)
+            node.count = len(node_articles)
+        return used
+
+def get_subcategory_tree(generator):
+    if getattr(generator, 'subcategory_tree', None) is None:
+        generator.subcategory_tree = SubCategoryTree(generator.settings)
+    return generator.subcategory_tree
+
 def get_subcategories(generator, metadata):
     if 'SUBCATEGORY_SAVE_AS' not in generator.settings:
         generator.settings['SUBCATEGORY_SAVE_AS'] = os.path.join( 
@@ -67,34 +120,20 @@ def get_subcategories(generator, metadata):
         sub_list.append(subcategory)
         parent = subcategory
     metadata['subcategories'] = sub_list
+    get_subcategory_tree(generator).add_path(category, sub_list)
 
 def create_subcategories(generator):
-    generator.subcategories = []
-    for article in generator.articles:
-        parent = article.category
-        actual_subcategories = []
-        for subcategory in article.subcategories:
-            #following line returns a list of items, tuples in this case
-            sub_cat = [item for item in generator.subcategories 
-                    if item[0].name == subcategory]
-            if sub_cat:
-                sub_cat[0][1].append(article)
-                parent = sub_cat[0][0]
-                actual_subcategories.append(parent)
-            else:
-                new_sub = SubCategory(subcategory, parent, generator.settings)
-                generator.subcategories.append((new_sub, [article,]))
-                parent = new_sub
-                actual_subcategories.append(parent)
-        article.subcategories = actual_subcategories
+    tree = get_subcategory_tree(generator)
+    generator.subcategories = tree.add_articles(generator.articles)
+    generator.context['subcategory_tree'] = tree
 
 def generate_subcategories(generator, writer):
     write = partial(writer.write_file,
             relative_urls=generator.settings['RELATIVE_URLS'])
     subcategory_template = generator.get_template('subcategory')
     for subcat, articles in generator.subcategories:
-        articles.sort(key=attrgetter('date'), reverse=True)
-        dates = [article for article in generator.dates if article in articles]
+        members = set(articles)
+        dates = [article for article in generator.dates if article in members]
         write(subcat.save_as, subcategory_template, generator.context, 
                 subcategory=subcat, articles=articles, dates=dates, 
                 paginated={'articles': articles, 'dates': dates},
@@ -102,7 +141,6 @@ def generate_subcategories(generator, writer):
 
 def generate_subcategory_feeds(generator, writer):
     for subcat, articles in generator.subcategories:
-        articles.sort(key=attrgetter('date'), reverse=True)
         if generator.settings.get('SUBCATEGORY_FEED_ATOM'):
             writer.write_feed(articles, generator.context,
                     generator.settings['SUBCATEGORY_FEED_ATOM']
@@ -11,18 +11,88 @@ Copyright (c) Talha Mansoor
 
 from __future__ import unicode_literals
 
+import hashlib
 import os.path
 import json
+import re
 from bs4 import BeautifulSoup
 from codecs import open
 try:
     from urlparse import urljoin
 except ImportError:
     from urllib.parse import urljoin
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+try:
+    from html import unescape
+except ImportError:
+    unescape = HTMLParser().unescape
 
 from pelican import signals
 
 
+CACHE_VERSION = 1
+TERM_REGEX = re.compile(r'\w+', re.UNICODE)
+
+
+class TextExtractor(HTMLParser):
+    """Collects the text of an HTML fragment without building a tree.
+
+    Text inside ``script`` and ``style`` elements is skipped, as
+    BeautifulSoup's ``get_text`` does.
+    """
+
+    skipped_tags = ('script', 'style')
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.chunks = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self.skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.chunks.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(unescape('&%s;' % name))
+
+    def handle_charref(self, name):
+        self.handle_data(unescape('&#%s;' % name))
+
+
+def extract_text(html, parser='fast'):
+    """Return the whitespace-normalized text of an HTML fragment."""
+    if parser == 'bs4':
+        text = BeautifulSoup(html, 'html.parser').get_text(' ', strip=True)
+    else:
+        extractor = TextExtractor()
+        extractor.feed(html)
+        extractor.close()
+        text = ' '.join(extractor.chunks)
+    return ' '.join(text.split())
+
+
+def shard_name(key):
+    """File name of the shard for key, readable when key is plain ASCII.
+
+    Other keys are spelled as the code points of their characters, after a
+    ``u-`` no plain key can start with.
+    """
+    if re.match(r'^[a-z0-9_]+$', key):
+        return key + '.json'
+    return 'u-' + '-'.join('%x' % ord(c) for c in key) + '.json'
+
+
 class Tipue_Search_JSON_Generator(object):
 
     def __init__(self, context, settings, path, theme, output_path, *null):
@@ -33,6 +103,46 @@ class Tipue_Search_JSON_Generator(object):
         self.tpages = settings.get('TEMPLATE_PAGES')
         self.output_path = output_path
         self.json_nodes = []
+        self.parser = settings.get('TIPUE_SEARCH_PARSER', 'fast')
+        self.shards = settings.get('TIPUE_SEARCH_SHARDS', None)
+        self.prefix_length = settings.get('TIPUE_SEARCH_PREFIX_LENGTH', 2)
+        self.cache_path = None
+        self.text_cache = {}
+        self.used_cache = {}
+        if settings.get('TIPUE_SEARCH_CACHE', True) and settings.get('CACHE_PATH'):
+            self.cache_path = os.path.join(settings['CACHE_PATH'], 'tipue_search.json')
+            self.load_cache()
+
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as fd:
+                data = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == CACHE_VERSION and data.get('parser') == self.parser:
+            self.text_cache = data.get('texts', {})
+
+
+    def save_cache(self):
+        directory = os.path.dirname(self.cache_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.cache_path + '.tmp', 'w', encoding='utf-8') as fd:
+            json.dump({'version': CACHE_VERSION, 'parser': self.parser,
+                       'texts': self.used_cache}, fd, ensure_ascii=False)
+        os.rename(self.cache_path + '.tmp', self.cache_path)
+
+
+    def page_text(self, content):
+        """Text of a page's HTML, reused from the cache while it is unchanged."""
+        key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        text = self.text_cache.get(key)
+        if text is None:
+            text = extract_text(content, self.parser).replace('“', '"').replace('”', '"').replace('’', "'").replace('¶', ' ').replace('^', '&#94;')
+            text = ' '.join(text.split())
+        self.used_cache[key] = text
+        return text
 
 
     def create_json_node(self, page):
@@ -40,12 +150,9 @@ class Tipue_Search_JSON_Generator(object):
         if getattr(page, 'status', 'published') != 'published':
             return
 
-        soup_title = BeautifulSoup(page.title.replace('&nbsp;', ' '), 'html.parser')
-        page_title = soup_title.get_text(' ', strip=True).replace('“', '"').replace('”', '"').replace('’', "'").replace('^', '&#94;')
+        page_title = extract_text(page.title.replace('&nbsp;', ' '), self.parser).replace('“', '"').replace('”', '"').replace('’', "'").replace('^', '&#94;')
 
-        soup_text = BeautifulSoup(page.content, 'html.parser')
-        page_text = soup_text.get_text(' ', strip=True).replace('“', '"').replace('”', '"').replace('’', "'").replace('¶', ' ').replace('^', '&#94;')
-        page_text = ' '.join(page_text.split())
+        page_text = self.page_text(page.content)
 
         if getattr(page, 'category', 'None') == 'None':
             page_category = ''
@@ -87,6 +194,58 @@ class Tipue_Search_JSON_Generator(object):
         self.json_nodes.append(node)
 
 
+    def write_json(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w', encoding='utf-8') as fd:
+            json.dump(data, fd, separators=(',', ':'), ensure_ascii=False)
+
+
+    def section_shards(self):
+        """One Tipue JSON file per category, pages without one under '_'."""
+        shards = {}
+        for node in self.json_nodes:
+            key = node['tags'] or '_'
+            shards.setdefault(key, []).append(node)
+        return dict((key, {'pages': nodes}) for key, nodes in shards.items())
+
+
+    def prefix_shards(self):
+        """Term -> document ids, one file per term prefix.
+
+        Documents themselves, without their text, go to the 'documents' file.
+        """
+        shards = {}
+        for doc_id, node in enumerate(self.json_nodes):
+            terms = set(TERM_REGEX.findall((node['title'] + ' ' + node['text']).lower()))
+            for term in terms:
+                postings = shards.setdefault(term[:self.prefix_length], {})
+                postings.setdefault(term, []).append(doc_id)
+        shards = dict((key, {'terms': terms}) for key, terms in shards.items())
+        documents = [{'title': node['title'], 'tags': node['tags'], 'url': node['url']}
+                     for node in self.json_nodes]
+        return shards, documents
+
+
+    def write_shards(self):
+        """Write the sharded index and a manifest listing the shard files."""
+        shard_dir = os.path.join(self.output_path, 'tipuesearch')
+        manifest = {'mode': self.shards, 'pages': len(self.json_nodes), 'shards': {}}
+        if self.shards == 'section':
+            shards = self.section_shards()
+        else:
+            shards, documents = self.prefix_shards()
+            manifest['prefix_length'] = self.prefix_length
+            manifest['documents'] = 'tipuesearch/documents.json'
+            self.write_json(os.path.join(shard_dir, 'documents.json'), documents)
+        for key, shard in shards.items():
+            name = shard_name(key)
+            manifest['shards'][key] = 'tipuesearch/' + name
+            self.write_json(os.path.join(shard_dir, name), shard)
+        self.write_json(os.path.join(self.output_path, 'tipuesearch_manifest.json'), manifest)
+
+
     def generate_output(self, writer):
         path = os.path.join(self.output_path, 'tipuesearch_content.json')
 
@@ -100,10 +259,16 @@ class Tipue_Search_JSON_Generator(object):
 
         for page in pages:
             self.create_json_node(page)
-        root_node = {'pages': self.json_nodes}
 
-        with open(path, 'w', encoding='utf-8') as fd:
-            json.dump(root_node, fd, separators=(',', ':'), ensure_ascii=False)
+        if self.cache_path:
+            self.save_cache()
+
+        if self.shards in ('section', 'prefix'):
+            self.write_shards()
+            return
+
+        root_node = {'pages': self.json_nodes}
+        self.write_json(path, root_node)
 
 
 def get_generators(generators):
@@ -1,36 +1,163 @@
+import hashlib
+import io
+import os
 import subprocess
+from multiprocessing.pool import ThreadPool
 from pelican import signals
 from pelican.readers import BaseReader
 from pelican.utils import pelican_open
 
+T2T_CMD = [r"txt2tags", r"--encoding=utf-8", r"--target=html", r"--infile=-", r"--outfile=-"]
+
+CACHE_VERSION = 1
+
+
+def split_source(filename):
+    """The metadata lines, as (name, value) pairs, and the txt2tags body"""
+    with pelican_open(filename) as fp:
+        text = list(fp.splitlines())
+
+    metadata = []
+    content = ""
+    for i, line in enumerate(text):
+        kv = line.split(':', 1)
+        if len(kv) == 2:
+            metadata.append((kv[0].lower(), kv[1].strip()))
+        else:
+            content = "\n".join(text[i:])
+            break
+    return metadata, content
+
+
+def run_txt2tags(content):
+    proc = subprocess.Popen(T2T_CMD,
+                            stdin = subprocess.PIPE,
+                            stdout = subprocess.PIPE)
+
+    output = proc.communicate(content.encode('utf-8'))[0].decode('utf-8')
+    status = proc.wait()
+    if status:
+        raise subprocess.CalledProcessError(status, T2T_CMD)
+    return output
+
+
+def converter_version():
+    """The version line of txt2tags, part of the cache keys"""
+    try:
+        output = subprocess.check_output([T2T_CMD[0], '--version'])
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return output.decode('utf-8', 'replace').strip()
+
+
+class Txt2tagsConverter(object):
+    """Converts txt2tags bodies to HTML, from the cache or with txt2tags,
+    TXT2TAGS_WORKERS of them at a time as soon as the generators start
+    reading"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.cache_path = None
+        if settings.get('TXT2TAGS_CACHE', True):
+            self.cache_path = os.path.join(settings['CACHE_PATH'],
+                                           'txt2tags_reader')
+        self.version = None
+
+        self.workers = settings.get('TXT2TAGS_WORKERS', 0)
+        self.pool = None
+        self.pending = {}
+
+    def key(self, content):
+        if self.version is None:
+            # the HTML also depends on the converter and on its options
+            self.version = hashlib.sha1(
+                '{0} {1} {2}'.format(CACHE_VERSION, converter_version(),
+                                     ' '.join(T2T_CMD)).encode('utf-8'))
+        digest = self.version.copy()
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
+
+    def cached(self, key):
+        if self.cache_path:
+            try:
+                with io.open(os.path.join(self.cache_path, key + '.html'),
+                             encoding='utf-8', newline='') as f:
+                    return f.read()
+            except (IOError, OSError):
+                pass
+        return None
+
+    def store(self, key, output):
+        if not self.cache_path:
+            return
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        path = os.path.join(self.cache_path, key + '.html')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(output.encode('utf-8'))
+        os.rename(path + '.tmp', path)
+
+    def convert(self, filename, content):
+        key = self.key(content)
+        output = self.cached(key)
+        if output is not None:
+            return output
+        pending = self.pending.pop(filename, None)
+        if pending is not None:
+            output = pending.get()
+        else:
+            output = run_txt2tags(content)
+        self.store(key, output)
+        return output
+
+    def prefetch(self, filenames):
+        """Start converting the files that are not in the cache"""
+        if not filenames:
+            return
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        for filename in filenames:
+            if filename in self.pending:
+                continue
+            content = split_source(filename)[1]
+            if self.cached(self.key(content)) is not None:
+                continue
+            self.pending[filename] = self.pool.apply_async(
+                run_txt2tags, (content,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+
+
+_converter = None
+
+
+def get_converter(settings):
+    global _converter
+    if _converter is not None and _converter.settings is not settings:
+        _converter.close()
+        _converter = None
+    if _converter is None:
+        _converter = Txt2tagsConverter(settings)
+    return _converter
+
+
 class Txt2tagsReader(BaseReader):
     enabled = True
     file_extensions = ['t2t', 'txt2tags']
 
     def read(self, filename):
-        with pelican_open(filename) as fp:
-            text = list(fp.splitlines())
+        lines, content = split_source(filename)
 
         metadata = {}
-        for i, line in enumerate(text):
-            kv = line.split(':', 1)
-            if len(kv) == 2:
-                name, value = kv[0].lower(), kv[1].strip()
-                metadata[name] = self.process_metadata(name, value)
-            else:
-                content = "\n".join(text[i:])
-                break
-
-        t2t_cmd = [r"txt2tags", r"--encoding=utf-8", r"--target=html", r"--infile=-", r"--outfile=-"]
-
-        proc = subprocess.Popen(t2t_cmd,
-                                stdin = subprocess.PIPE,
-                                stdout = subprocess.PIPE)
-
-        output = proc.communicate(content.encode('utf-8'))[0].decode('utf-8')
-        status = proc.wait()
-        if status:
-            raise subprocess.CalledProcessError(status, t2t_cmd)
+        for name, value in lines:
+            metadata[name] = self.process_metadata(name, value)
+
+        output = get_converter(self.settings).convert(filename, content)
 
         return output, metadata
 
@@ -38,5 +165,30 @@ def add_reader(readers):
     for ext in Txt2tagsReader.file_extensions:
         readers.reader_classes[ext] = Txt2tagsReader
 
+def prefetch(generator, paths, excludes):
+    if generator.settings.get('TXT2TAGS_WORKERS', 0) <= 0:
+        return
+    converter = get_converter(generator.settings)
+    files = generator.get_files(generator.settings[paths],
+                                exclude=generator.settings[excludes],
+                                extensions=Txt2tagsReader.file_extensions)
+    converter.prefetch([os.path.abspath(os.path.join(generator.path, f))
+                        for f in files])
+
+def prefetch_articles(generator):
+    prefetch(generator, 'ARTICLE_PATHS', 'ARTICLE_EXCLUDES')
+
+def prefetch_pages(generator):
+    prefetch(generator, 'PAGE_PATHS', 'PAGE_EXCLUDES')
+
+def close_converter(pelican):
+    global _converter
+    if _converter is not None:
+        _converter.close()
+        _converter = None
+
 def register():
     signals.readers_init.connect(add_reader)
+    signals.article_generator_init.connect(prefetch_articles)
+    signals.page_generator_init.connect(prefetch_pages)
+    signals.finalized.connect(close_converter)
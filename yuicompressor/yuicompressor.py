@@ -2,8 +2,14 @@
 
 from pelican import signals
 from subprocess import call
+from multiprocessing.pool import ThreadPool
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import shutil
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -16,19 +22,222 @@ with Yuicompressor from Yahoo
 Required : pip install yuicompressor
 """
 
+EXTENSIONS = ('.css', '.js')
+
+MANIFEST_NAME = 'yuicompressor.json'
+REPORT_NAME = 'yuicompressor_report.json'
+
+
 def minify(pelican):
     """
       Minify CSS and JS with YUI Compressor
       :param pelican: The Pelican instance
     """
-    for dirpath, _, filenames in os.walk(pelican.settings['OUTPUT_PATH']):
+    settings = pelican.settings
+    output_path = settings['OUTPUT_PATH']
+    cache = MinifyCache(settings) if settings.get('YUICOMPRESSOR_CACHE', True) else None
+
+    results = {}
+    pending = {}
+    for dirpath, _, filenames in os.walk(output_path):
         for name in filenames:
-            if os.path.splitext(name)[1] in ('.css','.js'):
+            ext = os.path.splitext(name)[1]
+            if ext in EXTENSIONS:
                 filepath = os.path.join(dirpath, name)
-                logger.info('minifiy %s', filepath)
-                verbose = '-v' if SHOW_OUTPUT else ''
-                call("yuicompressor {} --charset utf-8 {} -o {}".format(
-                    verbose, filepath, filepath), shell=True)
+                result = restore_cached(filepath, cache)
+                if result['status'] == 'pending':
+                    pending.setdefault(ext, []).append(result)
+                else:
+                    results[filepath] = result
+
+    jobs = settings.get('YUICOMPRESSOR_JOBS', 1)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    batch = settings.get('YUICOMPRESSOR_BATCH', True)
+
+    # one YUI Compressor run, and JVM, for each chunk of files of a type
+    chunks = []
+    for ext, files in pending.items():
+        if batch:
+            size = min(jobs, len(files))
+            chunks.extend((ext, files[i::size]) for i in range(size))
+        else:
+            chunks.extend((ext, [f]) for f in files)
+
+    if jobs > 1 and len(chunks) > 1:
+        pool = ThreadPool(jobs)
+        pool.map(lambda chunk: compress_chunk(chunk[0], chunk[1], cache), chunks)
+        pool.close()
+        pool.join()
+    else:
+        for ext, files in chunks:
+            compress_chunk(ext, files, cache)
+
+    for files in pending.values():
+        for result in files:
+            results[result['path']] = result
+
+    report = dict((os.path.relpath(path, output_path), r)
+                  for path, r in results.items())
+    for r in report.values():
+        del r['path']
+    before = sum(r['before'] for r in report.values())
+    after = sum(r['after'] for r in report.values())
+    cached = sum(1 for r in report.values() if r['status'] in ('unchanged', 'restored'))
+    logger.info('yuicompressor: %d files, %d from cache, %d runs, %d bytes '
+                'saved (%.1f%%)', len(report), cached, len(chunks),
+                before - after,
+                100.0 * (before - after) / before if before else 0)
+
+    if cache:
+        cache.save()
+    if settings.get('YUICOMPRESSOR_REPORT', True):
+        write_report(settings['CACHE_PATH'], report)
+
+
+class MinifyCache(object):
+    """
+    Persistent manifest of minified files under CACHE_PATH
+
+    Maps the hash of every original to the hash of its minified version,
+    a copy of which is kept to restore it when the original is copied to
+    the output again.
+    """
+
+    def __init__(self, settings):
+        self.path = os.path.join(settings['CACHE_PATH'], 'yuicompressor')
+        self.manifest_path = os.path.join(settings['CACHE_PATH'], MANIFEST_NAME)
+        self.entries = {}
+        self.used = {}
+        try:
+            with open(self.manifest_path) as fd:
+                self.entries = json.load(fd)
+        except (IOError, OSError, ValueError):
+            pass
+        self.originals = {}
+        for original, minified in self.entries.items():
+            self.originals.setdefault(minified, []).append(original)
+        # created here, before the files are minified in parallel
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def lookup(self, digest):
+        """Return 'minified' or the cached copy for digest, or None."""
+        if digest in self.originals:
+            for original in self.originals[digest]:
+                self.used[original] = digest
+            return 'minified'
+        if digest in self.entries:
+            copy = self.blob(digest)
+            if os.path.exists(copy):
+                self.used[digest] = self.entries[digest]
+                return copy
+        return None
+
+    def blob(self, digest):
+        return os.path.join(self.path, digest)
+
+    def store(self, digest, filepath):
+        minified = file_hash(filepath)
+        shutil.copyfile(filepath, self.blob(digest))
+        self.used[digest] = minified
+
+    def save(self):
+        for name in os.listdir(self.path):
+            if name not in self.used:
+                os.remove(os.path.join(self.path, name))
+        with open(self.manifest_path + '.tmp', 'w') as fd:
+            json.dump(self.used, fd)
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+
+def write_report(cache_path, report):
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    with open(os.path.join(cache_path, REPORT_NAME), 'w') as fd:
+        json.dump(report, fd, indent=1, sort_keys=True)
+
+
+def file_hash(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as fd:
+        for block in iter(lambda: fd.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def restore_cached(filepath, cache):
+    """
+    Restore a file from the cache when it knows its minified version.
+
+    :returns: dict with the path, status, sizes before and after, the
+        seconds spent and the hash of the original
+    """
+    started = time.time()
+    result = {'path': filepath, 'status': 'pending',
+              'before': os.path.getsize(filepath), 'digest': None}
+    if cache:
+        result['digest'] = file_hash(filepath)
+        found = cache.lookup(result['digest'])
+        if found == 'minified':
+            result['status'] = 'unchanged'
+        elif found:
+            shutil.copyfile(found, filepath)
+            result['status'] = 'restored'
+    if result['status'] != 'pending':
+        finish(result, started)
+    return result
+
+
+def finish(result, started):
+    result['after'] = os.path.getsize(result['path'])
+    result['saved'] = result['before'] - result['after']
+    result['seconds'] = time.time() - started
+    logger.debug('yuicompressor: %s %s, %d -> %d bytes in %.3fs',
+                 result['status'], result['path'], result['before'],
+                 result['after'], result['seconds'])
+    del result['digest']
+
+
+def compress_chunk(ext, files, cache):
+    """
+    Minify files of type ext in place, with a single YUI Compressor run.
+
+    A run stops at the first file it cannot minify, so when it fails its
+    files are minified again one by one to find out the wrong ones.
+    """
+    started = time.time()
+    ok = compress(ext, [f['path'] for f in files])
+    if not ok and len(files) > 1:
+        for f in files:
+            compress_chunk(ext, [f], cache)
+        return
+    for f in files:
+        f['status'] = 'minified' if ok else 'failed'
+        if not ok:
+            logger.error('yuicompressor: could not minify %s', f['path'])
+        elif cache:
+            cache.store(f['digest'], f['path'])
+        finish(f, started)
+
+
+def compress(ext, filepaths):
+    """Run YUI Compressor on filepaths, returns whether it succeeded"""
+    for filepath in filepaths:
+        logger.info('minifiy %s', filepath)
+    cmd = ['yuicompressor', '--type', ext[1:], '--charset', 'utf-8']
+    if SHOW_OUTPUT:
+        cmd.append('-v')
+    if len(filepaths) == 1:
+        cmd.extend(['-o', filepaths[0]])
+    else:
+        # the output of each file replaces it
+        cmd.extend(['-o', '{0}$:{0}'.format(ext)])
+    try:
+        return call(cmd + filepaths) == 0
+    except OSError as e:
+        logger.error('yuicompressor: could not run %s: %s', cmd[0], e)
+        return False
 
 def register():
     signals.finalized.connect(minify)